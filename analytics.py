@@ -0,0 +1,277 @@
+"""
+Fleet energy and runtime analytics.
+
+Runtime totals are pre-aggregated into one RoomDailyUsage row per room and
+day, computed from the state interval table. Today's rows are refreshed every
+few minutes and the previous day is finalized by a nightly job, so
+/api/analytics only sums a few rows per room and day, whatever the size of
+the event history.
+"""
+import os
+import logging
+from datetime import datetime, date, timedelta
+
+from flask import request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import func, or_
+from app import app, db
+from models import RoomDailyUsage, StateInterval, ACSettings, User
+from state_intervals import total_seconds, intersect
+
+logger = logging.getLogger("analytics")
+
+# Power draw of a running AC unit when its room has no rating of its own
+DEFAULT_POWER_RATING_KW = float(os.environ.get('AC_POWER_RATING_KW', '1.0'))
+
+# Longest range /api/analytics answers in one request
+MAX_RANGE_DAYS = 366
+
+GROUP_BY_OPTIONS = ('room', 'floor', 'day', 'room_day', 'floor_day', 'fleet')
+
+# Days back the nightly job checks for missing aggregates
+BACKFILL_DAYS = 31
+
+
+def floor_of(room_number):
+    """Floor of a room, from its number (e.g. '204' -> '2', '1203' -> '12')"""
+    if room_number and room_number.isdigit() and len(room_number) >= 3:
+        return room_number[:-2]
+    return ''
+
+
+def power_rating_kw(settings):
+    """Power rating used for a room's energy estimate"""
+    if settings and settings.power_rating_kw:
+        return settings.power_rating_kw
+    return DEFAULT_POWER_RATING_KW
+
+
+def refresh_daily_usage(day, rooms=None):
+    """
+    Recompute the usage rows of one day from the state intervals
+
+    Args:
+        day (date): UTC day to aggregate
+        rooms (list, optional): Rooms to refresh (default: every room)
+
+    Returns:
+        int: Number of rows written
+    """
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    now = datetime.utcnow()
+
+    if rooms is None:
+        rooms = [room for (room,) in db.session.query(User.room_number).filter(User.room_number.isnot(None))]
+    if not rooms:
+        return 0
+
+    # All intervals overlapping the day, for every room, in one range scan
+    intervals = db.session.query(
+        StateInterval.room_number, StateInterval.kind, StateInterval.start, StateInterval.end
+    ).filter(
+        StateInterval.room_number.in_(rooms),
+        StateInterval.start < end,
+        or_(StateInterval.end.is_(None), StateInterval.end > start)
+    ).order_by(StateInterval.start).all()
+
+    clipped = {}
+    for room_number, kind, interval_start, interval_end in intervals:
+        clipped_start = max(interval_start, start)
+        clipped_end = min(interval_end or now, end)
+        if clipped_end > clipped_start:
+            clipped.setdefault((room_number, kind), []).append((clipped_start, clipped_end))
+
+    settings_by_room = {
+        settings.room_number: settings
+        for settings in ACSettings.query.filter(ACSettings.room_number.in_(rooms))
+    }
+    existing = {
+        usage.room_number: usage
+        for usage in RoomDailyUsage.query.filter(RoomDailyUsage.day == day, RoomDailyUsage.room_number.in_(rooms))
+    }
+
+    for room_number in rooms:
+        ac_on = clipped.get((room_number, 'ac_on'), [])
+        window_open = clipped.get((room_number, 'window_open'), [])
+
+        usage = existing.get(room_number)
+        if not usage:
+            usage = RoomDailyUsage()
+            usage.room_number = room_number
+            usage.day = day
+            db.session.add(usage)
+
+        usage.floor = floor_of(room_number)
+        usage.ac_on_seconds = total_seconds(ac_on)
+        usage.window_open_seconds = total_seconds(window_open)
+        usage.window_open_ac_on_seconds = total_seconds(intersect(ac_on, window_open))
+        usage.energy_kwh = usage.ac_on_seconds / 3600 * power_rating_kw(settings_by_room.get(room_number))
+        usage.updated_at = now
+
+    db.session.commit()
+    return len(rooms)
+
+
+def refresh_todays_usage():
+    """Keep today's aggregates current (scheduled job)"""
+    with app.app_context():
+        try:
+            refresh_daily_usage(datetime.utcnow().date())
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error refreshing today's usage: {e}")
+
+
+def finalize_daily_usage():
+    """Finalize yesterday and fill in any missing recent days (nightly job)"""
+    with app.app_context():
+        today = datetime.utcnow().date()
+        try:
+            refresh_daily_usage(today - timedelta(days=1))
+
+            # Days with no rows at all were never aggregated (new install, downtime)
+            first_day = today - timedelta(days=BACKFILL_DAYS)
+            have_rows = {
+                day for (day,) in db.session.query(RoomDailyUsage.day).filter(
+                    RoomDailyUsage.day >= first_day
+                ).distinct()
+            }
+            for offset in range(BACKFILL_DAYS, 1, -1):
+                day = today - timedelta(days=offset)
+                if day not in have_rows:
+                    refresh_daily_usage(day)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error finalizing daily usage: {e}")
+
+
+def parse_day(value, default):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else default
+
+
+@app.route('/api/analytics')
+@login_required
+def get_analytics():
+    """
+    Fleet runtime and energy totals from the daily aggregates.
+
+    Query parameters:
+        from:     first day, YYYY-MM-DD (default: 6 days before `to`)
+        to:       last day, YYYY-MM-DD (default: today, UTC)
+        group_by: room, floor, day, room_day, floor_day or fleet (default room)
+        rooms:    comma-separated room numbers to include
+        floor:    only include rooms on this floor
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    try:
+        last_day = parse_day(request.args.get('to'), datetime.utcnow().date())
+        first_day = parse_day(request.args.get('from'), last_day - timedelta(days=6))
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    if first_day > last_day:
+        return jsonify({'error': '"from" must not be after "to"'}), 400
+    if (last_day - first_day).days >= MAX_RANGE_DAYS:
+        return jsonify({'error': f'Range is limited to {MAX_RANGE_DAYS} days'}), 400
+
+    group_by = request.args.get('group_by', 'room')
+    if group_by not in GROUP_BY_OPTIONS:
+        return jsonify({'error': f'group_by must be one of {", ".join(GROUP_BY_OPTIONS)}'}), 400
+
+    group_columns = {
+        'room': [RoomDailyUsage.room_number],
+        'floor': [RoomDailyUsage.floor],
+        'day': [RoomDailyUsage.day],
+        'room_day': [RoomDailyUsage.room_number, RoomDailyUsage.day],
+        'floor_day': [RoomDailyUsage.floor, RoomDailyUsage.day],
+        'fleet': []
+    }[group_by]
+
+    query = db.session.query(
+        *group_columns,
+        func.sum(RoomDailyUsage.ac_on_seconds),
+        func.sum(RoomDailyUsage.window_open_ac_on_seconds),
+        func.sum(RoomDailyUsage.energy_kwh),
+        func.count(func.distinct(RoomDailyUsage.room_number))
+    ).filter(
+        RoomDailyUsage.day >= first_day,
+        RoomDailyUsage.day <= last_day
+    )
+
+    rooms_filter = request.args.get('rooms', '')
+    rooms = [room.strip() for room in rooms_filter.split(',') if room.strip()]
+    if rooms:
+        query = query.filter(RoomDailyUsage.room_number.in_(rooms))
+    if request.args.get('floor'):
+        query = query.filter(RoomDailyUsage.floor == request.args.get('floor'))
+
+    if group_columns:
+        query = query.group_by(*group_columns).order_by(*group_columns)
+
+    results = []
+    for row in query.all():
+        keys = row[:len(group_columns)]
+        ac_on_seconds, window_open_ac_on_seconds, energy_kwh, room_count = row[len(group_columns):]
+        entry = {}
+        for column, value in zip(group_columns, keys):
+            entry[column.key] = value.isoformat() if isinstance(value, date) else value
+        entry.update({
+            'rooms': room_count,
+            'ac_runtime_hours': round((ac_on_seconds or 0) / 3600, 2),
+            'window_open_cooling_hours': round((window_open_ac_on_seconds or 0) / 3600, 2),
+            'energy_kwh': round(energy_kwh or 0, 2)
+        })
+        results.append(entry)
+
+    return jsonify({
+        'from': first_day.isoformat(),
+        'to': last_day.isoformat(),
+        'group_by': group_by,
+        'default_power_rating_kw': DEFAULT_POWER_RATING_KW,
+        'results': results
+    })
+
+
+@app.route('/api/analytics/power_rating', methods=['POST'])
+@login_required
+def set_power_rating():
+    """
+    Set the power rating used for energy estimates.
+
+    JSON body:
+        power_rating_kw: rating in kW (null to use the fleet default)
+        rooms:           room numbers to update (default: every room)
+
+    Today's aggregates are recomputed with the new rating; finalized days keep
+    the rating they were computed with.
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or {}
+    rating = data.get('power_rating_kw')
+    if rating is not None:
+        try:
+            rating = float(rating)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'power_rating_kw must be a number'}), 400
+        if not 0 < rating <= 20:
+            return jsonify({'error': 'power_rating_kw must be between 0 and 20'}), 400
+
+    query = ACSettings.query
+    if data.get('rooms'):
+        query = query.filter(ACSettings.room_number.in_(data['rooms']))
+
+    updated = []
+    for settings in query.all():
+        settings.power_rating_kw = rating
+        updated.append(settings.room_number)
+    db.session.commit()
+
+    refresh_daily_usage(datetime.utcnow().date(), rooms=updated)
+    app.logger.info(f"Power rating set to {rating} kW for {len(updated)} rooms by {current_user.username}")
+
+    return jsonify({'success': True, 'rooms': updated, 'power_rating_kw': rating})
@@ -0,0 +1,175 @@
+"""
+Streaming anomaly detection for room sensors.
+
+Every ingested report updates a small fixed-size state per room:
+
+- stuck_sensor: an exponentially weighted mean and variance of the reported
+  temperature (Welford-style update). A real room drifts by at least a few
+  hundredths of a degree; a sensor whose readings have not varied for
+  STUCK_AFTER is flagged.
+- window_flapping: an exponentially decaying count of window open/close
+  changes. A window that toggles more than FLAP_THRESHOLD times within about
+  FLAP_WINDOW_SECONDS is flagged, and cleared once it calms down.
+
+Memory is O(1) per room and nothing is read from the database. Flags are only
+written to RoomStatus when they change. When the global policy enables it,
+flapping rooms are quarantined: their window changes no longer create pending
+shutoff events, which stops the PendingWindowEvent storm.
+"""
+import math
+import threading
+from datetime import datetime, timedelta
+
+# Weight of each new reading in the running mean/variance
+TEMPERATURE_ALPHA = 0.05
+
+# Readings that have not varied for this long mean a stuck sensor
+STUCK_AFTER = timedelta(hours=6)
+
+# Standard deviation (°C) below which readings count as "not varying"
+STUCK_STDDEV = 0.01
+
+# Window changes within roughly this many seconds are counted together
+FLAP_WINDOW_SECONDS = 60.0
+
+# Decayed toggle count that raises / clears the flapping flag
+FLAP_THRESHOLD = 6.0
+FLAP_CLEAR = 2.0
+
+STUCK_SENSOR = 'stuck_sensor'
+WINDOW_FLAPPING = 'window_flapping'
+
+
+class RoomSensorState:
+    """Running statistics for one room"""
+
+    __slots__ = ('mean', 'variance', 'samples', 'steady_since',
+                 'window_state', 'toggle_rate', 'last_toggle', 'flapping')
+
+    def __init__(self):
+        self.mean = None
+        self.variance = 0.0
+        self.samples = 0
+        self.steady_since = None  # When readings last stopped varying
+        self.window_state = None
+        self.toggle_rate = 0.0  # Decayed number of recent window changes
+        self.last_toggle = None
+        self.flapping = False
+
+    def observe_temperature(self, temperature, at):
+        """Update the running mean/variance and return whether the sensor looks stuck"""
+        self.samples += 1
+        if self.mean is None:
+            self.mean = temperature
+            self.steady_since = at
+            return False
+
+        # Exponentially weighted Welford update
+        delta = temperature - self.mean
+        self.mean += TEMPERATURE_ALPHA * delta
+        self.variance = (1 - TEMPERATURE_ALPHA) * (self.variance + TEMPERATURE_ALPHA * delta * delta)
+
+        if math.sqrt(self.variance) >= STUCK_STDDEV or abs(delta) >= STUCK_STDDEV:
+            self.steady_since = at
+            return False
+
+        return at - self.steady_since >= STUCK_AFTER
+
+    def observe_window(self, window_state, at):
+        """Update the toggle rate and return whether the window is flapping"""
+        if self.last_toggle is not None:
+            elapsed = max(0.0, (at - self.last_toggle).total_seconds())
+            decayed = self.toggle_rate * math.exp(-elapsed / FLAP_WINDOW_SECONDS)
+        else:
+            decayed = 0.0
+
+        if self.window_state is not None and window_state != self.window_state:
+            self.toggle_rate = decayed + 1.0
+            self.last_toggle = at
+        elif self.last_toggle is not None:
+            # No change - only let the rate decay
+            self.toggle_rate = decayed
+            self.last_toggle = at
+        self.window_state = window_state
+
+        # Hysteresis so a room on the edge does not flap in and out of the flag
+        if self.toggle_rate >= FLAP_THRESHOLD:
+            self.flapping = True
+        elif self.toggle_rate <= FLAP_CLEAR:
+            self.flapping = False
+        return self.flapping
+
+
+class AnomalyDetector:
+    """Per-room detector state, shared by all request threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}
+
+    def observe(self, room_number, temperature=None, window_state=None, at=None):
+        """
+        Feed one report into the detector
+
+        Args:
+            room_number (str): Reporting room
+            temperature (float, optional): Reported temperature (°C)
+            window_state (str, optional): Reported window state
+            at (datetime, optional): Report time (default: now)
+
+        Returns:
+            list: Anomalies currently detected for the room, in a stable order
+        """
+        at = at or datetime.utcnow()
+        with self._lock:
+            state = self._rooms.get(room_number)
+            if state is None:
+                state = self._rooms[room_number] = RoomSensorState()
+
+            anomalies = []
+            if temperature is not None and state.observe_temperature(float(temperature), at):
+                anomalies.append(STUCK_SENSOR)
+            if window_state is not None and state.observe_window(window_state, at):
+                anomalies.append(WINDOW_FLAPPING)
+            return anomalies
+
+    def reset(self, room_number):
+        with self._lock:
+            self._rooms.pop(room_number, None)
+
+
+detector = AnomalyDetector()
+
+
+def check_report(status, temperature, window_state, policy=None):
+    """
+    Run a report through the detector and record the outcome on the room status
+
+    The status is only modified when its anomalies or quarantine state change,
+    so steady rooms cause no extra writes.
+
+    Args:
+        status (RoomStatus): The reporting room's status (not yet updated with the report)
+        temperature (float): Reported temperature (°C)
+        window_state (str): Reported window state
+        policy (GlobalPolicy, optional): Global policy, for the quarantine switch
+
+    Returns:
+        bool: Whether the room is quarantined from triggering pending events
+    """
+    anomalies = detector.observe(status.room_number, temperature, window_state)
+    flags = ','.join(anomalies) or None
+
+    quarantine = bool(policy and policy.quarantine_noisy_rooms and WINDOW_FLAPPING in anomalies)
+
+    if flags != status.anomaly_flags:
+        if flags and not status.anomaly_flags:
+            status.anomaly_since = datetime.utcnow()
+        elif not flags:
+            status.anomaly_since = None
+        status.anomaly_flags = flags
+
+    if quarantine != bool(status.quarantined):
+        status.quarantined = quarantine
+
+    return quarantine
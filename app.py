@@ -43,6 +43,15 @@ mail.init_app(app)
 # Import routes after app initialization
 from routes import *  # noqa
 from check_command_endpoint import *  # Import the check_command endpoint
+import change_bus  # noqa - Publishes committed changes to live subscribers
+import stream_endpoint  # noqa - Server-Sent Events stream for dashboards
+import command_channel  # noqa - Command delivery channel for Raspberry Pi clients
+import temperature_history  # noqa - Downsampled temperature history for charts
+import export_jobs  # noqa - Background export and report jobs
+import state_intervals  # noqa - Keeps AC/window state intervals in step with RoomStatus
+import analytics  # noqa - Fleet runtime and energy analytics
+import device_reports  # noqa - Backfill of reports queued by offline Raspberry Pi clients
+import gateway_api  # noqa - Batched endpoints for Raspberry Pi gateways managing several rooms
 
 def check_pending_window_events():
     """
@@ -89,6 +98,11 @@ def check_pending_window_events():
                 
                 # Mark pending event as processed
                 event.processed = True
+
+                # Have the room's client carry out the shutoff
+                if event.ac_state == 'on':
+                    from command_channel import queue_command
+                    queue_command(event.room_number, 'turn_off', 'pending_event')
                 db.session.commit()
                 
                 logging.info(f"Processed pending event {event.id} for room {event.room_number}")
@@ -171,6 +185,7 @@ def update_compliance_metrics():
     """Update compliance metrics for all rooms"""
     with app.app_context():
         from models import ACSettings, WindowEvent, GlobalPolicy, User
+        from state_intervals import overlap_seconds
         
         # Get policy
         policy = GlobalPolicy.query.first()
@@ -188,16 +203,11 @@ def update_compliance_metrics():
                     continue
                 
                 # Calculate window_open_minutes (time with window open and AC on)
-                one_day_ago = datetime.utcnow() - timedelta(days=1)
-                window_open_events = WindowEvent.query.filter(
-                    WindowEvent.room_number == room.room_number,
-                    WindowEvent.timestamp >= one_day_ago,
-                    WindowEvent.window_state == 'opened',
-                    WindowEvent.ac_state == 'on'
-                ).all()
-                
-                # Rough estimate - each event represents about 1 minute
-                window_open_minutes = len(window_open_events)
+                now = datetime.utcnow()
+                one_day_ago = now - timedelta(days=1)
+                window_open_minutes = int(round(overlap_seconds(
+                    room.room_number, 'window_open', 'ac_on', one_day_ago, now
+                ) / 60))
                 
                 # Calculate temperature deviation
                 # Get the average difference between room temperature and policy limits
@@ -330,11 +340,14 @@ scheduler.add_job(check_pending_window_events, 'interval', seconds=10)  # Check
 scheduler.add_job(check_scheduled_shutoffs, 'interval', minutes=5)  # Check every 5 minutes
 scheduler.add_job(update_compliance_metrics, 'interval', hours=1)  # Update metrics hourly
 scheduler.add_job(check_temperature_compliance, 'interval', seconds=5)  # Check temperature compliance every 5 seconds
+scheduler.add_job(export_jobs.cleanup_export_jobs, 'interval', minutes=30)  # Remove expired export files every 30 minutes
+scheduler.add_job(analytics.refresh_todays_usage, 'interval', minutes=5)  # Keep today's usage aggregates current
+scheduler.add_job(analytics.finalize_daily_usage, 'cron', hour=0, minute=15, timezone='UTC')  # Finalize yesterday's usage nightly
 scheduler.start()
 
 with app.app_context():
     # Import models to ensure they're registered with SQLAlchemy
-    from models import User, ACSettings, WindowEvent, PendingWindowEvent, GlobalPolicy, RoomStatus  # noqa
+    from models import User, ACSettings, WindowEvent, PendingWindowEvent, GlobalPolicy, RoomStatus, DeviceCommand, ExportJob, StateInterval, RoomDailyUsage, DeviceToken, DeviceReportStream  # noqa
     
     # Create all tables
     db.create_all()
@@ -365,4 +378,9 @@ with app.app_context():
             db.session.add(status)
             logging.info(f"Created initial status for room {user.room_number}")
     
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+
+# Optional MQTT ingestion of device telemetry (only runs with MQTT_BRIDGE_ENABLED=true,
+# in one process per host)
+import mqtt_bridge  # noqa
+mqtt_bridge.start_bridge()
@@ -0,0 +1,90 @@
+"""
+Benchmark of device token authentication overhead.
+
+Measures, per request:
+- the HMAC of a presented token
+- verification with a warm cache (the normal case)
+- verification on a cache miss (database lookup)
+- a pbkdf2 check like User.check_pin, for comparison
+- a full /api/check_policy request with and without a token
+
+Runs in-process against the configured database. A temporary room token is
+issued for the benchmark and deleted afterwards.
+
+Usage:
+    python bench_device_auth.py [room_number] [iterations]
+"""
+import sys
+import time
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import app, db
+from models import DeviceToken
+from device_auth import generate_token, token_digest, verify_token, verified_tokens
+
+
+def per_call_us(func, iterations):
+    """Average wall-clock microseconds per call"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def run_benchmark(room_number="101", iterations=2000):
+    token = generate_token()
+
+    with app.app_context():
+        device_token = DeviceToken()
+        device_token.room_number = room_number
+        device_token.label = "benchmark"
+        device_token.token_prefix = token[:12]
+        device_token.token_hash = token_digest(token)
+        db.session.add(device_token)
+        db.session.commit()
+        token_id = device_token.id
+
+        try:
+            results = {}
+            results['HMAC digest'] = per_call_us(lambda: token_digest(token), iterations)
+
+            verify_token(token)  # Warm the cache
+            results['verify (cache hit)'] = per_call_us(lambda: verify_token(token), iterations)
+
+            def verify_cold():
+                verified_tokens.clear()
+                verify_token(token)
+            results['verify (cache miss)'] = per_call_us(verify_cold, max(1, iterations // 10))
+
+            pin_hash = generate_password_hash("1234", method='pbkdf2:sha256')
+            results['pbkdf2 check (check_pin)'] = per_call_us(
+                lambda: check_password_hash(pin_hash, "1234"), max(1, iterations // 100)
+            )
+        finally:
+            verified_tokens.clear()
+
+    client = app.test_client()
+    url = f"/api/check_policy/{room_number}?command=TEMP_22&current_temp=22"
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.get(url, headers=headers)  # Warm the cache
+    without_token = per_call_us(lambda: client.get(url), max(1, iterations // 10))
+    with_token = per_call_us(lambda: client.get(url, headers=headers), max(1, iterations // 10))
+    results['request without token'] = without_token
+    results['request with token'] = with_token
+
+    with app.app_context():
+        db.session.delete(db.session.get(DeviceToken, token_id))
+        db.session.commit()
+
+    print(f"Device auth benchmark (room {room_number}, {iterations} iterations)")
+    for name, microseconds in results.items():
+        print(f"  {name:<28} {microseconds:10.1f} us")
+    print(f"  {'auth overhead per request':<28} {with_token - without_token:10.1f} us")
+
+
+if __name__ == "__main__":
+    room = sys.argv[1] if len(sys.argv) > 1 else "101"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    run_benchmark(room, count)
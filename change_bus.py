@@ -0,0 +1,229 @@
+"""
+In-process change bus for the AC control system.
+
+Every committed change to RoomStatus, WindowEvent, PendingWindowEvent,
+DeviceCommand or ACSettings is turned into a small change record and fanned
+out to subscribers (the Server-Sent Events stream, long-polling device
+channels, ...). The cost of publishing is proportional to the number of
+changes, not to the number of viewers or rooms on screen. Per-room version
+numbers also back the ETags of the polling APIs.
+
+Changes are collected from SQLAlchemy session events, so every code path that
+commits through the ORM (routes, scheduler jobs, the test interface) publishes
+without having to remember to do so. Only changes committed by this process
+are seen; run the server as a single process (threads are fine).
+"""
+import itertools
+import logging
+import queue
+import threading
+import uuid
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("change_bus")
+
+# Identifies this server process in event ids, so a client resuming with an id
+# issued before a restart gets a full refresh instead of a bogus replay
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+class Change:
+    """A single committed change, as delivered to subscribers"""
+
+    __slots__ = ('seq', 'kind', 'room_number', 'data')
+
+    def __init__(self, seq, kind, room_number, data):
+        self.seq = seq
+        self.kind = kind  # 'status', 'event', 'pending', 'command' or 'settings'
+        self.room_number = room_number
+        self.data = data
+
+    @property
+    def event_id(self):
+        return f"{BOOT_ID}-{self.seq}"
+
+
+class Subscription:
+    """A subscriber's view of the bus, optionally filtered by room and kind"""
+
+    def __init__(self, rooms=None, kinds=None, max_queue=1000):
+        self.rooms = set(rooms) if rooms else None
+        self.kinds = set(kinds) if kinds else None
+        self.needs_reset = False  # Set when changes were missed and the client must resync
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def wants(self, change):
+        if self.rooms is not None and change.room_number not in self.rooms:
+            return False
+        if self.kinds is not None and change.kind not in self.kinds:
+            return False
+        return True
+
+    def deliver(self, change):
+        try:
+            self._queue.put_nowait(change)
+        except queue.Full:
+            # Slow consumer - drop its backlog and ask it to resync
+            self.needs_reset = True
+
+    def get(self, timeout=None):
+        """
+        Wait for changes for this subscriber
+
+        Returns:
+            list: All changes queued so far (empty if the timeout expired)
+        """
+        try:
+            changes = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        while True:
+            try:
+                changes.append(self._queue.get_nowait())
+            except queue.Empty:
+                return changes
+
+
+class ChangeBus:
+    """Publish/subscribe hub with a short replay history for resuming clients"""
+
+    def __init__(self, history_size=2000):
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._room_versions = {}
+
+    def publish(self, kind, room_number, data):
+        """Publish a change and return its sequence number"""
+        with self._lock:
+            change = Change(next(self._seq), kind, room_number, data)
+            self._history.append(change)
+            self._room_versions[room_number] = change.seq
+            subscribers = [sub for sub in self._subscribers if sub.wants(change)]
+
+        for subscriber in subscribers:
+            subscriber.deliver(change)
+        return change.seq
+
+    def subscribe(self, rooms=None, kinds=None, last_event_id=None):
+        """
+        Register a new subscriber
+
+        Args:
+            rooms (iterable, optional): Room numbers to receive changes for (all if None)
+            kinds (iterable, optional): Change kinds to receive (all if None)
+            last_event_id (str, optional): Last event id the client saw; newer
+                changes still in the history are replayed
+
+        Returns:
+            Subscription: The new subscription
+        """
+        subscription = Subscription(rooms, kinds)
+
+        with self._lock:
+            if last_event_id:
+                last_seq = parse_event_id(last_event_id)
+                oldest_seq = self._history[0].seq if self._history else None
+                if last_seq is None or (oldest_seq is not None and last_seq < oldest_seq - 1):
+                    # Unknown id or history no longer reaches back far enough
+                    subscription.needs_reset = True
+                else:
+                    for change in self._history:
+                        if change.seq > last_seq and subscription.wants(change):
+                            subscription.deliver(change)
+            self._subscribers.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def room_version(self, room_number):
+        """Sequence number of the last change published for a room (0 if none yet)"""
+        return self._room_versions.get(room_number, 0)
+
+    def version(self):
+        """Sequence number of the last change published for any room (0 if none yet)"""
+        with self._lock:
+            return self._history[-1].seq if self._history else 0
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def parse_event_id(event_id):
+    """Return the sequence number from an event id issued by this process, else None"""
+    boot_id, _, seq = str(event_id).partition('-')
+    if boot_id != BOOT_ID or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+bus = ChangeBus()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    """Record changes made by this flush; they are published once the transaction commits"""
+    from models import RoomStatus, WindowEvent, PendingWindowEvent, DeviceCommand, ACSettings
+
+    changes = session.info.setdefault('change_bus', [])
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, RoomStatus):
+            if obj in session.new or session.is_modified(obj):
+                changes.append(('status', obj.room_number, obj.to_summary()))
+        elif isinstance(obj, WindowEvent):
+            if obj in session.new and obj.backfilled:
+                # History, not the newest event: subscribers just reload the log
+                changes.append(('event', obj.room_number, {'backfilled': True}))
+            elif obj in session.new:
+                changes.append(('event', obj.room_number, obj.to_dict()))
+        elif isinstance(obj, PendingWindowEvent):
+            changes.append(('pending', obj.room_number, obj.to_dict()))
+        elif isinstance(obj, DeviceCommand):
+            if obj in session.new:
+                changes.append(('command', obj.room_number, obj.to_dict()))
+        elif isinstance(obj, ACSettings):
+            if obj in session.new or session.is_modified(obj):
+                changes.append(('settings', obj.room_number, {}))
+
+    for obj in session.deleted:
+        if isinstance(obj, PendingWindowEvent):
+            data = obj.to_dict()
+            data['cancelled'] = True
+            changes.append(('pending', obj.room_number, data))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    changes = session.info.pop('change_bus', None)
+    if not changes:
+        return
+
+    # Several flushes in one transaction only need the final status of each
+    # room, and a batch of backfilled events a single notice per room
+    last_index = {}
+    for index, (kind, room_number, data) in enumerate(changes):
+        if kind == 'status' or data.get('backfilled'):
+            last_index[(kind, room_number)] = index
+
+    for index, (kind, room_number, data) in enumerate(changes):
+        if (kind == 'status' or data.get('backfilled')) and last_index[(kind, room_number)] != index:
+            continue
+        try:
+            bus.publish(kind, room_number, data)
+        except Exception as e:
+            logger.error(f"Error publishing {kind} change for room {room_number}: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('change_bus', None)
@@ -1,11 +1,13 @@
+from datetime import datetime
 from flask import request, jsonify
 from app import app, db
-from models import ACSettings, RoomStatus, GlobalPolicy
-from datetime import datetime
-from routes import time_in_range
+from models import ACSettings, RoomStatus, GlobalPolicy, WindowEvent
+from device_auth import device_auth_required
+from policy_engine import build_bundle, evaluate_command
 
 
 @app.route('/api/check_command', methods=['POST'])
+@device_auth_required
 def check_command():
     """
     Advanced API to check if a command should be allowed, 
@@ -35,58 +37,109 @@ def check_command():
     # Get the global policy
     policy = GlobalPolicy.query.first()
     
-    # Check if settings are locked by admin (no commands allowed)
-    if settings.settings_locked:
-        return jsonify({
-            'allowed': False,
-            'reason': 'Room settings locked by administrator',
-            'alternative_action': 'REPORT_STATUS'
-        })
-    
-    # Check if this is a power-on command with window open
-    if command == 'POWER' and window_state == 'opened' and ac_state == 'off':
-        return jsonify({
-            'allowed': False,
-            'reason': 'Cannot turn on AC while window is open',
-            'alternative_action': 'REPORT_STATUS'
-        })
-    
-    # Check if this is a prohibited temperature change
-    if command == 'TEMP_DOWN':
-        # Calculate new temperature after command
-        new_temp = temperature - 1
-        
-        if new_temp < policy.min_allowed_temp:
-            return jsonify({
-                'allowed': False,
-                'reason': f'Temperature cannot be set below {policy.min_allowed_temp}°C',
-                'alternative_action': f'SET_TEMP_{int(policy.min_allowed_temp)}'
-            })
-    
-    if command == 'TEMP_UP':
-        # Calculate new temperature after command
-        new_temp = temperature + 1
-        
-        if new_temp > policy.max_allowed_temp:
-            return jsonify({
-                'allowed': False,
-                'reason': f'Temperature cannot be set above {policy.max_allowed_temp}°C',
-                'alternative_action': f'SET_TEMP_{int(policy.max_allowed_temp)}'
-            })
-    
-    # Check if it's scheduled shutoff time
-    if policy.scheduled_shutoff_active and command == 'POWER' and ac_state == 'off':
-        current_time = datetime.now().time()
-        # If current time is in the shutoff range and it's not exempt
-        if time_in_range(policy.scheduled_shutoff_time, policy.scheduled_startup_time, current_time) and not settings.schedule_override:
-            return jsonify({
-                'allowed': False,
-                'reason': 'AC usage not allowed during scheduled shutoff hours',
-                'alternative_action': 'REPORT_STATUS'
-            })
-    
-    # All checks passed, command is allowed
-    return jsonify({
-        'allowed': True,
-        'policy_status': 'compliant'
-    })
\ No newline at end of file
+    # Same rules the Pi applies locally with its cached policy bundle
+    bundle = build_bundle(policy, settings, room_number)
+    decision = evaluate_command(bundle, command, window_state, ac_state, temperature)
+    decision['policy_version'] = bundle['version']
+    return jsonify(decision)
+
+
+@app.route('/api/ir_command', methods=['POST'])
+@device_auth_required
+def ir_command():
+    """
+    Decide an IR command and record it in a single round trip.
+    
+    Replaces /api/check_command followed by a status report to /receive_data
+    for every button press: the decision, the room's resulting state and the
+    command's event log entry are committed in one transaction. Server
+    commands for the room go over the command channel, not in this reply.
+    
+    The client sends the room's state from before the command. A client that
+    already decided the command with its cached policy bundle also sends its
+    decision ('allowed' or 'blocked', with the reason), which is recorded as is.
+    """
+    if not request.is_json:
+        return jsonify({'allowed': False, 'reason': 'Request must be JSON'}), 400
+    
+    data = request.get_json(silent=True) or {}
+    room_number = data.get('room_number')
+    command = data.get('command')
+    window_state = data.get('window_state')
+    ac_state = data.get('ac_state')
+    
+    if not room_number or not command:
+        return jsonify({'allowed': False, 'reason': 'Missing required fields'}), 400
+    try:
+        temperature = float(data['temperature']) if data.get('temperature') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'allowed': False, 'reason': 'Invalid temperature'}), 400
+    
+    settings = ACSettings.query.filter_by(room_number=room_number).first()
+    status = RoomStatus.query.filter_by(room_number=room_number).first()
+    
+    if not settings or not status:
+        return jsonify({'allowed': False, 'reason': 'Room not found'}), 404
+    
+    policy = GlobalPolicy.query.first()
+    bundle = build_bundle(policy, settings, room_number)
+    
+    if data.get('decision') in ('allowed', 'blocked'):
+        # Already decided (and executed) on the device
+        decision = {'allowed': data['decision'] == 'allowed'}
+        if data.get('reason'):
+            decision['reason'] = data['reason']
+    else:
+        decision = evaluate_command(bundle, command, window_state, ac_state, temperature)
+    decision['policy_version'] = bundle['version']
+    
+    # The state once the command has run (only POWER changes it)
+    if window_state in ('opened', 'closed'):
+        status.window_state = window_state
+    new_ac_state = ac_state if ac_state in ('on', 'off') else status.ac_state
+    if decision['allowed'] and command == 'POWER' and new_ac_state in ('on', 'off'):
+        new_ac_state = 'on' if new_ac_state == 'off' else 'off'
+    status.ac_state = new_ac_state
+    if temperature is not None:
+        status.current_temperature = temperature
+    status.last_updated = datetime.utcnow()
+    
+    issue = f"IR command {command} {'allowed' if decision['allowed'] else 'blocked'}"
+    if decision.get('reason'):
+        issue += f": {decision['reason']}"
+    
+    event = WindowEvent()
+    event.room_number = room_number
+    event.window_state = status.window_state
+    event.ac_state = new_ac_state
+    event.temperature = temperature
+    event.policy_compliant = decision['allowed']
+    event.compliance_issue = issue[:100]
+    db.session.add(event)
+    db.session.commit()
+    
+    decision['ac_state'] = new_ac_state
+    return jsonify(decision)
+
+
+@app.route('/api/policy_bundle/<room_number>')
+@device_auth_required
+def policy_bundle(room_number):
+    """
+    The compiled command policy for a room, for Raspberry Pi clients to
+    evaluate commands locally.
+    
+    The ETag is the bundle version, so a client revalidating with
+    If-None-Match gets a 304 until an admin changes the policy or the room's
+    settings.
+    """
+    settings = ACSettings.query.filter_by(room_number=room_number).first()
+    if not settings:
+        return jsonify({'error': 'Room not found', 'status': 'error'}), 404
+    
+    bundle = build_bundle(GlobalPolicy.query.first(), settings, room_number)
+    
+    response = jsonify(bundle)
+    response.set_etag(bundle['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
@@ -0,0 +1,217 @@
+"""
+Low-latency command delivery to Raspberry Pi clients.
+
+Admin and user actions (send_command, force_ac_state) queue a DeviceCommand.
+Each Pi client holds a long-poll request open on /api/commands/<room>; the
+request is woken through the change bus the moment a command is committed, so
+commands reach the room in well under a second instead of waiting for the next
+status update. A gateway Pi that manages several rooms holds a single poll
+open on /api/commands?rooms=... for all of them. Clients acknowledge
+execution, which records the delivery latency on the command.
+
+A waiting poll holds its request open for up to MAX_WAIT_SECONDS (but no
+database connection), so the server runs on gevent workers (see .replit):
+each waiting poll is a greenlet rather than an OS thread, and one worker
+holds hundreds of them. At most COMMAND_POLL_SLOTS polls wait at a time;
+polls beyond that are answered straight away, without touching the database,
+with a retry_after for the client to sleep before polling again. Under the
+threaded development server every waiting poll is a thread, so set
+COMMAND_POLL_SLOTS low there.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+
+from flask import request, jsonify, g
+from app import app, db
+from models import DeviceCommand
+from change_bus import bus
+from device_auth import device_auth_required, requested_rooms, token_covers
+
+# Longest a client may hold a poll open, in seconds
+MAX_WAIT_SECONDS = 30
+
+# Most polls waiting at once (below gunicorn's --worker-connections, leaving
+# room for dashboards and reports), and how long the clients turned away
+# should sleep before polling again
+COMMAND_POLL_SLOTS = int(os.environ.get('COMMAND_POLL_SLOTS', 900))
+POLL_RETRY_AFTER = 15
+
+_poll_slots = threading.BoundedSemaphore(COMMAND_POLL_SLOTS)
+
+# Commands not delivered within this window are dropped - a stale "turn on"
+# should not run when a client comes back online hours later
+COMMAND_TTL = timedelta(minutes=10)
+
+# Delivered commands that are not acknowledged within this window are redelivered
+REDELIVERY_AFTER = timedelta(seconds=30)
+
+
+def queue_command(room_number, command, source):
+    """
+    Queue a command for a room's client
+
+    The command is added to the current session and goes out to the client as
+    soon as the caller commits.
+
+    Args:
+        room_number (str): Target room
+        command (str): 'turn_on', 'turn_off' or 'set_temp_<n>'
+        source (str): What queued the command, for the audit trail
+
+    Returns:
+        DeviceCommand: The queued command
+    """
+    device_command = DeviceCommand()
+    device_command.room_number = room_number
+    device_command.command = command
+    device_command.source = source
+    device_command.status = 'queued'
+    device_command.created_at = datetime.utcnow()
+    db.session.add(device_command)
+    return device_command
+
+
+def claim_pending_commands(*room_numbers):
+    """Return the rooms' undelivered commands, marking them as delivered"""
+    now = datetime.utcnow()
+
+    commands = DeviceCommand.query.filter(
+        DeviceCommand.room_number.in_(room_numbers),
+        DeviceCommand.status.in_(['queued', 'delivered'])
+    ).order_by(DeviceCommand.id).all()
+
+    claimed = []
+    for command in commands:
+        if command.created_at < now - COMMAND_TTL:
+            command.status = 'expired'
+        elif command.status == 'queued' or command.delivered_at < now - REDELIVERY_AFTER:
+            command.status = 'delivered'
+            command.delivered_at = now
+            claimed.append(command)
+
+    if commands:
+        db.session.commit()
+    return claimed
+
+
+def poll_turned_away():
+    """Reply to a poll that found no free slot to wait in"""
+    app.logger.warning(f"All {COMMAND_POLL_SLOTS} command poll slots are in use")
+    response = jsonify({'commands': [], 'retry_after': POLL_RETRY_AFTER})
+    response.headers['Retry-After'] = str(POLL_RETRY_AFTER)
+    return response
+
+
+def wait_for_commands(room_numbers):
+    """
+    Claim the rooms' commands, holding the request open until one is queued
+    if there are none (the body of both long-poll endpoints)
+
+    Args:
+        room_numbers (list): Rooms the client manages
+
+    Returns:
+        Response: The claimed commands, or a busy reply with retry_after
+    """
+    wait = max(0, min(request.args.get('wait', 25, type=int), MAX_WAIT_SECONDS))
+    if wait == 0:
+        commands = claim_pending_commands(*room_numbers)
+        return jsonify({'commands': [command.to_dict() for command in commands]})
+
+    # Take a slot first, so a poll that is turned away costs no database work
+    if not _poll_slots.acquire(blocking=False):
+        return poll_turned_away()
+    try:
+        # Subscribe before checking the database so a command committed in
+        # between still wakes us up
+        subscription = bus.subscribe(rooms=room_numbers, kinds=['command'])
+        try:
+            commands = claim_pending_commands(*room_numbers)
+            if not commands:
+                # Return the connection to the pool while waiting
+                db.session.remove()
+                if subscription.get(timeout=wait):
+                    commands = claim_pending_commands(*room_numbers)
+        finally:
+            bus.unsubscribe(subscription)
+    finally:
+        _poll_slots.release()
+
+    return jsonify({'commands': [command.to_dict() for command in commands]})
+
+
+@app.route('/api/commands/<room_number>')
+@device_auth_required
+def poll_commands(room_number):
+    """
+    Long-poll for commands queued for a room.
+
+    Returns immediately when commands are waiting, otherwise holds the request
+    open until one is queued or the wait expires. Query parameter:
+        wait: seconds to wait for a command (default 25, max 30, 0 to not wait)
+    """
+    return wait_for_commands([room_number])
+
+
+@app.route('/api/commands')
+@device_auth_required
+def poll_gateway_commands():
+    """
+    Long-poll for commands queued for any of several rooms (a gateway's).
+
+    Query parameters:
+        rooms: comma-separated room numbers (default: every room of the token)
+        wait:  as for /api/commands/<room>
+    Each command carries its room_number.
+    """
+    rooms = requested_rooms()
+    if not rooms:
+        return jsonify({'error': 'rooms is required', 'status': 'error'}), 400
+    if not token_covers(rooms):
+        return jsonify({'error': 'Token is not valid for this room', 'status': 'error'}), 403
+    return wait_for_commands(rooms)
+
+
+@app.route('/api/commands/<int:command_id>/ack', methods=['POST'])
+@device_auth_required
+def acknowledge_command(command_id):
+    """Record that a client executed (or failed to execute) a command"""
+    data = request.get_json(silent=True) or {}
+
+    command = db.session.get(DeviceCommand, command_id)
+    if not command:
+        return jsonify({'error': 'Command not found'}), 404
+
+    room_number = g.device_room or data.get('room_number')
+    if room_number and room_number != command.room_number:
+        return jsonify({'error': 'Command belongs to another room'}), 403
+
+    latency_ms = record_acknowledgement(command, data.get('success', True), data.get('message'))
+
+    return jsonify({
+        'success': True,
+        'status': command.status,
+        'delivery_latency_ms': latency_ms
+    })
+
+
+def record_acknowledgement(command, success, message=None):
+    """
+    Record a client's acknowledgement of a command and commit
+
+    Returns:
+        int: Delivery latency in milliseconds
+    """
+    command.status = 'executed' if success else 'failed'
+    command.result = (message or '')[:100] or None
+    command.acked_at = datetime.utcnow()
+    if not command.delivered_at:
+        command.delivered_at = command.acked_at
+
+    db.session.commit()
+
+    latency_ms = command.delivery_latency_ms()
+    app.logger.info(f"Command {command.id} ({command.command}) for room {command.room_number} "
+                    f"{command.status} after {latency_ms} ms")
+    return latency_ms
@@ -0,0 +1,307 @@
+"""
+Token authentication for Raspberry Pi clients.
+
+Admins issue a random API token per device, bound to a room (or, for a
+gateway Pi that manages several rooms, to a list of rooms). Only an
+HMAC-SHA256 of the token is stored. A request presents the token in an
+"Authorization: Bearer <token>" (or "X-Device-Token") header; verifying it
+costs one HMAC (microseconds, unlike pbkdf2) plus a lookup in a cache of
+recently verified tokens, so the database is only consulted on a cache miss.
+
+Tokens are required by default, and the server refuses to start without a
+DEVICE_TOKEN_KEY to compute their digests with. While devices are being
+provisioned, DEVICE_AUTH_REQUIRED=false explicitly lets requests without a
+token through; a token that is invalid, revoked or bound to other rooms is
+always refused.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request, jsonify, g, render_template, redirect, url_for, flash
+from flask_login import login_required, current_user
+from sqlalchemy import event, inspect
+from app import app, db
+from models import DeviceToken, User
+
+logger = logging.getLogger("device_auth")
+
+# Refuse device requests without a token, unless explicitly turned off for
+# provisioning (tokens are then still checked when present)
+DEVICE_AUTH_REQUIRED = os.environ.get('DEVICE_AUTH_REQUIRED', 'true').lower() not in ('false', 'no', '0', 'f')
+
+# Key for token digests - rotating it invalidates every issued token. There is
+# deliberately no fallback to the session secret, whose default is public
+TOKEN_KEY = os.environ.get('DEVICE_TOKEN_KEY', '').encode() or None
+
+if TOKEN_KEY is None:
+    if DEVICE_AUTH_REQUIRED:
+        raise RuntimeError("DEVICE_TOKEN_KEY must be set while device tokens are required "
+                           "(set DEVICE_AUTH_REQUIRED=false only while provisioning devices)")
+    logger.warning("DEVICE_AUTH_REQUIRED=false and no DEVICE_TOKEN_KEY: device endpoints are "
+                   "unauthenticated and no tokens can be issued or verified")
+
+# Verified tokens are trusted for this long before being checked against the database again
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 4096
+
+# Write last_used_at at most this often per token
+LAST_USED_INTERVAL = timedelta(minutes=5)
+
+
+def token_digest(token):
+    """HMAC of a token, as stored in DeviceToken.token_hash"""
+    if TOKEN_KEY is None:
+        raise RuntimeError("DEVICE_TOKEN_KEY is not set")
+    return hmac.new(TOKEN_KEY, token.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_token():
+    """A new random token: 'acd_' followed by 43 URL-safe characters"""
+    return 'acd_' + secrets.token_urlsafe(32)
+
+
+class VerifiedTokenCache:
+    """Thread-safe LRU cache of token digest -> (token id, rooms), with a TTL"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if not entry or entry[2] <= time.monotonic():
+                return None
+            self._entries.move_to_end(digest)
+            return entry[0], entry[1]
+
+    def put(self, digest, token_id, rooms):
+        with self._lock:
+            self._entries[digest] = (token_id, rooms, time.monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+@event.listens_for(DeviceToken, 'after_update')
+def _forget_revoked_token(mapper, connection, target):
+    # Revocations are rare - simply drop everything (last_used_at updates are ignored)
+    if inspect(target).attrs.revoked.history.has_changes():
+        verified_tokens.clear()
+
+
+@event.listens_for(DeviceToken, 'after_delete')
+def _forget_deleted_token(mapper, connection, target):
+    verified_tokens.clear()
+
+
+def verify_token(token):
+    """
+    Check a presented token
+
+    Returns:
+        tuple: (token id, tuple of rooms, its own room first) for a valid,
+               unrevoked token, else None
+    """
+    if not token or TOKEN_KEY is None:
+        return None
+
+    digest = token_digest(token)
+    cached = verified_tokens.get(digest)
+    if cached:
+        return cached
+
+    # Looked up by digest: the presented token itself is never compared or stored
+    device_token = DeviceToken.query.filter_by(token_hash=digest).first()
+    if not device_token or device_token.revoked:
+        return None
+
+    now = datetime.utcnow()
+    if not device_token.last_used_at or device_token.last_used_at < now - LAST_USED_INTERVAL:
+        device_token.last_used_at = now
+        db.session.commit()
+
+    rooms = tuple(device_token.rooms())
+    verified_tokens.put(digest, device_token.id, rooms)
+    return device_token.id, rooms
+
+
+def presented_token():
+    """Token sent with the current request, if any"""
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header[7:].strip()
+    return request.headers.get('X-Device-Token', '').strip() or None
+
+
+def requested_room(view_kwargs):
+    """Room the current device request is about (URL, JSON body or query string)"""
+    if view_kwargs.get('room_number'):
+        return str(view_kwargs['room_number'])
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict) and data.get('room_number'):
+        return str(data['room_number'])
+    return request.args.get('room_number')
+
+
+def requested_rooms():
+    """
+    Rooms a gateway request is about: the comma-separated 'rooms' query
+    parameter, or else every room of the caller's token
+
+    Returns:
+        list: Room numbers (empty if neither is given)
+    """
+    rooms = [room.strip() for room in request.args.get('rooms', '').split(',') if room.strip()]
+    if not rooms and g.device_rooms:
+        rooms = list(g.device_rooms)
+    return list(dict.fromkeys(rooms))
+
+
+def token_covers(rooms):
+    """
+    Whether the current device request may act for every one of these rooms
+
+    For endpoints that serve several rooms at once (a gateway's batches); the
+    rooms of a request without a token are not restricted.
+    """
+    if g.device_rooms is None:
+        return True
+    return set(rooms) <= set(g.device_rooms)
+
+
+def device_auth_required(view):
+    """
+    Authenticate a device endpoint with the caller's API token.
+
+    The token must be bound to the room the request is about. On success the
+    room is available as g.device_room (None if a gateway token's request
+    names no room) and every room the token covers as g.device_rooms.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = presented_token()
+        g.device_room = None
+        g.device_rooms = None
+
+        if token is None:
+            if DEVICE_AUTH_REQUIRED:
+                return jsonify({'error': 'Device token required', 'status': 'error'}), 401
+            return view(*args, **kwargs)
+
+        verified = verify_token(token)
+        if verified is None:
+            logger.warning(f"Rejected invalid device token on {request.path} from {request.remote_addr}")
+            return jsonify({'error': 'Invalid device token', 'status': 'error'}), 401
+
+        _, token_rooms = verified
+        room_number = requested_room(kwargs)
+        if room_number and room_number not in token_rooms:
+            logger.warning(f"Device token for rooms {', '.join(token_rooms)} used for room {room_number}")
+            return jsonify({'error': 'Token is not valid for this room', 'status': 'error'}), 403
+
+        g.device_room = room_number or (token_rooms[0] if len(token_rooms) == 1 else None)
+        g.device_rooms = token_rooms
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@app.route('/device_tokens')
+@login_required
+def device_tokens():
+    """Admin page for issuing and revoking device tokens"""
+    if not current_user.is_admin:
+        flash('You must be an admin to access this page', 'error')
+        return redirect(url_for('room_dashboard'))
+
+    tokens = DeviceToken.query.order_by(DeviceToken.room_number, DeviceToken.id).all()
+    rooms = User.query.filter(User.room_number.isnot(None)).order_by(User.room_number).all()
+
+    return render_template('device_tokens.html',
+                           tokens=tokens,
+                           rooms=rooms,
+                           enforced=DEVICE_AUTH_REQUIRED,
+                           can_issue=TOKEN_KEY is not None)
+
+
+@app.route('/device_tokens/issue', methods=['POST'])
+@login_required
+def issue_device_token():
+    """Issue a new token for a room; the token is shown once and never stored"""
+    if not current_user.is_admin:
+        flash('You must be an admin to access this page', 'error')
+        return redirect(url_for('room_dashboard'))
+
+    if TOKEN_KEY is None:
+        flash('Set DEVICE_TOKEN_KEY before issuing device tokens', 'error')
+        return redirect(url_for('device_tokens'))
+
+    room_number = request.form.get('room_number', '').strip()
+    if not User.query.filter_by(room_number=room_number).first():
+        flash('Unknown room number', 'error')
+        return redirect(url_for('device_tokens'))
+
+    # A gateway token also covers the other rooms its Pi manages
+    gateway_rooms = [room.strip() for room in request.form.get('gateway_rooms', '').split(',')
+                     if room.strip() and room.strip() != room_number]
+    unknown = [room for room in gateway_rooms if not User.query.filter_by(room_number=room).first()]
+    if unknown:
+        flash(f"Unknown room number: {', '.join(unknown)}", 'error')
+        return redirect(url_for('device_tokens'))
+
+    token = generate_token()
+    device_token = DeviceToken()
+    device_token.room_number = room_number
+    device_token.gateway_rooms = ','.join(dict.fromkeys(gateway_rooms)) or None
+    device_token.label = request.form.get('label', '').strip()[:64] or None
+    device_token.token_prefix = token[:12]
+    device_token.token_hash = token_digest(token)
+    device_token.created_at = datetime.utcnow()
+    db.session.add(device_token)
+    db.session.commit()
+
+    app.logger.info(f"Device token {device_token.id} issued for room(s) {', '.join(device_token.rooms())} "
+                    f"by {current_user.username}")
+    return render_template('device_tokens.html',
+                           tokens=DeviceToken.query.order_by(DeviceToken.room_number, DeviceToken.id).all(),
+                           rooms=User.query.filter(User.room_number.isnot(None)).order_by(User.room_number).all(),
+                           enforced=DEVICE_AUTH_REQUIRED,
+                           can_issue=True,
+                           new_token=token,
+                           new_token_room=', '.join(device_token.rooms()))
+
+
+@app.route('/device_tokens/<int:token_id>/revoke', methods=['POST'])
+@login_required
+def revoke_device_token(token_id):
+    """Revoke a device token; it stops working immediately"""
+    if not current_user.is_admin:
+        flash('You must be an admin to access this page', 'error')
+        return redirect(url_for('room_dashboard'))
+
+    device_token = db.session.get(DeviceToken, token_id)
+    if device_token:
+        device_token.revoked = True
+        db.session.commit()
+        app.logger.info(f"Device token {token_id} for room {device_token.room_number} revoked by {current_user.username}")
+        flash('Device token revoked', 'success')
+
+    return redirect(url_for('device_tokens'))
@@ -0,0 +1,305 @@
+"""
+Backfill of reports queued by offline Raspberry Pi clients.
+
+When a Pi cannot reach the server it stores its status reports and IR command
+events in a local queue (see pi_offline_queue.py), stamped with the device
+time and a sequence number, and uploads them here in gzip-compressed batches
+once the connection is back. The same queue carries the audit of commands
+the Pi allowed or blocked locally with its cached policy bundle.
+
+Backfilled reports are history: they are added to the event log at the time
+they were recorded, but they do not change the live room status and never
+trigger shutoffs or notifications - live reports keep doing that. The room's
+state intervals over the span of a batch are rebuilt from the event log, and
+the daily usage of the days it touches is recomputed. Each
+device queue is a stream with its own id; the highest sequence number
+accepted per stream is stored, so a batch that is uploaded again after a
+lost response is not recorded twice.
+"""
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from flask import request, jsonify, g
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import WindowEvent, GlobalPolicy, DeviceReportStream
+from device_auth import device_auth_required, token_covers
+from state_intervals import rebuild_room_intervals
+from analytics import refresh_daily_usage
+
+logger = logging.getLogger("device_reports")
+
+# Most reports accepted in one batch
+MAX_BATCH_SIZE = 500
+
+# Largest accepted batch, after decompression
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+
+# Reports recorded longer ago than this are dropped
+MAX_REPORT_AGE = timedelta(days=30)
+
+WINDOW_STATES = ('opened', 'closed')
+AC_STATES = ('on', 'off')
+
+
+def read_batch():
+    """
+    Decode the request body, which may be gzip-compressed
+
+    Returns:
+        dict: The batch, or None if the body is not a valid batch
+    """
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            # Bounded so a small compressed body cannot expand without limit
+            body = decompressor.decompress(body, MAX_BATCH_BYTES + 1)
+        except zlib.error:
+            return None
+    if len(body) > MAX_BATCH_BYTES:
+        return None
+
+    try:
+        batch = json.loads(body)
+    except ValueError:
+        return None
+    return batch if isinstance(batch, dict) else None
+
+
+def parse_device_time(value):
+    """Parse an ISO 8601 device timestamp (UTC) into a naive datetime"""
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def clock_offset(batch, now):
+    """
+    Difference between server and device clocks
+
+    A Pi without a real-time clock can run minutes or years off until NTP
+    syncs. The batch carries the device time it was sent at, so device
+    timestamps are shifted by the difference (transport delay is negligible
+    at this resolution).
+    """
+    try:
+        return now - parse_device_time(batch['sent_at'])
+    except (KeyError, TypeError, ValueError):
+        return timedelta(0)
+
+
+def compliance_of(policy, window_state, ac_state, temperature):
+    """Compliance of a reported state, by the same rules as live reports"""
+    if not policy or not policy.policy_active:
+        return True, None
+    if window_state == 'opened' and ac_state == 'on':
+        return False, "Window open with AC running"
+    if temperature is not None:
+        if temperature < policy.min_allowed_temp:
+            return False, f"Temperature below minimum allowed ({policy.min_allowed_temp}°C)"
+        if temperature > policy.max_allowed_temp:
+            return False, f"Temperature above maximum allowed ({policy.max_allowed_temp}°C)"
+    return True, None
+
+
+def report_event(report, recorded_at, policy):
+    """
+    Build the event log entry for one queued report
+
+    Returns:
+        WindowEvent: The event, or None if the report is invalid
+    """
+    try:
+        temperature = float(report['temperature']) if report.get('temperature') is not None else None
+    except (TypeError, ValueError):
+        return None
+
+    event = WindowEvent()
+    event.room_number = report['room_number']
+    event.timestamp = recorded_at
+    event.temperature = temperature
+    event.backfilled = True
+
+    command = report.get('command')
+    if command:
+        # IR command event - state is whatever the device knew at the time
+        event.window_state = (report.get('window_state') or '').lower() or None
+        event.ac_state = (report.get('ac_state') or '').lower() or None
+        decision = report.get('decision')
+        if decision in ('allowed', 'blocked'):
+            # Audit of a command decided on the device
+            event.policy_compliant = decision == 'allowed'
+            issue = f"IR command {command} {decision}"
+            if report.get('reason'):
+                issue += f": {report['reason']}"
+            event.compliance_issue = issue[:100]
+        else:
+            event.compliance_issue = f"IR command: {str(command)[:80]}"
+        return event
+
+    window_state = (report.get('window_state') or '').lower()
+    ac_state = (report.get('ac_state') or '').lower()
+    if window_state not in WINDOW_STATES or ac_state not in AC_STATES:
+        return None
+
+    event.window_state = window_state
+    event.ac_state = ac_state
+    event.policy_compliant, event.compliance_issue = compliance_of(policy, window_state, ac_state, temperature)
+    return event
+
+
+def rebuild_room_history(room_number, first, last, now):
+    """
+    Replay a room's backfilled span into its state intervals
+
+    The span runs from the first backfilled event up to the next event logged
+    after the last one (or now), from where the recorded state takes over.
+
+    Returns:
+        datetime: End of the rebuilt span
+    """
+    later_event = WindowEvent.query.with_entities(WindowEvent.timestamp).filter(
+        WindowEvent.room_number == room_number,
+        WindowEvent.timestamp > last
+    ).order_by(WindowEvent.timestamp).first()
+    end = later_event.timestamp if later_event else now
+
+    rebuild_room_intervals(db.session, room_number, first, end)
+    return end
+
+
+def stream_watermark(room_number, stream_id):
+    """Get or create the sequence watermark of a device stream"""
+    stream = DeviceReportStream.query.filter_by(room_number=room_number, stream_id=stream_id).first()
+    if stream:
+        return stream
+
+    stream = DeviceReportStream()
+    stream.room_number = room_number
+    stream.stream_id = stream_id
+    stream.last_seq = 0
+    try:
+        # Savepoint, in case another upload of the same stream created it first
+        with db.session.begin_nested():
+            db.session.add(stream)
+    except IntegrityError:
+        stream = DeviceReportStream.query.filter_by(room_number=room_number, stream_id=stream_id).first()
+    return stream
+
+
+@app.route('/api/device_reports', methods=['POST'])
+@device_auth_required
+def receive_device_reports():
+    """
+    Accept a batch of reports queued by a device while it was offline.
+
+    Body (JSON, optionally sent with Content-Encoding: gzip):
+        stream_id: id of the device's queue
+        sent_at:   device time the batch was sent (ISO 8601, UTC)
+        reports:   list of {seq, recorded_at, room_number, window_state,
+                   ac_state, temperature, command?, decision?, reason?},
+                   oldest first
+
+    Returns the highest sequence number the device may delete from its queue,
+    covering accepted, duplicate and rejected reports alike.
+    """
+    batch = read_batch()
+    if batch is None:
+        return jsonify({'error': 'Invalid batch', 'status': 'error'}), 400
+
+    stream_id = str(batch.get('stream_id') or '')[:64]
+    reports = batch.get('reports')
+    if not stream_id or not isinstance(reports, list):
+        return jsonify({'error': 'stream_id and reports are required', 'status': 'error'}), 400
+    if len(reports) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} reports per batch', 'status': 'error'}), 413
+
+    now = datetime.utcnow()
+    offset = clock_offset(batch, now)
+    policy = GlobalPolicy.query.first()
+
+    reports = sorted(
+        (report for report in reports if isinstance(report, dict) and isinstance(report.get('seq'), int)),
+        key=lambda report: report['seq']
+    )
+
+    # A device token only covers its own room (or a gateway's rooms)
+    rooms = {str(report.get('room_number')) for report in reports}
+    if not token_covers(rooms):
+        other_rooms = sorted(rooms - set(g.device_rooms))
+        logger.warning(f"Device token for rooms {', '.join(g.device_rooms)} sent reports for rooms {other_rooms}")
+        return jsonify({'error': 'Token is not valid for this room', 'status': 'error'}), 403
+
+    accepted = duplicates = rejected = 0
+    streams = {}
+    spans = {}  # Room -> [first, last] recorded time of its accepted reports
+    last_seq = 0
+
+    for report in reports:
+        last_seq = max(last_seq, report['seq'])
+        room_number = str(report.get('room_number') or '')
+        if not room_number:
+            rejected += 1
+            continue
+
+        stream = streams.get(room_number)
+        if stream is None:
+            stream = streams[room_number] = stream_watermark(room_number, stream_id)
+        if report['seq'] <= (stream.last_seq or 0):
+            duplicates += 1
+            continue
+
+        try:
+            recorded_at = min(parse_device_time(report['recorded_at']) + offset, now)
+        except (KeyError, TypeError, ValueError):
+            recorded_at = None
+        event = report_event(report, recorded_at, policy) if recorded_at else None
+        if event is None or recorded_at < now - MAX_REPORT_AGE:
+            rejected += 1
+        else:
+            db.session.add(event)
+            accepted += 1
+            span = spans.setdefault(room_number, [recorded_at, recorded_at])
+            span[0], span[1] = min(span[0], recorded_at), max(span[1], recorded_at)
+            if not stream.last_recorded_at or recorded_at > stream.last_recorded_at:
+                stream.last_recorded_at = recorded_at
+
+        stream.last_seq = report['seq']
+        stream.updated_at = now
+
+    try:
+        # In the same transaction, so the intervals always match the event log
+        rebuilt = {room_number: (first, rebuild_room_history(room_number, first, last, now))
+                   for room_number, (first, last) in spans.items()}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error storing device reports for stream {stream_id}: {str(e)}")
+        return jsonify({'error': 'Could not store reports', 'status': 'error'}), 500
+
+    # The nightly job only fills in days without aggregates, so refresh them here
+    for room_number, (start, end) in rebuilt.items():
+        day = start.date()
+        try:
+            while day <= end.date():
+                refresh_daily_usage(day, rooms=[room_number])
+                day += timedelta(days=1)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error refreshing daily usage of room {room_number} after backfill: {str(e)}")
+
+    if accepted or rejected:
+        app.logger.info(f"Backfilled {accepted} reports from stream {stream_id} "
+                        f"({duplicates} duplicates, {rejected} rejected, clock offset {offset.total_seconds():.0f}s)")
+
+    return jsonify({
+        'status': 'success',
+        'accepted': accepted,
+        'duplicates': duplicates,
+        'rejected': rejected,
+        'ack_seq': last_seq
+    })
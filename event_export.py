@@ -0,0 +1,141 @@
+"""
+Streaming event export.
+
+Events are read in batches with yield_per (a server-side cursor where the
+database supports one) and written out as CSV, NDJSON or JSON while they are
+read, optionally gzip-compressed on the fly. Memory use stays flat whatever
+the size of the export, and the first bytes reach the client immediately.
+"""
+import csv
+import io
+import json
+import zlib
+
+from models import WindowEvent
+from temperature_utils import celsius_to_fahrenheit
+
+# Rows fetched from the database per round trip
+BATCH_SIZE = 1000
+
+# Buffer output into chunks of about this many characters before sending
+CHUNK_SIZE = 64 * 1024
+
+CSV_HEADER = ['ID', 'Room', 'Timestamp', 'Window State', 'AC State',
+              'Temperature (°F)', 'Policy Compliant', 'Compliance Issue']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+# Plain columns instead of ORM objects - nothing to track in the session
+EXPORT_COLUMNS = (
+    WindowEvent.id,
+    WindowEvent.room_number,
+    WindowEvent.timestamp,
+    WindowEvent.window_state,
+    WindowEvent.ac_state,
+    WindowEvent.temperature,
+    WindowEvent.policy_compliant,
+    WindowEvent.compliance_issue
+)
+
+
+def export_rows(query):
+    """Iterate over the export columns of a filtered WindowEvent query, newest first"""
+    return query.with_entities(*EXPORT_COLUMNS).order_by(
+        WindowEvent.timestamp.desc(), WindowEvent.id.desc()
+    ).yield_per(BATCH_SIZE)
+
+
+def csv_row(row):
+    """CSV fields for an exported event"""
+    # Convert temperature to Fahrenheit
+    temp_f = celsius_to_fahrenheit(row.temperature) if row.temperature is not None else None
+
+    return [
+        row.id,
+        row.room_number,
+        row.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        row.window_state,
+        row.ac_state,
+        f"{temp_f:.1f}" if temp_f is not None else "",
+        'Yes' if row.policy_compliant else 'No',
+        row.compliance_issue or ''
+    ]
+
+
+def json_record(row):
+    """JSON object for an exported event"""
+    # Convert temperature to Fahrenheit
+    temp_f = celsius_to_fahrenheit(row.temperature) if row.temperature is not None else None
+
+    return {
+        'id': row.id,
+        'room_number': row.room_number,
+        'timestamp': row.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'window_state': row.window_state,
+        'ac_state': row.ac_state,
+        'temperature': row.temperature,
+        'temperature_f': temp_f,
+        'unit': 'F',  # Indicate preferred unit
+        'policy_compliant': row.policy_compliant,
+        'compliance_issue': row.compliance_issue
+    }
+
+
+def iter_export(rows, format_type, header=CSV_HEADER, to_csv=csv_row, to_json=json_record, json_key='events'):
+    """
+    Render exported rows as text, one chunk at a time
+
+    Args:
+        rows (iterable): Rows from export_rows (or any rows the converters accept)
+        format_type (str): 'csv', 'ndjson' or 'json'
+        header (list): CSV header row
+        to_csv (callable): Converts a row to its CSV fields
+        to_json (callable): Converts a row to its JSON object
+        json_key (str): Key holding the list in the JSON document
+
+    Yields:
+        str: Chunks of the export, each roughly CHUNK_SIZE characters
+    """
+    buffer = io.StringIO()
+
+    if format_type == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        write = lambda row: writer.writerow(to_csv(row))
+    elif format_type == 'ndjson':
+        write = lambda row: buffer.write(json.dumps(to_json(row)) + '\n')
+    else:
+        # Same document as the original JSON export, written incrementally
+        buffer.write('{' + json.dumps(json_key) + ': [')
+        first = [True]
+
+        def write(row):
+            if not first[0]:
+                buffer.write(', ')
+            first[0] = False
+            buffer.write(json.dumps(to_json(row)))
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if format_type not in ('csv', 'ndjson'):
+        buffer.write(']}')
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,194 @@
+"""
+Keyset pagination for the event log.
+
+Pages are addressed by an opaque cursor holding the (timestamp, id) of the
+last row seen instead of an OFFSET, so the database seeks straight to the
+right place in the (timestamp, id) index and page 10,000 costs the same as
+page 1. Total counts are expensive on large tables; they are cached per filter
+and refreshed in the background by the scheduler, so the page shows an
+approximate total without ever waiting for a full scan.
+"""
+import base64
+import binascii
+import json
+import logging
+import threading
+import time as time_module
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+from models import WindowEvent
+
+logger = logging.getLogger("event_pagination")
+
+DEFAULT_PER_PAGE = 50
+
+# How long a cached total is shown before a background refresh is requested
+COUNT_TTL_SECONDS = 60
+
+# filter key -> (count, monotonic time it was computed)
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def filtered_event_query(selected_room='all', event_type='all', date_from='', date_to=''):
+    """
+    Build the WindowEvent query for the event log filters
+
+    Args:
+        selected_room (str): Room number or 'all'
+        event_type (str): 'window_opened', 'window_closed', 'ac_on', 'ac_off',
+            'policy_violation' or 'all'
+        date_from (str): First day to include ('YYYY-MM-DD'), or empty
+        date_to (str): Last day to include ('YYYY-MM-DD'), or empty
+
+    Returns:
+        Query: Unordered query of matching events
+    """
+    query = WindowEvent.query
+
+    # Apply room filter
+    if selected_room != 'all':
+        query = query.filter_by(room_number=selected_room)
+
+    # Apply event type filter
+    if event_type == 'window_opened':
+        query = query.filter_by(window_state='opened')
+    elif event_type == 'window_closed':
+        query = query.filter_by(window_state='closed')
+    elif event_type == 'ac_on':
+        query = query.filter_by(ac_state='on')
+    elif event_type == 'ac_off':
+        query = query.filter_by(ac_state='off')
+    elif event_type == 'policy_violation':
+        query = query.filter_by(policy_compliant=False)
+
+    # Apply date filters
+    if date_from:
+        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+        query = query.filter(WindowEvent.timestamp >= date_from_obj)
+
+    if date_to:
+        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
+        # Add a day to include the full end date
+        date_to_obj = date_to_obj + timedelta(days=1)
+        query = query.filter(WindowEvent.timestamp < date_to_obj)
+
+    return query
+
+
+def encode_cursor(event):
+    """Opaque cursor pointing at an event's position in the log"""
+    payload = json.dumps({'t': event.timestamp.isoformat(), 'i': event.id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Returns:
+        tuple: (timestamp, id), or None if the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload['t']), int(payload['i'])
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+
+
+def keyset_page(query, after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """
+    Fetch one page of events, newest first
+
+    Args:
+        query (Query): Filtered, unordered WindowEvent query
+        after (str, optional): Cursor of the last row of the previous page (next page)
+        before (str, optional): Cursor of the first row of the following page (previous page)
+        per_page (int): Rows per page
+
+    Returns:
+        dict: events, plus next_cursor/prev_cursor (None when there is no such page)
+    """
+    position = (WindowEvent.timestamp, WindowEvent.id)
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    if before_key:
+        # Walk towards newer rows, then flip back to newest first
+        rows = query.filter(tuple_(*position) > before_key).order_by(
+            WindowEvent.timestamp.asc(), WindowEvent.id.asc()
+        ).limit(per_page + 1).all()
+        has_newer = len(rows) > per_page
+        events = list(reversed(rows[:per_page]))
+        has_older = True
+    else:
+        if after_key:
+            query = query.filter(tuple_(*position) < after_key)
+        rows = query.order_by(
+            WindowEvent.timestamp.desc(), WindowEvent.id.desc()
+        ).limit(per_page + 1).all()
+        has_older = len(rows) > per_page
+        events = rows[:per_page]
+        has_newer = after_key is not None
+
+    return {
+        'events': events,
+        'next_cursor': encode_cursor(events[-1]) if events and has_older else None,
+        'prev_cursor': encode_cursor(events[0]) if events and has_newer else None
+    }
+
+
+def cached_event_count(filters):
+    """
+    Approximate number of events matching the filters
+
+    Returns the cached total (possibly up to COUNT_TTL_SECONDS old, plus the
+    time a refresh takes) and schedules a background refresh when it is stale.
+
+    Args:
+        filters (dict): Keyword arguments for filtered_event_query
+
+    Returns:
+        int: Cached total, or None if it has not been counted yet
+    """
+    key = tuple(sorted(filters.items()))
+
+    with _count_lock:
+        cached = _count_cache.get(key)
+
+    if cached is None or time_module.monotonic() - cached[1] > COUNT_TTL_SECONDS:
+        _schedule_count_refresh(key, filters)
+
+    return cached[0] if cached else None
+
+
+def _schedule_count_refresh(key, filters):
+    from app import scheduler
+
+    # A fixed job id per filter means a burst of page loads queues one count
+    try:
+        scheduler.add_job(
+            _refresh_event_count,
+            args=[key, filters],
+            id=f"event-count-{abs(hash(key))}",
+            replace_existing=True,
+            misfire_grace_time=None
+        )
+    except Exception as e:
+        logger.error(f"Error scheduling event count refresh: {e}")
+
+
+def _refresh_event_count(key, filters):
+    from app import app
+
+    with app.app_context():
+        try:
+            count = filtered_event_query(**filters).order_by(None).count()
+        except Exception as e:
+            logger.error(f"Error counting events for {filters}: {e}")
+            return
+
+    with _count_lock:
+        _count_cache[key] = (count, time_module.monotonic())
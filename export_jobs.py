@@ -0,0 +1,302 @@
+"""
+Background export and report jobs.
+
+Large event exports and compliance reports run in a small worker pool instead
+of a request thread. Each job writes a gzip-compressed file under
+instance/exports, reports its progress through /api/export_jobs/<id> and can
+be downloaded until it expires. An identical request (same kind, format and
+filters) made while a recent job is still queued, running or downloadable
+gets that job back instead of starting another one.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import request, jsonify, send_file
+from flask_login import login_required, current_user
+from sqlalchemy import func, case
+from app import app, db
+from models import ExportJob, WindowEvent, ACSettings
+from event_pagination import filtered_event_query
+from event_export import export_rows, iter_export, CONTENT_TYPES, BATCH_SIZE
+from temperature_utils import celsius_to_fahrenheit
+
+logger = logging.getLogger("export_jobs")
+
+EXPORT_DIR = os.path.join(app.instance_path, 'exports')
+
+# Jobs run here rather than on the scheduler's threads, so a long export never
+# delays the policy checks
+MAX_WORKERS = 2
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='export-job')
+
+# How long a finished file can be downloaded
+RESULT_TTL = timedelta(hours=24)
+
+# Identical requests within this window reuse the existing job
+REUSE_WINDOW = timedelta(minutes=15)
+
+# Jobs still marked queued/running after this long were lost (e.g. a restart)
+STALE_AFTER = timedelta(hours=2)
+
+JOB_KINDS = ('events', 'compliance')
+
+# Rows written by running jobs. Kept in memory rather than committed to the
+# job row: a commit would close the cursor the export is streaming from.
+_progress = {}
+
+COMPLIANCE_HEADER = ['Room', 'Events', 'Policy Violations', 'Window Open With AC On',
+                     'Average Temperature (°F)', 'Compliance Score']
+
+
+def job_key(kind, format_type, params):
+    """Stable hash identifying identical export requests"""
+    payload = json.dumps([kind, format_type, params], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def find_reusable_job(key):
+    """Most recent job for the same request that is still in progress or downloadable"""
+    return ExportJob.query.filter(
+        ExportJob.job_key == key,
+        ExportJob.status.in_(['queued', 'running', 'done']),
+        ExportJob.created_at >= datetime.utcnow() - REUSE_WINDOW
+    ).order_by(ExportJob.id.desc()).first()
+
+
+def compliance_rows(params):
+    """Per-room compliance summary for the filtered events, computed in one GROUP BY"""
+    query = filtered_event_query(**params)
+    return query.with_entities(
+        WindowEvent.room_number,
+        func.count(WindowEvent.id).label('events'),
+        func.sum(case((WindowEvent.policy_compliant == False, 1), else_=0)).label('violations'),  # noqa: E712
+        func.sum(case(((WindowEvent.window_state == 'opened') & (WindowEvent.ac_state == 'on'), 1),
+                      else_=0)).label('window_open_ac_on'),
+        func.avg(WindowEvent.temperature).label('avg_temperature'),
+        ACSettings.compliance_score
+    ).outerjoin(
+        ACSettings, ACSettings.room_number == WindowEvent.room_number
+    ).group_by(
+        WindowEvent.room_number, ACSettings.compliance_score
+    ).order_by(WindowEvent.room_number)
+
+
+def compliance_csv_row(row):
+    avg_f = celsius_to_fahrenheit(row.avg_temperature) if row.avg_temperature is not None else None
+    return [
+        row.room_number,
+        row.events,
+        row.violations,
+        row.window_open_ac_on,
+        f"{avg_f:.1f}" if avg_f is not None else "",
+        f"{row.compliance_score:.1f}" if row.compliance_score is not None else ""
+    ]
+
+
+def compliance_json_record(row):
+    avg_f = celsius_to_fahrenheit(row.avg_temperature) if row.avg_temperature is not None else None
+    return {
+        'room_number': row.room_number,
+        'events': row.events,
+        'policy_violations': row.violations,
+        'window_open_ac_on': row.window_open_ac_on,
+        'avg_temperature_f': round(avg_f, 1) if avg_f is not None else None,
+        'compliance_score': row.compliance_score,
+        'unit': 'F'  # Indicate preferred unit
+    }
+
+
+def counted(rows, job_id):
+    """Pass rows through, recording progress for the job"""
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % BATCH_SIZE == 0:
+            _progress[job_id] = count
+    _progress[job_id] = count
+
+
+def run_export_job(job_id):
+    """Generate a job's file (runs on the worker pool)"""
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        if not job or job.status != 'queued':
+            return
+
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        params = json.loads(job.params)
+        path = os.path.join(EXPORT_DIR, f"{job.kind}_{job.id}.{job.format}.gz")
+        partial_path = path + '.part'
+
+        try:
+            if job.kind == 'compliance':
+                rows = compliance_rows(params).all()  # One row per room
+                job.total_rows = len(rows)
+                chunks = iter_export(rows, job.format, header=COMPLIANCE_HEADER, to_csv=compliance_csv_row,
+                                     to_json=compliance_json_record, json_key='rooms')
+            else:
+                query = filtered_event_query(**params)
+                job.total_rows = query.order_by(None).count()
+                chunks = iter_export(counted(export_rows(query), job.id), job.format)
+            db.session.commit()
+
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            with gzip.open(partial_path, 'wt', encoding='utf-8', newline='') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+            os.replace(partial_path, path)
+
+            job.status = 'done'
+            job.rows_written = _progress.pop(job.id, job.total_rows)
+            job.file_path = path
+            job.file_size = os.path.getsize(path)
+            job.finished_at = datetime.utcnow()
+            job.expires_at = job.finished_at + RESULT_TTL
+            db.session.commit()
+            logger.info(f"Export job {job.id} finished: {job.rows_written} rows, {job.file_size} bytes")
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Export job {job_id} failed: {e}")
+            _progress.pop(job_id, None)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            job = db.session.get(ExportJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)[:255]
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+
+def cleanup_export_jobs():
+    """Delete expired result files and fail jobs that were lost (scheduled job)"""
+    with app.app_context():
+        now = datetime.utcnow()
+
+        expired = ExportJob.query.filter(
+            ExportJob.status == 'done',
+            ExportJob.expires_at < now
+        ).all()
+        for job in expired:
+            if job.file_path and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            job.status = 'expired'
+            job.file_path = None
+
+        stale = ExportJob.query.filter(
+            ExportJob.status.in_(['queued', 'running']),
+            ExportJob.created_at < now - STALE_AFTER
+        ).all()
+        for job in stale:
+            job.status = 'failed'
+            job.error = 'Interrupted'
+            job.finished_at = now
+
+        if expired or stale:
+            db.session.commit()
+            logger.info(f"Cleaned up {len(expired)} expired and {len(stale)} stale export jobs")
+
+
+@app.route('/api/export_jobs', methods=['POST'])
+@login_required
+def create_export_job():
+    """
+    Start a background export (or reuse an identical recent one).
+
+    JSON body or form fields:
+        kind:   'events' (default) or 'compliance'
+        format: 'csv' (default), 'ndjson' or 'json'
+        room, event_type, date_from, date_to: same filters as the event log
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or request.form
+    kind = data.get('kind', 'events')
+    format_type = data.get('format', 'csv')
+    if kind not in JOB_KINDS or format_type not in CONTENT_TYPES:
+        return jsonify({'error': 'Invalid kind or format'}), 400
+
+    params = {
+        'selected_room': data.get('room') or 'all',
+        'event_type': data.get('event_type') or 'all',
+        'date_from': data.get('date_from') or '',
+        'date_to': data.get('date_to') or ''
+    }
+    try:
+        for date_value in (params['date_from'], params['date_to']):
+            if date_value:
+                datetime.strptime(date_value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    key = job_key(kind, format_type, params)
+    job = find_reusable_job(key)
+    if job:
+        return jsonify(dict(job.to_dict(), reused=True))
+
+    job = ExportJob()
+    job.job_key = key
+    job.kind = kind
+    job.format = format_type
+    job.params = json.dumps(params)
+    job.status = 'queued'
+    job.requested_by = current_user.id
+    job.created_at = datetime.utcnow()
+    db.session.add(job)
+    db.session.commit()
+
+    executor.submit(run_export_job, job.id)
+    app.logger.info(f"Export job {job.id} ({kind}, {format_type}) queued by {current_user.username}")
+
+    return jsonify(dict(job.to_dict(), reused=False)), 202
+
+
+@app.route('/api/export_jobs/<int:job_id>')
+@login_required
+def get_export_job(job_id):
+    """Progress of an export job"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    job = db.session.get(ExportJob, job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+
+    data = job.to_dict()
+    if job.status == 'running' and job.id in _progress:
+        data['rows_written'] = _progress[job.id]
+        if job.total_rows:
+            data['progress'] = min(1.0, data['rows_written'] / job.total_rows)
+    return jsonify(data)
+
+
+@app.route('/api/export_jobs/<int:job_id>/download')
+@login_required
+def download_export_job(job_id):
+    """Download a finished export (gzip-compressed)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    job = db.session.get(ExportJob, job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    if job.status != 'done' or not job.file_path or not os.path.exists(job.file_path):
+        return jsonify({'error': f'Export is {job.status}'}), 409
+
+    created = job.created_at.strftime('%Y%m%d_%H%M%S')
+    return send_file(
+        job.file_path,
+        mimetype='application/gzip',
+        as_attachment=True,
+        download_name=f"{job.kind}_{created}.{job.format}.gz"
+    )
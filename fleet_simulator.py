@@ -0,0 +1,559 @@
+"""
+Load generator simulating a fleet of Raspberry Pi clients.
+
+Each virtual client behaves like a Pi running pi_room.RoomLink, for one room
+or, with --rooms-per-client, as a gateway for several:
+- sensors are sampled every sample interval (the temperature drifting
+  slowly), and the rooms whose report is due - state change, temperature
+  moved by the policy's threshold, or the policy's heartbeat - are sent
+  together in one /api/gateway/reports request;
+- window open/close sequences: the window opens at random (Poisson), is
+  reported right away, stays open for a while and is closed and reported
+  again;
+- IR commands at random, decided locally with the cached policy bundle and
+  recorded with /api/ir_command;
+- one long poll on /api/commands for all of its rooms, acknowledging every
+  command it receives and backing off when the server answers retry_after;
+- policy bundles revalidated with If-None-Match on /api/policy_bundles
+  periodically, and right away when a reply names a new policy version.
+
+Thousands of clients run as asyncio tasks. Short HTTP requests go through a
+thread pool of --concurrency workers, each with its own keep-alive requests
+session, so --concurrency is the most of them in flight at once. Long polls
+sit on a separate pool with a thread per client, so waiting for commands
+never holds up reports. Clients are started following a ramp profile, so the
+point where latency or errors climb shows how many rooms the server
+configuration can handle.
+
+At the end (and as progress while running) it reports throughput, p50/p95/p99
+latency and error rate per endpoint. Latency is measured around the request
+itself; time spent waiting for a free worker is reported separately as
+"queue wait" - if it grows, the generator (not the server) is the bottleneck.
+Long poll latency is mostly the server's wait; polls turned away with
+retry_after are also counted under an endpoint of their own.
+
+Simulated rooms are named <prefix><number> (sim-0001, ...), so they are easy
+to delete afterwards. Unless the server runs with DEVICE_AUTH_REQUIRED=false,
+pass --token-file with a JSON object of room number -> device token (a
+gateway client uses the token of its first room, which must cover the rest).
+
+Usage:
+    python fleet_simulator.py --server http://localhost:5000 --rooms 1000 \\
+        --duration 300 --ramp linear --ramp-seconds 120 --concurrency 64
+    python fleet_simulator.py --rooms 1000 --rooms-per-client 20 ...  # Gateways
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from policy_engine import evaluate_command, reporting_cadence
+
+IR_COMMANDS = ['POWER', 'TEMP_UP', 'TEMP_DOWN', 'MODE', 'FAN']
+
+# Largest temperature change between two sensor samples
+TEMPERATURE_DRIFT = 0.05
+
+# Seconds before a failed report is sent again, as on the Pi
+REPORT_RETRY_INTERVAL = 60
+
+
+# Ramp profiles: fraction of the fleet running at `elapsed` seconds
+def ramp_constant(elapsed, ramp_seconds):
+    return 1.0
+
+
+def ramp_linear(elapsed, ramp_seconds):
+    return min(1.0, elapsed / ramp_seconds) if ramp_seconds > 0 else 1.0
+
+
+def ramp_step(elapsed, ramp_seconds, steps=4):
+    if ramp_seconds <= 0:
+        return 1.0
+    return min(1.0, (int(elapsed / (ramp_seconds / steps)) + 1) / steps)
+
+
+def ramp_spike(elapsed, ramp_seconds):
+    # A tenth of the fleet, then everyone at once (e.g. after a network outage)
+    return 1.0 if elapsed >= ramp_seconds else 0.1
+
+
+RAMP_PROFILES = {
+    'constant': ramp_constant,
+    'linear': ramp_linear,
+    'step': ramp_step,
+    'spike': ramp_spike
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class EndpointStats:
+    """Latencies and errors for one endpoint"""
+
+    def __init__(self):
+        self.latencies_ms = []
+        self.errors = {}
+        self.queue_wait_ms = []
+
+    @property
+    def requests(self):
+        return len(self.latencies_ms) + sum(self.errors.values())
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies_ms)
+        waits = sorted(self.queue_wait_ms)
+        total = self.requests
+        return {
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+            'error_rate': round(sum(self.errors.values()) / total, 4) if total else 0.0,
+            'errors': dict(self.errors),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None,
+            'queue_wait_p95_ms': percentile(waits, 0.95)
+        }
+
+
+class FleetSimulator:
+    """
+    Runs virtual Pi clients against a server
+
+    Args:
+        server_url (str): Base URL of the server
+        rooms (int): Number of simulated rooms
+        rooms_per_client (int): Rooms each virtual Pi manages (more than one: a gateway)
+        concurrency (int): Most short HTTP requests in flight at once
+        sample_interval (float): Seconds between sensor samples per client
+        window_rate (float): Window openings per room per hour
+        ir_rate (float): IR commands per room per hour
+        policy_interval (float): Seconds between policy bundle revalidations
+        poll_wait (int): Seconds the server holds a command long poll (0: no long polls)
+        room_prefix (str): Prefix of the simulated room numbers
+        tokens (dict): Room number -> device token
+        timeout (float): Request timeout in seconds
+    """
+
+    def __init__(self, server_url, rooms=100, rooms_per_client=1, concurrency=32, sample_interval=10,
+                 window_rate=2, ir_rate=4, policy_interval=600, poll_wait=25, room_prefix='sim-',
+                 tokens=None, timeout=10):
+        self.server_url = server_url.rstrip('/')
+        self.rooms = [f"{room_prefix}{index:04d}" for index in range(1, rooms + 1)]
+        rooms_per_client = max(1, rooms_per_client)
+        self.clients = [self.rooms[index:index + rooms_per_client]
+                        for index in range(0, len(self.rooms), rooms_per_client)]
+        self.sample_interval = sample_interval
+        self.window_rate = window_rate
+        self.ir_rate = ir_rate
+        self.policy_interval = policy_interval
+        self.poll_wait = poll_wait
+        self.tokens = tokens or {}
+        self.timeout = timeout
+
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='sim-http')
+        # Long polls mostly wait - one thread per client keeps them off the request pool
+        self.poll_executor = ThreadPoolExecutor(max_workers=max(1, len(self.clients)),
+                                                thread_name_prefix='sim-poll') if poll_wait > 0 else None
+        self.concurrency = concurrency
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+        self.active_clients = 0
+        self.active_rooms = 0
+        self.started_at = None
+
+    # HTTP ------------------------------------------------------------------
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _record(self, endpoint, latency_ms=None, error=None, queue_wait_ms=None):
+        with self._stats_lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            if error is None:
+                stats.latencies_ms.append(latency_ms)
+            else:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+            if queue_wait_ms is not None:
+                stats.queue_wait_ms.append(queue_wait_ms)
+
+    def _request(self, endpoint, method, path, room_number, submitted, **kwargs):
+        """
+        Send one request (on a worker thread) and record its outcome
+
+        Returns:
+            dict: The JSON reply ({} for 304 Not Modified), or None on failure
+        """
+        queue_wait_ms = (time.perf_counter() - submitted) * 1000
+        headers = dict(kwargs.pop('headers', None) or {})
+        token = self.tokens.get(room_number)
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        timeout = kwargs.pop('timeout', self.timeout)
+
+        start = time.perf_counter()
+        try:
+            response = self._session().request(method, f"{self.server_url}{path}",
+                                               headers=headers, timeout=timeout, **kwargs)
+        except requests.Timeout:
+            self._record(endpoint, error='timeout', queue_wait_ms=queue_wait_ms)
+            return None
+        except requests.RequestException as e:
+            self._record(endpoint, error=type(e).__name__, queue_wait_ms=queue_wait_ms)
+            return None
+
+        latency_ms = round((time.perf_counter() - start) * 1000, 2)
+        if response.status_code >= 400:
+            self._record(endpoint, error=f"HTTP {response.status_code}", queue_wait_ms=queue_wait_ms)
+            return None
+        self._record(endpoint, latency_ms, queue_wait_ms=queue_wait_ms)
+        if response.status_code == 304:
+            return {}
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    async def request(self, endpoint, method, path, room_number, executor=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        return await loop.run_in_executor(
+            executor or self.executor,
+            lambda: self._request(endpoint, method, path, room_number, submitted, **kwargs)
+        )
+
+    # Virtual client ----------------------------------------------------------
+
+    def new_client(self, room_numbers):
+        """State of a virtual Pi and its rooms"""
+        return {
+            'token_room': room_numbers[0],  # A gateway's token covers all of its rooms
+            'rooms': {
+                room_number: {
+                    'room_number': room_number,
+                    'window_state': 'closed',
+                    'ac_state': random.choice(['on', 'off']),
+                    'temperature': random.uniform(20, 26),
+                    'last_report': None  # (window_state, ac_state, temperature, monotonic time, ok)
+                }
+                for room_number in room_numbers
+            },
+            'bundles': {},
+            'bundles_version': None,
+            'report_wakeup': asyncio.Event(),
+            'policy_wakeup': asyncio.Event()
+        }
+
+    @staticmethod
+    def report_due(room, bundle, now):
+        """Whether a room's report is due, by the same rules as pi_room.Room.report_due"""
+        last = room['last_report']
+        if last is None or (room['window_state'], room['ac_state']) != last[:2]:
+            return True
+        window_state, ac_state, temperature, at, ok = last
+        if not ok:
+            return now - at >= REPORT_RETRY_INTERVAL
+        temperature_delta, heartbeat_seconds = reporting_cadence(bundle)
+        return abs(room['temperature'] - temperature) >= temperature_delta or now - at >= heartbeat_seconds
+
+    @staticmethod
+    def record_report(room, ok):
+        room['last_report'] = (room['window_state'], room['ac_state'], room['temperature'], time.monotonic(), ok)
+
+    def apply_reply(self, client, room, reply):
+        """Act on the server's reply to a report or IR command"""
+        bundle = client['bundles'].get(room['room_number'])
+        if reply.get('policy_version') and reply['policy_version'] != (bundle or {}).get('version'):
+            client['policy_wakeup'].set()
+        if reply.get('force_ac_state') in ('on', 'off'):
+            room['ac_state'] = reply['force_ac_state']
+        elif reply.get('ac_state') in ('on', 'off'):
+            room['ac_state'] = reply['ac_state']
+
+    async def report_loop(self, client):
+        """Sample the sensors and send the due reports of every room in one request"""
+        while True:
+            now = time.monotonic()
+            due = []
+            for room in client['rooms'].values():
+                room['temperature'] += random.uniform(-TEMPERATURE_DRIFT, TEMPERATURE_DRIFT)
+                if self.report_due(room, client['bundles'].get(room['room_number']), now):
+                    due.append(room)
+
+            if due:
+                reply = await self.request('gateway/reports', 'POST', '/api/gateway/reports',
+                                           client['token_room'], json={'reports': [{
+                                               'room_number': room['room_number'],
+                                               'window_state': room['window_state'],
+                                               'ac_state': room['ac_state'],
+                                               'temperature': round(room['temperature'], 1)
+                                           } for room in due]})
+                results = (reply or {}).get('results', {})
+                for room in due:
+                    room_reply = results.get(room['room_number'])
+                    ok = room_reply is not None and 'status_code' not in room_reply
+                    self.record_report(room, ok)
+                    if ok:
+                        self.apply_reply(client, room, room_reply)
+
+            client['report_wakeup'].clear()
+            try:
+                # Jittered, so clients started together drift apart
+                await asyncio.wait_for(client['report_wakeup'].wait(),
+                                       self.sample_interval * random.uniform(0.9, 1.1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def window_loop(self, client, room):
+        while True:
+            await asyncio.sleep(random.expovariate(self.window_rate / 3600))
+            room['window_state'] = 'opened'
+            client['report_wakeup'].set()
+            await asyncio.sleep(random.uniform(30, 300))
+            room['window_state'] = 'closed'
+            client['report_wakeup'].set()
+
+    async def ir_loop(self, client, room):
+        while True:
+            await asyncio.sleep(random.expovariate(self.ir_rate / 3600))
+            command = random.choice(IR_COMMANDS)
+            payload = {
+                'room_number': room['room_number'],
+                'command': command,
+                'window_state': room['window_state'],
+                'ac_state': room['ac_state'],
+                'temperature': round(room['temperature'], 1)
+            }
+            # Decided on the Pi when it has the room's bundle, by the server otherwise
+            bundle = client['bundles'].get(room['room_number'])
+            if bundle:
+                decision = evaluate_command(bundle, command, room['window_state'], room['ac_state'],
+                                            room['temperature'])
+                payload['decision'] = 'allowed' if decision['allowed'] else 'blocked'
+                payload['reason'] = decision.get('reason')
+
+            reply = await self.request('ir_command', 'POST', '/api/ir_command', client['token_room'], json=payload)
+            if reply:
+                self.apply_reply(client, room, reply)
+                # The server recorded the new state along with the command
+                self.record_report(room, True)
+
+    async def policy_loop(self, client):
+        """Revalidate the policy bundles periodically, or as soon as a reply names a new version"""
+        while True:
+            headers = {}
+            if client['bundles_version']:
+                headers['If-None-Match'] = f'"{client["bundles_version"]}"'
+            reply = await self.request('policy_bundles', 'GET', '/api/policy_bundles', client['token_room'],
+                                       params={'rooms': ','.join(client['rooms'])}, headers=headers)
+            if reply and reply.get('version'):
+                client['bundles'] = reply.get('bundles', {})
+                client['bundles_version'] = reply['version']
+
+            client['policy_wakeup'].clear()
+            try:
+                await asyncio.wait_for(client['policy_wakeup'].wait(),
+                                       self.policy_interval + random.uniform(0, 60))
+            except asyncio.TimeoutError:
+                pass
+
+    async def command_loop(self, client):
+        """Long-poll the server for commands for every room, like the Pi's command channel"""
+        while True:
+            reply = await self.request('commands (long poll)', 'GET', '/api/commands', client['token_room'],
+                                       executor=self.poll_executor, timeout=self.poll_wait + 10,
+                                       params={'rooms': ','.join(client['rooms']), 'wait': self.poll_wait})
+            if reply is None:
+                await asyncio.sleep(5 + random.uniform(0, 5))  # Back off (with jitter) before reconnecting
+                continue
+            if reply.get('retry_after'):
+                # Every waiting slot on the server is taken
+                self._record('commands (turned away)', 0)
+                await asyncio.sleep(reply['retry_after'] + random.uniform(0, 5))
+
+            for command in reply.get('commands', []):
+                room = client['rooms'].get(str(command.get('room_number')))
+                if room is None:
+                    continue
+                name = command.get('command', '')
+                if name in ('turn_on', 'turn_off'):
+                    room['ac_state'] = name[len('turn_'):]
+                asyncio.ensure_future(self.request(
+                    'commands/ack', 'POST', f"/api/commands/{command['id']}/ack", client['token_room'],
+                    json={'room_number': room['room_number'], 'success': True, 'message': None}
+                ))
+                client['report_wakeup'].set()
+
+    async def client(self, room_numbers):
+        client = self.new_client(room_numbers)
+        self.active_clients += 1
+        self.active_rooms += len(room_numbers)
+        # Like the real client, every job runs concurrently
+        loops = [self.policy_loop(client), self.report_loop(client)]
+        if self.poll_wait > 0:
+            loops.append(self.command_loop(client))
+        for room in client['rooms'].values():
+            loops.append(self.window_loop(client, room))
+            if self.ir_rate > 0:
+                loops.append(self.ir_loop(client, room))
+        await asyncio.gather(*loops)
+
+    # Run ---------------------------------------------------------------------
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def report(self):
+        """Per-endpoint summary plus totals"""
+        elapsed = self.elapsed()
+        with self._stats_lock:
+            endpoints = {name: stats.summary(elapsed) for name, stats in sorted(self.stats.items())}
+        total = sum(summary['requests'] for summary in endpoints.values())
+        errors = sum(sum(summary['errors'].values()) for summary in endpoints.values())
+        return {
+            'elapsed_seconds': round(elapsed, 1),
+            'active_clients': self.active_clients,
+            'active_rooms': self.active_rooms,
+            'concurrency': self.concurrency,
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'endpoints': endpoints
+        }
+
+    async def progress(self, interval):
+        last_total = 0
+        while True:
+            await asyncio.sleep(interval)
+            with self._stats_lock:
+                total = sum(stats.requests for stats in self.stats.values())
+                errors = sum(sum(stats.errors.values()) for stats in self.stats.values())
+            print(f"[{self.elapsed():6.0f}s] clients={self.active_clients:5d} rooms={self.active_rooms:5d} "
+                  f"rps={(total - last_total) / interval:7.1f} requests={total} errors={errors}", flush=True)
+            last_total = total
+
+    async def run(self, duration, ramp='linear', ramp_seconds=60, progress_interval=10):
+        """
+        Start clients following the ramp profile and run for duration seconds
+
+        Returns:
+            dict: The report
+        """
+        ramp_profile = RAMP_PROFILES[ramp]
+        self.started_at = time.monotonic()
+        tasks = []
+        progress = asyncio.ensure_future(self.progress(progress_interval)) if progress_interval else None
+
+        try:
+            while self.elapsed() < duration:
+                wanted = int(len(self.clients) * ramp_profile(self.elapsed(), ramp_seconds))
+                while len(tasks) < wanted:
+                    tasks.append(asyncio.ensure_future(self.client(self.clients[len(tasks)])))
+                await asyncio.sleep(min(0.5, max(0.0, duration - self.elapsed())))
+        finally:
+            for task in tasks + ([progress] if progress else []):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            if self.poll_executor:
+                # Open long polls end by themselves within poll_wait seconds
+                self.poll_executor.shutdown(wait=False, cancel_futures=True)
+
+        return self.report()
+
+
+def print_report(report):
+    print(f"\nFleet simulation: {report['active_clients']} clients, {report['active_rooms']} rooms, "
+          f"{report['elapsed_seconds']}s, "
+          f"concurrency {report['concurrency']}")
+    print(f"  {report['requests']} requests, {report['throughput_rps']} req/s, "
+          f"error rate {report['error_rate'] * 100:.2f}%\n")
+
+    def ms(value):
+        return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+    print(f"  {'endpoint':<24}{'requests':>9}{'req/s':>8}{'errors':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'wait p95':>9}")
+    for name, summary in report['endpoints'].items():
+        print(f"  {name:<24}{summary['requests']:>9}{summary['throughput_rps']:>8}"
+              f"{summary['error_rate'] * 100:>7.2f}%"
+              f" {ms(summary['p50_ms'])} {ms(summary['p95_ms'])} {ms(summary['p99_ms'])}"
+              f" {ms(summary['max_ms'])} {ms(summary['queue_wait_p95_ms'])}")
+        if summary['errors']:
+            print(f"  {'':<24}errors: {summary['errors']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a fleet of Raspberry Pi AC clients')
+    parser.add_argument('--server', default='http://localhost:5000', help='Server base URL')
+    parser.add_argument('--rooms', type=int, default=100, help='Number of simulated rooms')
+    parser.add_argument('--rooms-per-client', type=int, default=1,
+                        help='Rooms per virtual Pi (more than one: gateways batching their rooms)')
+    parser.add_argument('--concurrency', type=int, default=32, help='Most short requests in flight at once')
+    parser.add_argument('--duration', type=float, default=120, help='Seconds to run')
+    parser.add_argument('--ramp', choices=sorted(RAMP_PROFILES), default='linear', help='How clients are started')
+    parser.add_argument('--ramp-seconds', type=float, default=60, help='Length of the ramp')
+    parser.add_argument('--sample-interval', type=float, default=10, help='Seconds between sensor samples')
+    parser.add_argument('--window-rate', type=float, default=2, help='Window openings per room per hour')
+    parser.add_argument('--ir-rate', type=float, default=4, help='IR commands per room per hour')
+    parser.add_argument('--policy-interval', type=float, default=600,
+                        help='Seconds between policy bundle revalidations')
+    parser.add_argument('--poll-wait', type=int, default=25,
+                        help='Seconds the server holds a command long poll (0: no long polls)')
+    parser.add_argument('--room-prefix', default='sim-', help='Prefix of simulated room numbers')
+    parser.add_argument('--token-file', help='JSON file of room number -> device token')
+    parser.add_argument('--timeout', type=float, default=10, help='Request timeout in seconds')
+    parser.add_argument('--progress', type=float, default=10, help='Seconds between progress lines (0: off)')
+    parser.add_argument('--seed', type=int, help='Random seed, for repeatable runs')
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    tokens = {}
+    if args.token_file:
+        with open(args.token_file) as f:
+            tokens = json.load(f)
+
+    simulator = FleetSimulator(
+        args.server, rooms=args.rooms, rooms_per_client=args.rooms_per_client, concurrency=args.concurrency,
+        sample_interval=args.sample_interval, window_rate=args.window_rate, ir_rate=args.ir_rate,
+        policy_interval=args.policy_interval, poll_wait=args.poll_wait,
+        room_prefix=args.room_prefix, tokens=tokens, timeout=args.timeout
+    )
+    try:
+        report = asyncio.run(simulator.run(args.duration, args.ramp, args.ramp_seconds, args.progress))
+    except KeyboardInterrupt:
+        report = simulator.report()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['error_rate'] > 0.01 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
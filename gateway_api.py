@@ -0,0 +1,112 @@
+"""
+Batched endpoints for gateway Raspberry Pis that manage several rooms.
+
+A gateway (pi_gateway.py) reads the window sensors and drives the IR emitters
+of several rooms from one process. Instead of one request per room it sends
+all the rooms' due status reports in one request and fetches all their policy
+bundles in another, so the server sees one device and a fraction of the
+requests. Each report is processed exactly as a report to /receive_data.
+Commands for the rooms are long-polled on /api/commands?rooms=... (see
+command_channel.py).
+
+The single room client (raspberry_pi_ir_client.py) uses the same endpoints,
+as a gateway with one room.
+"""
+import hashlib
+import json
+import logging
+
+from flask import request, jsonify, g
+from app import app
+from models import ACSettings, GlobalPolicy
+from device_auth import device_auth_required, requested_rooms, token_covers
+from device_reports import read_batch
+from policy_engine import build_bundle
+
+logger = logging.getLogger("gateway_api")
+
+# Most rooms in one batch of live reports
+MAX_ROOMS_PER_BATCH = 100
+
+
+def bundles_version(bundles):
+    """Version of a set of room bundles: changes whenever any of them does"""
+    versions = {room_number: bundle['version'] for room_number, bundle in bundles.items()}
+    encoded = json.dumps(versions, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+@app.route('/api/gateway/reports', methods=['POST'])
+@device_auth_required
+def receive_gateway_reports():
+    """
+    Live status reports for several rooms in one request.
+
+    Body (JSON, optionally sent with Content-Encoding: gzip):
+        reports: list of {room_number, window_state, ac_state, temperature},
+                 at most one per room
+
+    Returns each room's reply, as /receive_data would have returned it, under
+    results[room_number]. A report that cannot be processed gets an error
+    reply without affecting the others.
+    """
+    batch = read_batch()
+    reports = batch.get('reports') if batch else None
+    if not isinstance(reports, list) or not all(isinstance(report, dict) for report in reports):
+        return jsonify({'error': 'reports is required', 'status': 'error'}), 400
+    if len(reports) > MAX_ROOMS_PER_BATCH:
+        return jsonify({'error': f'At most {MAX_ROOMS_PER_BATCH} reports per batch', 'status': 'error'}), 413
+
+    rooms = {str(report.get('room_number') or '') for report in reports}
+    if not token_covers(rooms):
+        logger.warning(f"Gateway token for rooms {', '.join(g.device_rooms)} sent reports for rooms "
+                       f"{sorted(rooms - set(g.device_rooms))}")
+        return jsonify({'error': 'Token is not valid for this room', 'status': 'error'}), 403
+
+    from routes import process_status_reports
+
+    reports = [dict(report, room_number=str(report.get('room_number') or '')) for report in reports]
+    results = {}
+    for report, (payload, status_code) in zip(reports, process_status_reports(reports)):
+        if status_code != 200:
+            payload = dict(payload, status_code=status_code)
+        results[report['room_number']] = payload
+
+    return jsonify({'status': 'success', 'results': results})
+
+
+@app.route('/api/policy_bundles')
+@device_auth_required
+def policy_bundles():
+    """
+    The policy bundles of several rooms (see /api/policy_bundle/<room>).
+
+    Query parameter:
+        rooms: comma-separated room numbers (default: every room of the token)
+
+    The ETag is a version covering every bundle, so a gateway revalidating
+    with If-None-Match gets a 304 until any of its rooms' policies changes.
+    """
+    rooms = requested_rooms()
+    if not rooms:
+        return jsonify({'error': 'rooms is required', 'status': 'error'}), 400
+    if len(rooms) > MAX_ROOMS_PER_BATCH:
+        return jsonify({'error': f'At most {MAX_ROOMS_PER_BATCH} rooms', 'status': 'error'}), 413
+    if not token_covers(rooms):
+        return jsonify({'error': 'Token is not valid for this room', 'status': 'error'}), 403
+
+    policy = GlobalPolicy.query.first()
+    settings = {settings.room_number: settings
+                for settings in ACSettings.query.filter(ACSettings.room_number.in_(rooms)).all()}
+    bundles = {room_number: build_bundle(policy, settings[room_number], room_number)
+               for room_number in rooms if room_number in settings}
+
+    version = bundles_version(bundles)
+    response = jsonify({
+        'version': version,
+        'bundles': bundles,
+        'missing': [room_number for room_number in rooms if room_number not in settings]
+    })
+    response.set_etag(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, time
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
@@ -62,6 +63,13 @@ class GlobalPolicy(db.Model):
     energy_conservation_active = db.Column(db.Boolean, default=False)
     conservation_threshold = db.Column(db.Float, default=24.0)        # Temperature threshold for conservation mode
 
+    # Sensor anomaly handling
+    quarantine_noisy_rooms = db.Column(db.Boolean, default=False)     # Stop flapping windows from triggering pending events
+
+    # Raspberry Pi reporting cadence
+    report_temperature_delta = db.Column(db.Float, default=0.5)       # Temperature change (°C) that is reported right away
+    report_heartbeat_seconds = db.Column(db.Integer, default=300)     # Longest time between reports while nothing changes
+
     def __init__(self):
         pass  # Use default values
 
@@ -83,11 +91,21 @@ class ACSettings(db.Model):
     window_open_minutes = db.Column(db.Integer, default=0)    # Minutes with window open and AC on in the last 24 hours
     temperature_deviation = db.Column(db.Float, default=0.0)  # Average deviation from policy temperature
     compliance_score = db.Column(db.Float, default=100.0)     # Overall compliance score (0-100)
+    
+    # Energy analytics
+    power_rating_kw = db.Column(db.Float, nullable=True)  # Power draw of the AC unit while running (None = fleet default)
 
     def __init__(self, room_number=None):
         self.room_number = room_number
 
 class WindowEvent(db.Model):
+    __table_args__ = (
+        # Per-room time range scans (recent events, temperature history)
+        db.Index('ix_window_event_room_timestamp', 'room_number', 'timestamp'),
+        # Keyset pagination of the event log, newest first
+        db.Index('ix_window_event_timestamp_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -98,6 +116,26 @@ class WindowEvent(db.Model):
     policy_compliant = db.Column(db.Boolean, default=True)
     compliance_issue = db.Column(db.String(100), nullable=True)
 
+    # Not stored: set on events a device uploads after the fact, so the change
+    # bus does not announce them as live
+    backfilled = False
+
+    def to_dict(self):
+        """JSON-ready view of the event, as shown in the recent events table"""
+        from temperature_utils import celsius_to_fahrenheit
+
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp.strftime('%Y-%m-%d %H:%M:%S') if self.timestamp else None,
+            'window_state': self.window_state,
+            'ac_state': self.ac_state,
+            'temperature': self.temperature,
+            'temperature_f': celsius_to_fahrenheit(self.temperature),
+            'unit': 'F',  # Indicate preferred unit
+            'policy_compliant': self.policy_compliant,
+            'compliance_issue': self.compliance_issue
+        }
+
 class PendingWindowEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'))
@@ -109,6 +147,16 @@ class PendingWindowEvent(db.Model):
     processed = db.Column(db.Boolean, default=False)  # Whether this event has been processed
     event_type = db.Column(db.String(20), default='window_open')  # Type of event (window_open, scheduled, etc.)
 
+    def to_dict(self):
+        """JSON-ready view of the pending action"""
+        return {
+            'id': self.id,
+            'event_type': self.event_type,
+            'ac_state': self.ac_state,
+            'scheduled_action_time': self.scheduled_action_time.isoformat() if self.scheduled_action_time else None,
+            'processed': self.processed
+        }
+
 class RoomStatus(db.Model):
     """Current status of a room - updated continuously from events"""
     id = db.Column(db.Integer, primary_key=True)
@@ -124,6 +172,11 @@ class RoomStatus(db.Model):
     non_compliant_since = db.Column(db.DateTime, nullable=True)  # When temperature became non-compliant
     policy_violation_type = db.Column(db.String(50), nullable=True)  # Type of violation (too low, too high, etc.)
     
+    # Sensor anomaly tracking
+    anomaly_flags = db.Column(db.String(100), nullable=True)  # Comma-separated anomalies (stuck_sensor, window_flapping)
+    anomaly_since = db.Column(db.DateTime, nullable=True)  # When the current anomalies were first detected
+    quarantined = db.Column(db.Boolean, default=False)  # Window changes do not trigger pending events
+    
     def __init__(self, **kwargs):
         """Initialize a room status with kwargs support"""
         self.room_number = kwargs.get('room_number')
@@ -145,6 +198,168 @@ class RoomStatus(db.Model):
         self.has_pending_event = kwargs.get('has_pending_event', False)
         self.pending_event_time = kwargs.get('pending_event_time')
 
+    def to_summary(self):
+        """Compact, JSON-ready view of the live room state used by the dashboard APIs"""
+        from temperature_utils import celsius_to_fahrenheit
+
+        return {
+            'window_state': self.window_state,
+            'ac_state': self.ac_state,
+            'temperature': self.current_temperature,
+            'temperature_f': celsius_to_fahrenheit(self.current_temperature),
+            'has_pending_event': self.has_pending_event,
+            'pending_event_time': self.pending_event_time.isoformat() if self.pending_event_time else None,
+            'non_compliant_since': self.non_compliant_since.isoformat() if self.non_compliant_since else None,
+            'policy_violation_type': self.policy_violation_type,
+            'anomalies': self.anomaly_flags.split(',') if self.anomaly_flags else [],
+            'quarantined': bool(self.quarantined),
+            'last_updated': self.last_updated.isoformat() if self.last_updated else None
+        }
+
+class DeviceCommand(db.Model):
+    """Command queued for a room's Raspberry Pi client, with its delivery receipt"""
+    id = db.Column(db.Integer, primary_key=True)
+    room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'), index=True)
+    command = db.Column(db.String(30))  # 'turn_on', 'turn_off' or 'set_temp_<n>'
+    source = db.Column(db.String(30))  # What queued it (send_command, force_ac_state, ...)
+    status = db.Column(db.String(20), default='queued')  # queued, delivered, executed, failed or expired
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime, nullable=True)  # When the client first received it
+    acked_at = db.Column(db.DateTime, nullable=True)  # When the client reported executing it
+    result = db.Column(db.String(100), nullable=True)  # Message reported by the client
+
+    def delivery_latency_ms(self):
+        """Milliseconds from queueing to the client's acknowledgement"""
+        if not self.acked_at or not self.created_at:
+            return None
+        return int((self.acked_at - self.created_at).total_seconds() * 1000)
+
+    def to_dict(self):
+        """JSON-ready view of the command, as sent to clients"""
+        return {
+            'id': self.id,
+            'room_number': self.room_number,
+            'command': self.command,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'delivery_latency_ms': self.delivery_latency_ms()
+        }
+
+class ExportJob(db.Model):
+    """Export or report generated in the background, with its downloadable result"""
+    id = db.Column(db.Integer, primary_key=True)
+    job_key = db.Column(db.String(64), index=True)  # Hash of kind, format and filters - identical requests share a job
+    kind = db.Column(db.String(20))  # 'events' or 'compliance'
+    format = db.Column(db.String(10))  # 'csv', 'ndjson' or 'json'
+    params = db.Column(db.Text)  # JSON-encoded filters
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed or expired
+    requested_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    total_rows = db.Column(db.Integer, nullable=True)
+    rows_written = db.Column(db.Integer, default=0)
+    file_path = db.Column(db.String(255), nullable=True)  # Gzip-compressed result on local disk
+    file_size = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)  # When the result file is deleted
+
+    def progress(self):
+        """Fraction of rows written so far (None while the total is unknown)"""
+        if self.status == 'done':
+            return 1.0
+        if not self.total_rows:
+            return None
+        return min(1.0, (self.rows_written or 0) / self.total_rows)
+
+    def to_dict(self):
+        """JSON-ready view of the job, for the progress endpoint"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'format': self.format,
+            'params': json.loads(self.params) if self.params else {},
+            'status': self.status,
+            'total_rows': self.total_rows,
+            'rows_written': self.rows_written,
+            'progress': self.progress(),
+            'file_size': self.file_size,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class StateInterval(db.Model):
+    """Period during which a room was in a state (AC on, window open); end is None while ongoing"""
+    __table_args__ = (
+        # Range scans per room and kind: intervals ending after / starting before a point in time
+        db.Index('ix_state_interval_room_kind_start', 'room_number', 'kind', 'start'),
+        db.Index('ix_state_interval_room_kind_end', 'room_number', 'kind', 'end'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'))
+    kind = db.Column(db.String(20))  # 'ac_on' or 'window_open'
+    start = db.Column(db.DateTime, nullable=False)
+    end = db.Column(db.DateTime, nullable=True)
+
+    def duration_seconds(self, now=None):
+        """Length of the interval so far"""
+        end = self.end or now or datetime.utcnow()
+        return max(0.0, (end - self.start).total_seconds())
+
+class RoomDailyUsage(db.Model):
+    """Per-room, per-day runtime totals, pre-aggregated from state intervals for analytics"""
+    __table_args__ = (
+        db.UniqueConstraint('room_number', 'day', name='uq_room_daily_usage_room_day'),
+        db.Index('ix_room_daily_usage_day', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'))
+    floor = db.Column(db.String(10))  # Derived from the room number
+    day = db.Column(db.Date, nullable=False)  # UTC day
+    ac_on_seconds = db.Column(db.Float, default=0.0)
+    window_open_seconds = db.Column(db.Float, default=0.0)
+    window_open_ac_on_seconds = db.Column(db.Float, default=0.0)  # Cooling with the window open
+    energy_kwh = db.Column(db.Float, default=0.0)  # Estimated from runtime and the unit's power rating
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DeviceToken(db.Model):
+    """API token issued to a room's Raspberry Pi client"""
+    id = db.Column(db.Integer, primary_key=True)
+    room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'), index=True)
+    label = db.Column(db.String(64), nullable=True)  # e.g. "Pi by the window"
+    token_prefix = db.Column(db.String(12))  # First characters of the token, to recognise it in the admin UI
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)  # HMAC-SHA256 of the token; the token itself is never stored
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=True)  # Updated at most every few minutes
+    revoked = db.Column(db.Boolean, default=False)
+    gateway_rooms = db.Column(db.Text, nullable=True)  # Further rooms a gateway Pi manages, comma-separated
+
+    def rooms(self):
+        """Every room the token is valid for, its own room first"""
+        rooms = [self.room_number]
+        for room_number in (self.gateway_rooms or '').split(','):
+            room_number = room_number.strip()
+            if room_number and room_number not in rooms:
+                rooms.append(room_number)
+        return rooms
+
+class DeviceReportStream(db.Model):
+    """Highest report sequence number accepted from a device's offline queue"""
+    __table_args__ = (
+        db.UniqueConstraint('room_number', 'stream_id', name='uq_device_report_stream'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    room_number = db.Column(db.String(10), db.ForeignKey('user.room_number'), nullable=False)
+    stream_id = db.Column(db.String(64), nullable=False)  # Random id of the device's queue file; a new file starts a new stream
+    last_seq = db.Column(db.Integer, default=0)  # Reports at or below this sequence number are duplicates
+    last_recorded_at = db.Column(db.DateTime, nullable=True)  # Device time of the newest accepted report
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class SessionAtributes():
     def __init__(self, room_number, is_admin):
         self.room_number = room_number
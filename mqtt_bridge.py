@@ -0,0 +1,453 @@
+"""
+Optional MQTT ingestion bridge for Raspberry Pi telemetry.
+
+An HTTP request per status report costs a connection (or at least a request
+round trip), header parsing, token verification and an app context for every
+report. Devices that publish to an MQTT broker instead keep one connection
+open, and this bridge - one subscriber on the server - drains their messages
+and processes them in batches, one app context and transaction per batch,
+through the same logic as /receive_data (routes.process_status_reports).
+
+Topics, under MQTT_TOPIC_PREFIX (default "ac"):
+    ac/<room>/telemetry  device -> server: {"window_state", "ac_state", "temperature"}
+    ac/<room>/reply      server -> device: the reply /receive_data would have sent
+    ac/<room>/commands   server -> device: commands queued by send_command and
+                         force_ac_state, as returned by /api/commands/<room>
+    ac/<room>/ack        device -> server: {"id", "success", "message"}
+
+The room is taken from the topic, so which device may publish for which room
+is up to the broker's ACLs (give each device credentials for ac/<room>/# only).
+Commands are published to rooms that have sent telemetry over MQTT since the
+server started; other rooms keep receiving theirs over the HTTP command
+channel.
+
+Only one process may run the bridge, or every message would be processed
+once per process: with several gunicorn workers on a host, the first to take
+the lock file at MQTT_BRIDGE_LOCK_PATH starts it and the others skip it.
+Commands are forwarded from the change bus, which only sees commands queued
+in its own process, so run the server as a single process anyway (see
+change_bus.py). Across several hosts, set MQTT_BRIDGE_ENABLED on one only.
+
+The bridge is off unless MQTT_BRIDGE_ENABLED=true, and needs paho-mqtt
+(pip install paho-mqtt). LocalBroker is an in-process stand-in for a broker
+with the same client interface, for tests and trying the bridge out without
+one.
+"""
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+logger = logging.getLogger("mqtt_bridge")
+
+MQTT_BRIDGE_ENABLED = os.environ.get('MQTT_BRIDGE_ENABLED', 'false').lower() == 'true'
+MQTT_BROKER_HOST = os.environ.get('MQTT_BROKER_HOST', 'localhost')
+MQTT_BROKER_PORT = int(os.environ.get('MQTT_BROKER_PORT', '1883'))
+MQTT_USERNAME = os.environ.get('MQTT_USERNAME')
+MQTT_PASSWORD = os.environ.get('MQTT_PASSWORD')
+MQTT_TOPIC_PREFIX = os.environ.get('MQTT_TOPIC_PREFIX', 'ac')
+
+# Held by the one process on this host that runs the bridge
+MQTT_BRIDGE_LOCK_PATH = os.environ.get('MQTT_BRIDGE_LOCK_PATH',
+                                       os.path.join(tempfile.gettempdir(), 'ac-control-mqtt-bridge.lock'))
+
+# Most messages processed in one batch, and the longest a message waits for
+# its batch to fill up (seconds)
+BATCH_SIZE = 200
+BATCH_INTERVAL = 0.05
+
+# Messages waiting to be processed; beyond this, new ones are dropped
+MAX_PENDING = 10000
+
+# QoS of subscriptions and of messages published to devices (at least once)
+QOS = 1
+
+Message = namedtuple("Message", ["topic", "payload", "qos", "retain"])
+
+
+def topic_matches(pattern, topic):
+    """Whether an MQTT topic matches a subscription pattern with + and # wildcards"""
+    pattern_levels = pattern.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(pattern_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+class LocalBroker:
+    """In-process stand-in for an MQTT broker; messages are delivered synchronously"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = []
+
+    def client(self):
+        """A new client of this broker, with the subset of paho's Client the bridge uses"""
+        client = LocalClient(self)
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        message = Message(topic, payload, qos, retain)
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client._deliver(message)
+
+
+class LocalClient:
+    """A LocalBroker connection, used like paho.mqtt.client.Client"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_message = None
+        self.connected = False
+        self._subscriptions = []
+
+    def connect_async(self, host=None, port=None, keepalive=60):
+        pass
+
+    def loop_start(self):
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    def loop_stop(self):
+        self.connected = False
+
+    def disconnect(self):
+        self.connected = False
+
+    def subscribe(self, topic, qos=0):
+        self._subscriptions.append(topic)
+        return 0, len(self._subscriptions)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload or b'', qos, retain)
+
+    def _deliver(self, message):
+        if self.connected and self.on_message and \
+                any(topic_matches(pattern, message.topic) for pattern in self._subscriptions):
+            self.on_message(self, None, message)
+
+
+class MQTTBridge:
+    """
+    Moves device messages from an MQTT connection to batched processing and back
+
+    Args:
+        client: Connected-on-start MQTT client (paho Client or LocalClient)
+        process_reports (callable): List of status reports -> list of
+            (room number, reply) pairs, one per report
+        process_acks (callable, optional): List of (room number, ack) pairs -> None
+        claim_commands (callable, optional): Room number -> list of command
+            dicts to publish to it
+        topic_prefix (str): First level of every topic
+        batch_size (int): Most messages per batch
+        batch_interval (float): Longest wait for a batch to fill up (seconds)
+        max_pending (int): Most messages waiting to be processed
+    """
+
+    def __init__(self, client, process_reports, process_acks=None, claim_commands=None,
+                 topic_prefix=MQTT_TOPIC_PREFIX, batch_size=BATCH_SIZE,
+                 batch_interval=BATCH_INTERVAL, max_pending=MAX_PENDING):
+        self.client = client
+        self.process_reports = process_reports
+        self.process_acks = process_acks
+        self.claim_commands = claim_commands
+        self.topic_prefix = topic_prefix
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self.rooms = set()  # Rooms that have sent telemetry over MQTT
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._running = False
+        self._thread = None
+        # Updated from the MQTT client's thread, the bridge's thread and the command forwarder
+        self._counters_lock = threading.Lock()
+        self.counters = {"received": 0, "invalid": 0, "dropped": 0, "reports": 0, "acks": 0,
+                         "batches": 0, "replies": 0, "commands": 0, "errors": 0}
+
+    def count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    # MQTT side (the client's network thread) -----------------------------------
+
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        # Subscribing here also resubscribes after a reconnect
+        if rc != 0:
+            logger.error(f"MQTT connection refused (code {rc})")
+            return
+        client.subscribe(f"{self.topic_prefix}/+/telemetry", QOS)
+        client.subscribe(f"{self.topic_prefix}/+/ack", QOS)
+        logger.info(f"MQTT bridge subscribed to {self.topic_prefix}/+/telemetry")
+
+    def _on_message(self, client, userdata, message):
+        """Parse a message and queue it; processing happens on the bridge's own thread"""
+        self.count("received")
+        levels = message.topic.split('/')
+        try:
+            data = json.loads(message.payload)
+        except (ValueError, UnicodeDecodeError):
+            data = None
+        if len(levels) != 3 or not levels[1] or not isinstance(data, dict):
+            self.count("invalid")
+            return
+
+        room_number, kind = levels[1], levels[2]
+        if kind == 'telemetry':
+            # The topic, not the payload, says which room this is
+            item = ('report', room_number, dict(data, room_number=room_number))
+        elif kind == 'ack' and isinstance(data.get('id'), int):
+            item = ('ack', room_number, data)
+        else:
+            self.count("invalid")
+            return
+
+        try:
+            self._pending.put_nowait(item)
+        except queue.Full:
+            self.count("dropped")
+
+    # Processing (the bridge's thread) ---------------------------------------
+
+    def _next_batch(self, timeout):
+        """Wait for a message, then collect more until the batch is full or its time is up"""
+        try:
+            batch = [self._pending.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def process_batch(self, batch):
+        """Process a batch of queued messages and publish the replies"""
+        reports = [data for kind, _, data in batch if kind == 'report']
+        acks = [(room_number, data) for kind, room_number, data in batch if kind == 'ack']
+        self.count("batches")
+
+        if reports:
+            new_rooms = {report['room_number'] for report in reports} - self.rooms
+            self.rooms.update(new_rooms)
+            for room_number, reply in self.process_reports(reports):
+                self.publish(room_number, 'reply', reply)
+                self.count("replies")
+            self.count("reports", len(reports))
+
+            # Commands queued before a room was first heard from over MQTT
+            for room_number in new_rooms:
+                self.forward_commands(room_number)
+
+        if acks and self.process_acks:
+            self.process_acks(acks)
+            self.count("acks", len(acks))
+
+    def _run(self):
+        while self._running:
+            batch = self._next_batch(timeout=0.5)
+            if not batch:
+                continue
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                self.count("errors")
+                logger.error(f"Error processing a batch of {len(batch)} MQTT messages: {e}")
+
+    def forward_commands(self, room_number):
+        """Publish a room's pending commands, if the room is on MQTT"""
+        if self.claim_commands is None or room_number not in self.rooms:
+            return 0
+        commands = self.claim_commands(room_number)
+        for command in commands:
+            self.publish(room_number, 'commands', command)
+        self.count("commands", len(commands))
+        return len(commands)
+
+    def publish(self, room_number, kind, data):
+        self.client.publish(f"{self.topic_prefix}/{room_number}/{kind}",
+                            json.dumps(data, separators=(',', ':')), qos=QOS)
+
+    # Lifecycle ---------------------------------------------------------------
+
+    def start(self):
+        """Start processing and connect the client"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="mqtt-bridge", daemon=True)
+        self._thread.start()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.loop_stop()
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def pending(self):
+        return self._pending.qsize()
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return dict(counters, pending=self.pending(), rooms=len(self.rooms))
+
+
+# Server wiring ---------------------------------------------------------------
+
+def process_reports(reports):
+    """Apply status reports as /receive_data does, in one app context and transaction"""
+    from app import app
+    from routes import process_status_reports
+
+    replies = []
+    with app.app_context():
+        for report, (payload, status_code) in zip(reports, process_status_reports(reports)):
+            if status_code != 200:
+                payload = dict(payload, status_code=status_code)
+            replies.append((report['room_number'], payload))
+    return replies
+
+
+def process_acks(acks):
+    """Record command acknowledgements sent over MQTT"""
+    from app import app, db
+    from models import DeviceCommand
+    from command_channel import record_acknowledgement
+
+    with app.app_context():
+        for room_number, ack in acks:
+            command = db.session.get(DeviceCommand, ack['id'])
+            if command is None or command.room_number != room_number:
+                logger.warning(f"Ignoring MQTT ack from room {room_number} for command {ack['id']}")
+                continue
+            record_acknowledgement(command, ack.get('success', True), ack.get('message'))
+
+
+def claim_commands(room_number):
+    """A room's undelivered commands, marked as delivered"""
+    from app import app
+    from command_channel import claim_pending_commands
+
+    with app.app_context():
+        return [command.to_dict() for command in claim_pending_commands(room_number)]
+
+
+def forward_queued_commands(bridge):
+    """Publish commands to MQTT rooms as soon as they are queued (runs on its own thread)"""
+    from change_bus import bus
+
+    subscription = bus.subscribe(kinds=['command'])
+    try:
+        while bridge._running:
+            for room_number in {change.room_number for change in subscription.get(timeout=1)}:
+                try:
+                    bridge.forward_commands(room_number)
+                except Exception as e:
+                    logger.error(f"Error publishing commands for room {room_number}: {e}")
+    finally:
+        bus.unsubscribe(subscription)
+
+
+def create_client():
+    """
+    A paho-mqtt client for the configured broker
+
+    Returns:
+        paho.mqtt.client.Client: The client, not yet connected; None if
+        paho-mqtt is not installed
+    """
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        logger.warning("MQTT bridge enabled but paho-mqtt is not installed (pip install paho-mqtt)")
+        return None
+
+    client_id = f"ac-control-bridge-{uuid.uuid4().hex[:8]}"
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        # paho-mqtt 2.x: keep the 1.x callback signatures the bridge uses
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id)
+    else:
+        client = mqtt.Client(client_id=client_id)
+    if MQTT_USERNAME:
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    client.connect_async(MQTT_BROKER_HOST, MQTT_BROKER_PORT, keepalive=60)
+    return client
+
+
+bridge = None
+_bridge_lock = None
+
+
+def claim_bridge_lock(path=MQTT_BRIDGE_LOCK_PATH):
+    """
+    Take the lock that lets this process run the bridge; it is held until the process exits
+
+    Returns:
+        bool: Whether this process holds the lock
+    """
+    global _bridge_lock
+    try:
+        import fcntl
+    except ImportError:
+        return True  # No flock on this platform - run a single server process
+
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _bridge_lock = lock_file
+    return True
+
+
+def start_bridge(client=None):
+    """
+    Start the bridge (if MQTT_BRIDGE_ENABLED, or for the given client)
+
+    Args:
+        client: MQTT client to use instead of connecting to the configured
+                broker (e.g. LocalBroker().client())
+
+    Returns:
+        MQTTBridge: The running bridge, or None if it is disabled or another
+                    process runs it
+    """
+    global bridge
+    if client is None:
+        if not MQTT_BRIDGE_ENABLED:
+            return None
+        if not claim_bridge_lock():
+            logger.info(f"MQTT bridge already running in another process ({MQTT_BRIDGE_LOCK_PATH} is locked)")
+            return None
+        client = create_client()
+        if client is None:
+            return None
+
+    bridge = MQTTBridge(client, process_reports, process_acks, claim_commands)
+    bridge.start()
+    threading.Thread(target=forward_queued_commands, args=(bridge,),
+                     name="mqtt-commands", daemon=True).start()
+    logger.info(f"MQTT bridge started on topics {MQTT_TOPIC_PREFIX}/<room>/...")
+    return bridge
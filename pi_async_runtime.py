@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Asyncio runtime for the Raspberry Pi client
+
+Everything the client does runs on one event loop:
+
+- GPIO and IR inputs (which arrive on the input pipeline's thread) only post
+  an event with post_event(); a handler coroutine is started for each event.
+- Blocking work is handed to thread pools and awaited with a timeout:
+  network calls go to the "io" pool, and IR transmission and AC state changes
+  go to a single-threaded "device" pool, so remote-control commands are
+  applied one at a time and in the order they arrived.
+- Periodic jobs (status updates, policy refresh, URL refresh, offline queue
+  delivery) are coroutines that sleep until their interval passes or until
+  something wakes them early.
+
+A slow or dead server therefore only ever holds up the task waiting for it,
+never the handling of the next IR code or window change.
+
+The HTTP calls themselves still use the pooled requests session: a timed-out
+or cancelled call stops being waited for immediately, and its thread is
+released once the session's own connect/read timeouts expire. This needs no
+packages beyond the standard library and requests.
+"""
+import asyncio
+import logging
+import random
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("AC_Controller.runtime")
+
+
+class Wakeup:
+    """Lets any thread cut short a coroutine's wait (e.g. "send a status update now")"""
+
+    def __init__(self, runtime):
+        self._runtime = runtime
+        self._event = asyncio.Event()
+
+    def set(self):
+        """Wake the waiting coroutine; safe to call from any thread"""
+        loop = self._runtime.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._event.set()
+        else:
+            loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout):
+        """Wait until set() is called or the timeout passes"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+class AsyncRuntime:
+    """Event loop, thread pools and task bookkeeping for the client"""
+
+    def __init__(self, io_workers=4):
+        self.loop = None
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="ac-io")
+        self.device_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ac-device")
+        self._handlers = {}
+        self._events = None
+        self._tasks = set()
+        self._stopped = None
+
+    def on(self, kind, handler):
+        """Register the coroutine function that handles events of a kind"""
+        self._handlers[kind] = handler
+
+    def wakeup(self):
+        return Wakeup(self)
+
+    def post_event(self, kind, data=None):
+        """
+        Queue an event for its handler; safe to call from any thread
+
+        Args:
+            kind (str): Event kind, as registered with on()
+            data: Passed to the handler
+        """
+        if self.loop is None or self.loop.is_closed():
+            logger.warning(f"Runtime not running, dropping {kind} event")
+            return
+        self.loop.call_soon_threadsafe(self._events.put_nowait, (kind, data))
+
+    def spawn(self, coro, name=None):
+        """Run a coroutine in the background, logging any error it raises"""
+        task = asyncio.ensure_future(coro)
+        if name:
+            task.set_name(name)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Task {task.get_name()} failed: {task.exception()!r}")
+
+    async def run_io(self, func, *args, timeout=None):
+        """Run a blocking network call in the io pool, giving up after timeout seconds"""
+        return await self._run(self.io_executor, func, args, timeout)
+
+    async def run_device(self, func, *args, timeout=None):
+        """Run IR/GPIO work in the device pool, one call at a time, in order"""
+        return await self._run(self.device_executor, func, args, timeout)
+
+    async def _run(self, executor, func, args, timeout):
+        future = self.loop.run_in_executor(executor, func, *args)
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    async def periodic(self, name, func, interval, wakeup=None, jitter=0.0, first_delay=0.0):
+        """
+        Run a coroutine function forever, every interval seconds
+
+        Args:
+            name (str): For log messages
+            func: Coroutine function to run
+            interval (float): Seconds between runs
+            wakeup (Wakeup, optional): Starts the next run early when set
+            jitter (float): Up to this many seconds are added to each wait
+            first_delay (float): Seconds to wait before the first run
+        """
+        if first_delay:
+            await asyncio.sleep(first_delay)
+        while True:
+            try:
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in {name}: {e!r}")
+
+            delay = interval + random.uniform(0, jitter)
+            if wakeup is not None:
+                await wakeup.wait(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    async def _dispatch(self):
+        while True:
+            kind, data = await self._events.get()
+            handler = self._handlers.get(kind)
+            if handler is None:
+                logger.warning(f"No handler for {kind} event")
+                continue
+            # Each event gets its own task, so a slow handler never delays the next event
+            self.spawn(handler(data), name=f"{kind}-event")
+
+    def stop(self):
+        """Ask run() to return; safe to call from any thread"""
+        if self.loop is not None and self._stopped is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    async def run(self, *jobs):
+        """
+        Run the event dispatcher and the given job coroutines until stop()
+        or SIGINT/SIGTERM, then cancel everything that is still running
+
+        Args:
+            *jobs: Coroutines to run for the lifetime of the runtime
+        """
+        self.loop = asyncio.get_running_loop()
+        self._events = asyncio.Queue()
+        self._stopped = asyncio.Event()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self._stopped.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not on the main thread, or not supported on this platform
+
+        self.spawn(self._dispatch(), name="dispatcher")
+        for job in jobs:
+            self.spawn(job)
+
+        try:
+            await self._stopped.wait()
+            logger.info("Shutdown signal received")
+        finally:
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.io_executor.shutdown(wait=False, cancel_futures=True)
+            self.device_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+AC Controller gateway for Raspberry Pi: one process for several rooms
+
+Where one Raspberry Pi can reach the window sensors and IR emitters of
+several rooms, it runs this script instead of one raspberry_pi_ir_client.py
+per room. Every room keeps its own pins, AC state and reporting state, while
+everything that talks to the server is shared:
+
+- one keep-alive HTTP session and one device token (a gateway token covering
+  all the rooms, issued on the Device Tokens page)
+- one status upload per sample interval: the reports of every room that has
+  something to report go to /api/gateway/reports in a single request, and
+  each room gets its own reply back
+- one policy cache, revalidated for all rooms with one request
+- one long poll for server commands to any of the rooms
+- one offline queue for reports that could not be delivered
+
+so the server sees one device, and about 1/N of the requests that N single
+room clients would send. IR commands from a room's remote are decided locally
+with the room's policy bundle and recorded with one request each, as by the
+single room client.
+
+All AC changes, in every room, run one at a time on the runtime's device
+thread - which is also what the Pi's single IR wave engine needs.
+
+The rooms and the link to the server are pi_room.py's Room and RoomLink,
+which raspberry_pi_ir_client.py runs with a single room; this script only
+lists the rooms and sets up their shared pigpio connection.
+
+Setup: as for raspberry_pi_ir_client.py (copy the same pi_*.py files and
+policy_engine.py next to this script), then list the rooms and their pins in
+ROOMS below and set AC_DEVICE_TOKEN to the gateway token.
+"""
+
+import os
+import sys
+import asyncio
+import logging
+from pi_offline_queue import OfflineQueue
+from pi_policy_cache import PolicyCache
+from pi_async_runtime import AsyncRuntime
+from pi_ir_waveforms import WaveformCache
+from pi_room import Room, RoomLink, create_http_session, POOL_MAXSIZE
+
+# Server and credentials
+SERVER_URL = os.environ.get("AC_SERVER_URL", "http://localhost:5000")
+DEVICE_TOKEN = os.environ.get("AC_DEVICE_TOKEN")
+
+# Rooms this gateway manages and their GPIO pins (BCM numbering)
+ROOMS = [
+    {"room_number": "7", "window_pin": 17, "ir_receiver_pin": 18, "ir_transmitter_pin": 22},
+    {"room_number": "8", "window_pin": 23, "ir_receiver_pin": 24, "ir_transmitter_pin": 25},
+]
+
+# Decoded remote codes (NEC, 32 bits) -> commands, for rooms without their own "ir_codes"
+IR_CODES = {
+    # 0x00FF00FF: "POWER",
+}
+
+# Seconds between sensor samples; each room reports when it has something to report
+SENSOR_SAMPLE_INTERVAL = 10
+
+# Seconds between offline queue uploads, policy revalidations and statistics in the log
+OFFLINE_FLUSH_INTERVAL = 30
+POLICY_REFRESH_INTERVAL = 600
+INPUT_STATS_INTERVAL = 600
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("ac_gateway.log"),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger("AC_Gateway")
+
+
+# Shared by every room
+runtime = AsyncRuntime(io_workers=POOL_MAXSIZE)
+rooms = [Room(**{"ir_codes": IR_CODES, **config}, post_event=runtime.post_event,
+              logger=logging.getLogger(f"AC_Gateway.room_{config['room_number']}"))
+         for config in ROOMS]
+room_link = RoomLink(rooms, runtime, create_http_session(DEVICE_TOKEN),
+                     PolicyCache([room.room_number for room in rooms]), OfflineQueue(),
+                     server_url=lambda: SERVER_URL, logger=logger)
+
+# pigpio connection and the IR waveforms of every emitter, set up by setup_gpio()
+pi = None
+ir_waveforms = None
+
+
+def setup_gpio():
+    """Connect to pigpiod, start every room's input pipeline and prepare its IR waveforms"""
+    global pi, ir_waveforms
+    import pigpio
+    pi = pigpio.pi()
+    if not pi.connected:
+        raise RuntimeError("Cannot connect to pigpiod - is the daemon running?")
+
+    # The Pi has one wave memory and one wave engine, shared by all emitters
+    ir_waveforms = WaveformCache(pi, rooms[0].ir_transmitter_pin)
+    for room in rooms:
+        room.attach(pi, ir_waveforms)
+
+    logger.info(f"GPIO initialized for rooms {', '.join(room_link.rooms)}")
+
+
+async def input_stats_job():
+    """Log each room's input pipeline counters and the IR waveform cache"""
+    room_link.log_input_stats(ir_waveforms)
+
+
+def cleanup():
+    """Stop the input pipelines and release pigpio"""
+    logger.info("Cleaning up resources...")
+    for room in rooms:
+        room.pipeline.stop()
+    if pi is not None:
+        if ir_waveforms is not None:
+            ir_waveforms.clear()
+        pi.stop()
+
+
+def main():
+    """Main function"""
+    try:
+        setup_gpio()
+
+        logger.info(f"AC Controller gateway started for rooms {', '.join(room_link.rooms)}")
+        logger.info(f"Connecting to server at {SERVER_URL}")
+
+        # Runs until SIGINT/SIGTERM
+        asyncio.run(runtime.run(
+            *room_link.jobs(SENSOR_SAMPLE_INTERVAL, OFFLINE_FLUSH_INTERVAL, POLICY_REFRESH_INTERVAL),
+            runtime.periodic("input statistics", input_stats_job, INPUT_STATS_INTERVAL,
+                             first_delay=INPUT_STATS_INTERVAL)
+        ))
+
+    except Exception as e:
+        logger.error(f"Error in main function: {e}")
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
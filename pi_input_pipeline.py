@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+GPIO and IR input pipeline for the Raspberry Pi client
+
+pigpio calls its edge callbacks on a single thread; anything slow done there
+delays every later edge, and IR frames are lost when edges are missed. So
+the callback here only records the edge (pin, level, pigpio tick and a
+monotonic timestamp) in a fixed-size ring buffer and pokes a pipe. A worker
+thread then does everything else:
+
+- window sensor debouncing, with a timestamp state machine: a new level is
+  accepted once it has held for the debounce time, and a bounce back to the
+  stable level cancels it (no sleeping anywhere);
+- IR frame assembly: edges are turned into mark/space durations (from the
+  pigpio ticks, so timing is exact even if the worker runs late), and a
+  frame ends after a period of silence;
+- decoding (NEC by default) and dispatch to the client's handlers.
+
+The ring is single-producer/single-consumer and needs no lock: the callback
+only moves the head and the worker only moves the tail. When it is full the
+new edge is dropped and counted. stats() reports edge, drop, bounce and
+decoding counters, and latency histograms from the first edge of an input
+to its dispatch (and to its completed action, when the client records it).
+
+No pigpio import is needed here; the tests drive the pipeline with a
+simulated pigpio.
+"""
+import os
+import time
+import select
+import logging
+import threading
+
+logger = logging.getLogger("AC_Controller.input")
+
+# Edges held between the callback and the worker (an NEC frame is 68 edges)
+RING_SIZE = 4096
+
+# A window sensor level must hold this long to be accepted
+WINDOW_DEBOUNCE_MS = 50
+
+# Silence that ends an IR frame (longer than any space inside a frame)
+IR_FRAME_GAP_US = 12000
+
+# pigpio's values for these constants
+PI_INPUT = 0
+PI_PUD_UP = 2
+PI_EITHER_EDGE = 2
+PI_TIMEOUT_LEVEL = 2  # Level reported by watchdog timeouts (not an edge)
+
+TICK_MASK = 0xFFFFFFFF  # pigpio ticks are microseconds, wrapping every ~72 minutes
+
+
+def tick_diff(earlier, later):
+    """Microseconds between two pigpio ticks, across wraparound"""
+    return (later - earlier) & TICK_MASK
+
+
+class EdgeRing:
+    """Fixed-size single-producer, single-consumer ring buffer"""
+
+    def __init__(self, size=RING_SIZE):
+        self._slots = [None] * size
+        self._size = size
+        self._head = 0  # Next slot to write (producer only)
+        self._tail = 0  # Next slot to read (consumer only)
+        self.pushed = 0
+        self.dropped = 0
+
+    def push(self, item):
+        """Add an item (producer side); returns False and counts a drop when full"""
+        head = self._head
+        next_head = (head + 1) % self._size
+        if next_head == self._tail:
+            self.dropped += 1
+            return False
+        self._slots[head] = item
+        self._head = next_head  # Publish only after the slot is written
+        self.pushed += 1
+        return True
+
+    def pop(self):
+        """Remove the oldest item (consumer side), or return None when empty"""
+        tail = self._tail
+        if tail == self._head:
+            return None
+        item = self._slots[tail]
+        self._slots[tail] = None
+        self._tail = (tail + 1) % self._size
+        return item
+
+    def __len__(self):
+        return (self._head - self._tail) % self._size
+
+
+class LatencyHistogram:
+    """Latency counts in power-of-two microsecond buckets"""
+
+    # Bucket upper bounds: 64 us ... ~4.2 s, then everything slower
+    BOUNDS_US = [2 ** exponent for exponent in range(6, 23)]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.BOUNDS_US) + 1)
+        self.count = 0
+        self.max_us = 0
+
+    def observe(self, latency_ns):
+        latency_us = max(0, latency_ns) // 1000
+        index = 0
+        while index < len(self.BOUNDS_US) and latency_us > self.BOUNDS_US[index]:
+            index += 1
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.max_us = max(self.max_us, latency_us)
+
+    def percentile_ms(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self.count
+            max_us = self.max_us
+        if not total:
+            return None
+        threshold = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= threshold:
+                bound = self.BOUNDS_US[index] if index < len(self.BOUNDS_US) else max_us
+                return min(bound, max_us) / 1000.0
+        return max_us / 1000.0
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f"<={bound}us": count for bound, count in zip(self.BOUNDS_US, self._counts) if count}
+            if self._counts[-1]:
+                buckets["slower"] = self._counts[-1]
+            count, max_us = self.count, self.max_us
+        return {
+            "count": count,
+            "p50_ms": self.percentile_ms(0.5),
+            "p95_ms": self.percentile_ms(0.95),
+            "p99_ms": self.percentile_ms(0.99),
+            "max_ms": max_us / 1000.0 if count else None,
+            "buckets": buckets
+        }
+
+
+class Debouncer:
+    """Accepts a new level once it has held, without edges back, for the debounce time"""
+
+    def __init__(self, debounce_ns, level=None):
+        self.debounce_ns = debounce_ns
+        self.stable = level
+        self.pending = None
+        self.pending_since = None
+        self.first_edge_ns = None  # First edge of the current bouncy transition
+        self.bounces = 0
+
+    def edge(self, level, at_ns):
+        if level == self.stable:
+            if self.pending is not None:
+                # Bounced back before the new level held - not a real change
+                self.bounces += 1
+                self.pending = None
+            return
+        if self.pending is None:
+            self.first_edge_ns = at_ns
+        self.pending = level
+        self.pending_since = at_ns
+
+    def deadline(self):
+        if self.pending is None:
+            return None
+        return self.pending_since + self.debounce_ns
+
+    def poll(self, now_ns):
+        """Returns (new level, first edge time) once a pending level has held, else None"""
+        if self.pending is None or now_ns - self.pending_since < self.debounce_ns:
+            return None
+        self.stable, self.pending = self.pending, None
+        return self.stable, self.first_edge_ns
+
+
+class IRFrameAssembler:
+    """Turns IR receiver edges into frames of mark/space durations"""
+
+    def __init__(self, gap_us=IR_FRAME_GAP_US):
+        self.gap_us = gap_us
+        self._durations = []
+        self._last_tick = None
+        self._last_ns = None
+        self._first_ns = None
+
+    def edge(self, tick, at_ns):
+        """Add an edge; returns a completed (durations, first edge time) frame if this edge starts a new one"""
+        completed = None
+        if self._last_tick is not None:
+            duration = tick_diff(self._last_tick, tick)
+            if duration >= self.gap_us:
+                # The worker has not timed the previous frame out yet
+                completed = self._take()
+            else:
+                self._durations.append(duration)
+        if self._last_tick is None:
+            self._first_ns = at_ns
+        self._last_tick = tick
+        self._last_ns = at_ns
+        return completed
+
+    def deadline(self):
+        if self._last_tick is None:
+            return None
+        return self._last_ns + self.gap_us * 1000
+
+    def poll(self, now_ns):
+        """Returns the frame once the receiver has been silent for the frame gap, else None"""
+        if self._last_tick is None or now_ns - self._last_ns < self.gap_us * 1000:
+            return None
+        return self._take()
+
+    def _take(self):
+        frame = (self._durations, self._first_ns)
+        self._durations = []
+        self._last_tick = None
+        self._last_ns = None
+        self._first_ns = None
+        return frame
+
+
+def _near(value, target, tolerance=0.3):
+    return abs(value - target) <= target * tolerance
+
+
+def decode_nec(durations):
+    """
+    Decode an NEC remote frame
+
+    Args:
+        durations (list): Mark/space durations in microseconds, starting with a mark
+
+    Returns:
+        int: The 32-bit code (address, ~address, command, ~command, least
+             significant bit first), "REPEAT" for a held button, or None
+    """
+    if len(durations) >= 3 and _near(durations[0], 9000) and _near(durations[1], 2250):
+        return "REPEAT"
+    if len(durations) < 66 or not _near(durations[0], 9000) or not _near(durations[1], 4500):
+        return None
+
+    code = 0
+    for bit in range(32):
+        mark, space = durations[2 + 2 * bit], durations[3 + 2 * bit]
+        if not _near(mark, 560, 0.5):
+            return None
+        if _near(space, 1690, 0.35):
+            code |= 1 << bit
+        elif not _near(space, 560, 0.5):
+            return None
+    return code
+
+
+class InputPipeline:
+    """
+    Edge capture, debouncing, IR decoding and dispatch
+
+    Args:
+        window_pin (int): GPIO of the window reed switch (high = opened, with the pull-up)
+        ir_pin (int): GPIO of the IR receiver output
+        on_window (callable): Called as on_window(state, first_edge_ns) with 'opened'/'closed'
+        on_ir_code (callable): Called as on_ir_code(command, first_edge_ns) for mapped codes
+        ir_codes (dict): Decoded code -> command name (e.g. 'POWER')
+        ir_decoder (callable): Frame durations -> code, "REPEAT" or None
+    """
+
+    def __init__(self, window_pin, ir_pin, on_window, on_ir_code, ir_codes=None,
+                 ir_decoder=decode_nec, debounce_ms=WINDOW_DEBOUNCE_MS,
+                 ir_frame_gap_us=IR_FRAME_GAP_US, ring_size=RING_SIZE):
+        self.window_pin = window_pin
+        self.ir_pin = ir_pin
+        self.on_window = on_window
+        self.on_ir_code = on_ir_code
+        self.ir_codes = ir_codes if ir_codes is not None else {}
+        self.ir_decoder = ir_decoder
+
+        self._ring = EdgeRing(ring_size)
+        self._window = Debouncer(debounce_ms * 1_000_000)
+        self._ir = IRFrameAssembler(ir_frame_gap_us)
+
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._thread = None
+        self._running = False
+        self._callbacks = []
+
+        self.counters = {
+            "window_changes": 0,
+            "ir_frames": 0,
+            "ir_commands": 0,
+            "ir_repeats": 0,
+            "ir_undecoded": 0,
+            "ir_unknown": 0,
+            "handler_errors": 0
+        }
+        self.latency = {
+            "window_dispatch": LatencyHistogram(),
+            "ir_dispatch": LatencyHistogram(),
+            "ir_action": LatencyHistogram()
+        }
+
+    # Producer side (pigpio's callback thread) -------------------------------
+
+    def on_edge(self, gpio, level, tick):
+        """pigpio callback: record the edge and return immediately"""
+        self._ring.push((gpio, level, tick, time.monotonic_ns()))
+        try:
+            os.write(self._wake_write, b"\0")
+        except (BlockingIOError, OSError):
+            pass  # Pipe full (the worker is already due to wake) or closed
+
+    def attach(self, pi):
+        """
+        Configure the pins on a pigpio connection and register the edge callback
+
+        Args:
+            pi: pigpio.pi() connection (or a stand-in with the same methods)
+        """
+        pi.set_mode(self.window_pin, PI_INPUT)
+        pi.set_pull_up_down(self.window_pin, PI_PUD_UP)
+        pi.set_mode(self.ir_pin, PI_INPUT)
+
+        # Start from the current window state, so only real changes are reported
+        self._window.stable = pi.read(self.window_pin)
+
+        self._callbacks = [
+            pi.callback(self.window_pin, PI_EITHER_EDGE, self.on_edge),
+            pi.callback(self.ir_pin, PI_EITHER_EDGE, self.on_edge)
+        ]
+
+    @property
+    def window_state(self):
+        if self._window.stable is None:
+            return None
+        return "opened" if self._window.stable else "closed"
+
+    # Consumer side (worker thread) ------------------------------------------
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ac-input", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        for callback in self._callbacks:
+            try:
+                callback.cancel()
+            except Exception:
+                pass
+        self._callbacks = []
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            pass
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            self.process_pending()
+
+            deadlines = [deadline for deadline in (self._window.deadline(), self._ir.deadline()) if deadline]
+            timeout = None
+            if deadlines:
+                timeout = max(0.0, (min(deadlines) - time.monotonic_ns()) / 1e9)
+            if len(self._ring):
+                continue
+
+            readable, _, _ = select.select([self._wake_read], [], [], timeout)
+            if readable:
+                try:
+                    while os.read(self._wake_read, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+    def process_pending(self, now_ns=None):
+        """
+        Handle every recorded edge, then any debounce or frame timer that has expired
+
+        Called by the worker thread; tests call it directly with a fixed clock.
+        """
+        while True:
+            entry = self._ring.pop()
+            if entry is None:
+                break
+            gpio, level, tick, at_ns = entry
+            if level == PI_TIMEOUT_LEVEL:
+                continue
+            if gpio == self.window_pin:
+                self._window.edge(level, at_ns)
+            elif gpio == self.ir_pin:
+                frame = self._ir.edge(tick, at_ns)
+                if frame:
+                    self._handle_frame(*frame)
+
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        change = self._window.poll(now_ns)
+        if change:
+            level, first_edge_ns = change
+            self.counters["window_changes"] += 1
+            self._dispatch("window_dispatch", self.on_window, "opened" if level else "closed", first_edge_ns)
+
+        frame = self._ir.poll(now_ns)
+        if frame:
+            self._handle_frame(*frame)
+
+    def _handle_frame(self, durations, first_edge_ns):
+        self.counters["ir_frames"] += 1
+        code = self.ir_decoder(durations)
+        if code is None:
+            self.counters["ir_undecoded"] += 1
+            return
+        if code == "REPEAT":
+            # A held button - AC commands are one press each
+            self.counters["ir_repeats"] += 1
+            return
+
+        command = self.ir_codes.get(code)
+        if command is None:
+            self.counters["ir_unknown"] += 1
+            logger.info(f"Unknown IR code {code:#010x}" if isinstance(code, int) else f"Unknown IR code {code}")
+            return
+
+        self.counters["ir_commands"] += 1
+        self._dispatch("ir_dispatch", self.on_ir_code, command, first_edge_ns)
+
+    def _dispatch(self, histogram, handler, value, first_edge_ns):
+        self.latency[histogram].observe(time.monotonic_ns() - first_edge_ns)
+        try:
+            handler(value, first_edge_ns)
+        except Exception as e:
+            self.counters["handler_errors"] += 1
+            logger.error(f"Input handler failed for {value}: {e!r}")
+
+    def observe_action(self, first_edge_ns):
+        """Record the time from an IR command's first edge to its completed action"""
+        self.latency["ir_action"].observe(time.monotonic_ns() - first_edge_ns)
+
+    def stats(self):
+        """Counters and latency histograms, for logging"""
+        return {
+            "edges": self._ring.pushed,
+            "dropped_edges": self._ring.dropped,
+            "window_bounces": self._window.bounces,
+            **self.counters,
+            "latency": {name: histogram.snapshot() for name, histogram in self.latency.items()}
+        }
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+IR command encoding for the Raspberry Pi client
+
+Turns a change of AC state (power, mode, temperature, fan speed) into the IR
+frames that make it, so the client always asks for the state it wants
+instead of pressing buttons one at a time:
+
+- FullStateProtocol is for ACs whose remotes send the whole state in every
+  frame (most split units). Any change, including an absolute setpoint such
+  as SET_TEMP_22, is a single frame.
+- StepProtocol is for ACs that only understand button presses (POWER,
+  TEMP_UP, ...). The presses needed are worked out up front and sent as one
+  timed burst: the same frame repeated at the remote's own repeat rate, so
+  a 10 degree change is one transmission of about a second instead of ten
+  separate sends.
+
+A Transmission is a list of bursts of mark/space pulse lists, which
+pi_ir_waveforms.py sends as pigpio waves. Copy this file next to
+raspberry_pi_ir_client.py.
+"""
+from collections import namedtuple
+
+# Setting ranges of the AC
+MIN_TEMPERATURE = 18
+MAX_TEMPERATURE = 30
+MODES = ["cool", "heat", "fan", "dry"]
+FAN_SPEEDS = ["auto", "low", "medium", "high"]
+
+# NEC timing (microseconds)
+NEC_HEADER_MARK = 9000
+NEC_HEADER_SPACE = 4500
+NEC_BIT_MARK = 560
+NEC_ZERO_SPACE = 560
+NEC_ONE_SPACE = 1690
+NEC_FRAME_PERIOD_US = 108000  # Start-to-start time of a held button's frames
+
+# Silence after a full-state frame before the AC accepts another one
+STATE_FRAME_GAP_US = 40000
+
+
+class Burst(namedtuple("Burst", ["key", "pulses", "count", "gap_us"])):
+    """
+    One IR frame sent count times
+
+    key identifies the frame (e.g. "TEMP_UP", or the state a full-state frame
+    sets); pulses are mark/space durations in microseconds, starting and
+    ending with a mark; gap_us is the silence after each copy.
+    """
+
+    @property
+    def duration_us(self):
+        return (sum(self.pulses) + self.gap_us) * self.count
+
+
+class Transmission:
+    """
+    Everything sent to bring the AC to a new state
+
+    Args:
+        bursts (list): Bursts, sent in order with no pause between them
+        state (dict): The AC state once the transmission has been sent
+    """
+
+    def __init__(self, bursts, state):
+        self.bursts = bursts
+        self.state = state
+
+    @property
+    def duration_us(self):
+        return sum(burst.duration_us for burst in self.bursts)
+
+    def describe(self):
+        return ", ".join(f"{burst.key} x{burst.count}" if burst.count > 1 else burst.key
+                         for burst in self.bursts)
+
+
+def nec_pulses(code):
+    """Mark/space pulses of a 32-bit NEC code (least significant bit first)"""
+    pulses = [NEC_HEADER_MARK, NEC_HEADER_SPACE]
+    for bit in range(32):
+        pulses += [NEC_BIT_MARK, NEC_ONE_SPACE if code >> bit & 1 else NEC_ZERO_SPACE]
+    pulses.append(NEC_BIT_MARK)
+    return pulses
+
+
+def pulse_distance_pulses(data, header=(3500, 1750), bit_mark=430, zero_space=430, one_space=1300):
+    """
+    Mark/space pulses of bytes in pulse-distance coding (least significant bit
+    first), as used by most full-state AC remotes; the defaults are typical
+    timings, adjust them to the remote
+
+    Args:
+        data (bytes): Frame content
+    """
+    pulses = list(header)
+    for byte in data:
+        for bit in range(8):
+            pulses += [bit_mark, one_space if byte >> bit & 1 else zero_space]
+    pulses.append(bit_mark)
+    return pulses
+
+
+def packed_state_bytes(state):
+    """
+    Example full-state frame layout: an id byte, power/mode/fan bits, the
+    temperature offset and a checksum. Replace it with the layout of the room's
+    remote (capture frames with the input pipeline and compare a few states).
+    """
+    flags = (state["power"] == "on") | MODES.index(state["mode"]) << 1 | FAN_SPEEDS.index(state["fan_speed"]) << 4
+    data = bytes([0x4D, flags, state["temperature"] - MIN_TEMPERATURE])
+    return data + bytes([sum(data) & 0xFF])
+
+
+def clamp_state(state):
+    """A state with every setting within the AC's range"""
+    state = dict(state)
+    state["temperature"] = max(MIN_TEMPERATURE, min(MAX_TEMPERATURE, int(state["temperature"])))
+    return state
+
+
+def _cycle_presses(values, current, target):
+    """Presses of a cycling button to get from current to target"""
+    return (values.index(target) - values.index(current)) % len(values)
+
+
+class StepProtocol:
+    """
+    An AC controlled by button presses
+
+    Args:
+        codes (dict): Command name -> 32-bit NEC code, for POWER, TEMP_UP,
+                      TEMP_DOWN, MODE and FAN (as learned in the client's IR_CODES)
+    """
+
+    supports_absolute = False
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def _burst(self, command, count):
+        if command not in self.codes:
+            raise ValueError(f"No IR code learned for {command}")
+        pulses = nec_pulses(self.codes[command])
+        return Burst(command, pulses, count, NEC_FRAME_PERIOD_US - sum(pulses))
+
+    def known_bursts(self, state):
+        """One press of every learned button, e.g. to prepare their waveforms"""
+        return [self._burst(command, 1) for command in self.codes]
+
+    def plan(self, current, target):
+        """
+        The presses that take the AC from one state to another
+
+        Returns:
+            Transmission: The bursts to send, or None if nothing changes
+
+        Raises:
+            ValueError: A needed button has no learned code
+        """
+        target = clamp_state(target)
+        bursts = []
+
+        if current["power"] == "on" and target["power"] == "off":
+            # Settings cannot be changed on a switched-off AC; just switch it off
+            return Transmission([self._burst("POWER", 1)], dict(current, power="off"))
+        if current["power"] == "off" and target["power"] == "on":
+            bursts.append(self._burst("POWER", 1))
+        if target["power"] == "off":
+            return Transmission(bursts, dict(current, power="off")) if bursts else None
+
+        degrees = target["temperature"] - current["temperature"]
+        if degrees:
+            bursts.append(self._burst("TEMP_UP" if degrees > 0 else "TEMP_DOWN", abs(degrees)))
+        presses = _cycle_presses(MODES, current["mode"], target["mode"])
+        if presses:
+            bursts.append(self._burst("MODE", presses))
+        presses = _cycle_presses(FAN_SPEEDS, current["fan_speed"], target["fan_speed"])
+        if presses:
+            bursts.append(self._burst("FAN", presses))
+
+        return Transmission(bursts, target) if bursts else None
+
+
+class FullStateProtocol:
+    """
+    An AC whose remote sends the complete state in every frame
+
+    Args:
+        encode (callable): State dict -> mark/space pulses of its frame
+    """
+
+    supports_absolute = True
+
+    def __init__(self, encode=None):
+        self.encode = encode or (lambda state: pulse_distance_pulses(packed_state_bytes(state)))
+
+    def _burst(self, state):
+        key = f"STATE_{state['power']}_{state['mode']}_{state['temperature']}_{state['fan_speed']}"
+        return Burst(key, self.encode(state), 1, STATE_FRAME_GAP_US)
+
+    def known_bursts(self, state):
+        """The frames for every setpoint in the current mode, and for switching off"""
+        bursts = [self._burst(dict(state, power="on", temperature=temperature))
+                  for temperature in range(MIN_TEMPERATURE, MAX_TEMPERATURE + 1)]
+        bursts.append(self._burst(dict(state, power="off")))
+        return bursts
+
+    def plan(self, current, target):
+        """
+        The single frame that sets the target state
+
+        Returns:
+            Transmission: One burst, or None if nothing changes
+        """
+        target = clamp_state(target)
+        if target == current:
+            return None
+        return Transmission([self._burst(target)], target)
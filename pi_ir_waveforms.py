@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Cached pigpio waveforms for IR transmission on the Raspberry Pi client
+
+Building a pigpio wave (wave_add_generic + wave_create) for every button
+press costs milliseconds and adds jitter before the IR goes out. Instead,
+waves are built once and reused:
+
+- one wave per distinct mark length (the 38 kHz carrier, switched on and
+  off for that long) and one per distinct space length. An NEC remote needs
+  about a dozen of these for all of its buttons, and full-state AC frames
+  about as many for every setpoint.
+- a transmission is sent as a wave chain: each frame is the sequence of its
+  marks' and spaces' wave ids, and a burst of repeated frames is a chain
+  loop, so even a 10-press burst is a single chain handed to the DMA engine.
+
+pigpiod has a fixed amount of wave memory (about 250 wave ids and a limited
+number of DMA control blocks). The cache keeps its waves within both limits
+and evicts the least recently used ones when a new wave does not fit; if
+memory is too fragmented for that, it clears every wave and starts over.
+Wave memory and the DMA engine belong to the whole Pi, so a Pi with several
+IR LEDs (a gateway driving several rooms' ACs) uses one cache for all of
+them: spaces are shared, and each LED gets its own marks.
+
+Copy this file next to raspberry_pi_ir_client.py.
+"""
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("AC_Controller.ir_waveforms")
+
+CARRIER_HZ = 38000
+DUTY_CYCLE = 0.33
+
+# pigpiod limits: wave ids, and the longest chain it accepts (bytes)
+MAX_WAVES = 250
+MAX_CHAIN_BYTES = 600
+
+# Rough DMA control blocks per pulse, for checking a wave fits before creating it
+CBS_PER_PULSE = 2
+
+
+class WaveMemoryFull(Exception):
+    """The waves a transmission needs do not fit in pigpiod's wave memory"""
+
+
+class WaveformCache:
+    """
+    IR waves on a Pi's transmitter GPIOs, built on first use and kept for reuse
+
+    Args:
+        pi: pigpio.pi() connection (or a stand-in with the same methods)
+        gpio (int): GPIO driving the IR LED (the default for send)
+        carrier_hz (int): Carrier frequency
+        duty_cycle (float): Fraction of each carrier cycle the LED is on
+        max_waves (int): Most waves kept (default: pigpiod's limit)
+        max_cbs (int): Most DMA control blocks used (default: what pigpiod reports)
+        pigpio_module: The pigpio module (for pulse and error; imported if not given)
+    """
+
+    def __init__(self, pi, gpio, carrier_hz=CARRIER_HZ, duty_cycle=DUTY_CYCLE,
+                 max_waves=MAX_WAVES, max_cbs=None, pigpio_module=None):
+        if pigpio_module is None:
+            import pigpio as pigpio_module
+        self.pi = pi
+        self.gpio = gpio
+        self.carrier_hz = carrier_hz
+        self.duty_cycle = duty_cycle
+        self.max_waves = max_waves
+        self.max_cbs = max_cbs or pi.wave_get_max_cbs()
+        self._pulse = pigpio_module.pulse
+        self._error = pigpio_module.error
+        self._output_mode = pigpio_module.OUTPUT
+
+        # (kind, microseconds, GPIO of a mark) -> (wave id, control blocks), oldest first
+        self._waves = OrderedDict()
+        self._cbs_used = 0
+        self._outputs = set()
+        self.counters = {"hits": 0, "builds": 0, "evictions": 0, "resets": 0, "transmissions": 0}
+
+        self._output(gpio)
+
+    def _output(self, gpio):
+        """Make a GPIO an output, LED off, the first time it is used"""
+        if gpio not in self._outputs:
+            self.pi.set_mode(gpio, self._output_mode)
+            self.pi.write(gpio, 0)
+            self._outputs.add(gpio)
+
+    # Waves -------------------------------------------------------------------
+
+    def _segment_pulses(self, kind, duration, gpio):
+        """pigpio pulses for a mark (carrier on) or space (LED off) of a duration"""
+        if kind == "space":
+            return [self._pulse(0, 0, duration)]
+        mask = 1 << gpio
+
+        # Carrier cycles, with each edge rounded to the microsecond it falls
+        # on so rounding errors do not add up over a long mark
+        period = 1_000_000 / self.carrier_hz
+        cycles = max(1, round(duration / period))
+        pulses = []
+        elapsed = 0
+        for cycle in range(cycles):
+            on_until = round(cycle * period + period * self.duty_cycle)
+            off_until = round((cycle + 1) * period)
+            pulses.append(self._pulse(mask, 0, on_until - elapsed))
+            pulses.append(self._pulse(0, mask, off_until - on_until))
+            elapsed = off_until
+        return pulses
+
+    def _fits(self, pulse_count):
+        return (len(self._waves) < self.max_waves and
+                self._cbs_used + pulse_count * CBS_PER_PULSE <= self.max_cbs)
+
+    def _evict_one(self, keep):
+        """Delete the least recently used wave not in keep; returns False if there is none"""
+        for key in self._waves:
+            if key not in keep:
+                wave_id, cbs = self._waves.pop(key)
+                self.pi.wave_delete(wave_id)
+                self._cbs_used -= cbs
+                self.counters["evictions"] += 1
+                return True
+        return False
+
+    def _create(self, key, keep):
+        pulses = self._segment_pulses(*key)
+        while not self._fits(len(pulses)):
+            if not self._evict_one(keep):
+                raise WaveMemoryFull(f"No room for the {key[0]} wave of {key[1]} us")
+
+        while True:
+            self.pi.wave_add_new()
+            self.pi.wave_add_generic(pulses)
+            try:
+                wave_id = self.pi.wave_create()
+            except self._error:
+                wave_id = -1
+            if wave_id >= 0:
+                break
+            # Freed memory may be too fragmented for this wave - free more
+            if not self._evict_one(keep):
+                raise WaveMemoryFull(f"pigpiod could not create the {key[0]} wave of {key[1]} us")
+
+        cbs = self.pi.wave_get_cbs()
+        self._waves[key] = (wave_id, cbs)
+        self._cbs_used += cbs
+        self.counters["builds"] += 1
+        return wave_id
+
+    def _wave(self, key, keep):
+        """Wave id for a segment, building it if needed"""
+        keep.add(key)
+        entry = self._waves.get(key)
+        if entry is not None:
+            self._waves.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+        return self._create(key, keep)
+
+    def clear(self):
+        """Delete every wave on pigpiod (including ones this cache did not create)"""
+        self.pi.wave_clear()
+        self._waves.clear()
+        self._cbs_used = 0
+
+    # Chains ------------------------------------------------------------------
+
+    def _burst_chain(self, burst, keep, gpio):
+        frame = []
+        for index, duration in enumerate(burst.pulses):
+            key = ("mark", duration, gpio) if index % 2 == 0 else ("space", duration, None)
+            frame.append(self._wave(key, keep))
+        if burst.gap_us > 0:
+            frame.append(self._wave(("space", burst.gap_us, None), keep))
+
+        if burst.count == 1:
+            return frame
+        # Chain loop: 255 0 <waves> 255 1 <count low> <count high>
+        return [255, 0] + frame + [255, 1, burst.count & 0xFF, burst.count >> 8]
+
+    def _build_chains(self, transmission, gpio):
+        keep = set()
+        chains = [([], 0)]
+        for burst in transmission.bursts:
+            if not 0 < burst.count <= 0xFFFF:
+                raise ValueError(f"Cannot repeat a frame {burst.count} times")
+            chain = self._burst_chain(burst, keep, gpio)
+            if len(chain) > MAX_CHAIN_BYTES:
+                raise ValueError(f"{burst.key} frame is too long for a pigpio wave chain")
+            if len(chains[-1][0]) + len(chain) > MAX_CHAIN_BYTES:
+                chains.append(([], 0))
+            chains[-1] = (chains[-1][0] + chain, chains[-1][1] + burst.duration_us)
+        return [(chain, duration_us) for chain, duration_us in chains if chain]
+
+    def chains(self, transmission, gpio=None):
+        """
+        The wave chains that send a transmission, building any missing waves
+
+        Args:
+            transmission (Transmission): What to send
+            gpio (int): GPIO of the IR LED to send it on (default: the cache's)
+
+        Returns:
+            list: (chain, duration in us) pairs, normally just one; each chain
+                  is the list of bytes for pi.wave_chain
+
+        Raises:
+            WaveMemoryFull: The transmission's waves do not fit even in empty wave memory
+        """
+        gpio = self.gpio if gpio is None else gpio
+        self._output(gpio)
+        try:
+            return self._build_chains(transmission, gpio)
+        except WaveMemoryFull as e:
+            logger.warning(f"{e} - clearing all waves")
+            self.counters["resets"] += 1
+            self.clear()
+            return self._build_chains(transmission, gpio)
+
+    def prebuild(self, bursts, gpio=None):
+        """
+        Build the waves for frames that will be sent, so the first press is as fast as the rest
+
+        Args:
+            bursts: Bursts (e.g. every button of the remote, or every setpoint)
+            gpio (int): GPIO of the IR LED they will be sent on (default: the cache's)
+        """
+        gpio = self.gpio if gpio is None else gpio
+        self._output(gpio)
+        keep = set()
+        for burst in bursts:
+            try:
+                self._burst_chain(burst, keep, gpio)
+            except WaveMemoryFull:
+                logger.warning(f"Wave memory full, {burst.key} left to be built on first use")
+                return
+        logger.info(f"Prebuilt {len(self._waves)} IR waves ({self._cbs_used} control blocks)")
+
+    def send(self, transmission, gpio=None):
+        """Send a transmission (on the given IR LED's GPIO) and wait until it has gone out"""
+        for chain, duration_us in self.chains(transmission, gpio):
+            started = time.monotonic()
+            self.pi.wave_chain(chain)
+            # Sleep through most of it, then poll for the end
+            time.sleep(duration_us / 1e6 * 0.9)
+            while self.pi.wave_tx_busy():
+                if time.monotonic() - started > 10:
+                    self.pi.wave_tx_stop()
+                    logger.error("IR transmission did not finish, stopped it")
+                    break
+                time.sleep(0.002)
+        self.counters["transmissions"] += 1
+
+    def stats(self):
+        return {
+            "waves": len(self._waves),
+            "control_blocks": self._cbs_used,
+            "max_control_blocks": self.max_cbs,
+            **self.counters
+        }
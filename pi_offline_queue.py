@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Offline store-and-forward queue for the Raspberry Pi client
+
+Reports that cannot be delivered (server down, tunnel gone, Wi-Fi out) are
+written to a small SQLite database on the Pi instead of being dropped. Each
+report keeps the device time it was recorded at and gets a sequence number
+that is never reused. Once the server is reachable again, flush() uploads the
+queue oldest first, in gzip-compressed batches, to /api/device_reports, and
+deletes what the server acknowledged.
+
+Disk usage is bounded by both a report count and a byte budget; when either
+is exceeded the oldest reports are evicted first.
+
+Only the standard library and requests are needed, so this file can be copied
+next to raspberry_pi_ir_client.py.
+"""
+import os
+import json
+import gzip
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger("AC_Controller.offline_queue")
+
+# Queue database location (an SD card - keep writes small and few)
+QUEUE_PATH = os.environ.get("AC_QUEUE_PATH", "ac_offline_queue.db")
+
+# Limits on what is kept while offline; the oldest reports are evicted first.
+# At one status update a minute, 50,000 reports is about a month.
+MAX_REPORTS = 50000
+MAX_BYTES = 16 * 1024 * 1024
+
+# Reports uploaded per request (the server accepts up to 500)
+BATCH_SIZE = 200
+
+
+def utc_now_iso():
+    """Current device time, ISO 8601 in UTC"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+class OfflineQueue:
+    """Durable FIFO of undelivered reports, safe to share between threads"""
+
+    def __init__(self, path=QUEUE_PATH, max_reports=MAX_REPORTS, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_reports = max_reports
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL with NORMAL sync: durable across a crash of this process, far fewer SD card writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS report (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                recorded_at TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'stream_id'").fetchone()
+        if row:
+            self.stream_id = row[0]
+        else:
+            # Identifies this queue to the server, which deduplicates by (stream, seq)
+            self.stream_id = uuid.uuid4().hex
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('stream_id', ?)", (self.stream_id,))
+
+        self._count, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report"
+        ).fetchone()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def enqueue(self, report, recorded_at=None):
+        """
+        Store a report for later delivery
+
+        Args:
+            report (dict): The payload that could not be sent (must include room_number)
+            recorded_at (str, optional): Device time of the report (default: now)
+
+        Returns:
+            int: Sequence number of the stored report
+        """
+        payload = json.dumps(report, separators=(",", ":"))
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO report (recorded_at, payload, size) VALUES (?, ?, ?)",
+                (recorded_at or utc_now_iso(), payload, len(payload))
+            )
+            self._count += 1
+            self._bytes += len(payload)
+            self._evict()
+            return cursor.lastrowid
+
+    def _evict(self):
+        """Drop the oldest reports until the queue is within its limits (lock held)"""
+        if self._count <= self.max_reports and self._bytes <= self.max_bytes:
+            return
+
+        evicted = 0
+        while self._count > self.max_reports or self._bytes > self.max_bytes:
+            # Evict 5% at a time so a full queue is not trimmed on every report
+            excess = max(self._count - self.max_reports, 1, self._count // 20)
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM "
+                "(SELECT size FROM report ORDER BY seq LIMIT ?)", (excess,)
+            ).fetchone()
+            self._conn.execute(
+                "DELETE FROM report WHERE seq IN (SELECT seq FROM report ORDER BY seq LIMIT ?)", (excess,)
+            )
+            self._count -= count
+            self._bytes -= size
+            evicted += count
+            if count == 0:
+                break
+        logger.warning(f"Offline queue full - evicted {evicted} oldest reports")
+
+    def peek(self, limit=BATCH_SIZE):
+        """
+        Oldest queued reports, without removing them
+
+        Returns:
+            list: Reports with their seq and recorded_at added
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, recorded_at, payload FROM report ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        reports = []
+        for seq, recorded_at, payload in rows:
+            report = json.loads(payload)
+            report["seq"] = seq
+            report["recorded_at"] = recorded_at
+            reports.append(report)
+        return reports
+
+    def acknowledge(self, seq):
+        """Delete every report up to and including a sequence number"""
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM report WHERE seq <= ?", (seq,)
+            ).fetchone()
+            self._conn.execute("DELETE FROM report WHERE seq <= ?", (seq,))
+            self._count -= count
+            self._bytes -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def encode_batch(stream_id, reports):
+    """Gzip-compressed JSON body for /api/device_reports"""
+    body = json.dumps({
+        "stream_id": stream_id,
+        "sent_at": utc_now_iso(),
+        "reports": reports
+    }, separators=(",", ":")).encode()
+    return gzip.compress(body, compresslevel=6)
+
+
+def flush(queue, session, server_url, batch_size=BATCH_SIZE, timeout=(3.05, 30)):
+    """
+    Upload queued reports, oldest first, until the queue is empty
+
+    Stops at the first failure; what was not acknowledged stays queued and
+    is retried on the next flush.
+
+    Args:
+        queue (OfflineQueue): The queue to drain
+        session (requests.Session): HTTP session to upload with
+        server_url (str): Base URL of the server
+        batch_size (int): Reports per request
+        timeout: Request timeout, as for requests
+
+    Returns:
+        int: Number of reports delivered (accepted or duplicate)
+    """
+    delivered = 0
+    while len(queue):
+        reports = queue.peek(batch_size)
+        if not reports:
+            break
+
+        try:
+            response = session.post(
+                f"{server_url}/api/device_reports",
+                data=encode_batch(queue.stream_id, reports),
+                headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+                timeout=timeout
+            )
+        except Exception as e:
+            logger.warning(f"Offline queue upload failed: {e}")
+            break
+
+        if response.status_code in (400, 403, 413):
+            # The server will never accept this batch - drop it rather than block the queue
+            logger.error(f"Server refused {len(reports)} queued reports ({response.status_code}), dropping them")
+            queue.acknowledge(reports[-1]["seq"])
+            continue
+
+        if response.status_code != 200:
+            logger.warning(f"Offline queue upload returned {response.status_code}")
+            break
+
+        result = response.json()
+        ack_seq = result.get("ack_seq") or reports[-1]["seq"]
+        queue.acknowledge(ack_seq)
+        delivered += result.get("accepted", 0) + result.get("duplicates", 0)
+        if result.get("rejected"):
+            logger.warning(f"Server rejected {result['rejected']} queued reports")
+
+    if delivered:
+        logger.info(f"Delivered {delivered} queued reports, {len(queue)} left")
+    return delivered
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Local policy cache for the Raspberry Pi client
+
+Holds the policy bundles of the Pi's rooms, from /api/policy_bundles, so
+remote control commands are decided on the Pi, with the same rules as the
+server (policy_engine.py), instead of waiting on a round trip for every
+button press. The bundles are saved to disk so decisions keep working after
+a reboot while the server is unreachable.
+
+The bundles are only downloaded again when one of them changes: the server
+reports each room's current version with every status update, and periodic
+revalidation sends If-None-Match with the version covering all of them, so
+unchanged bundles cost a 304. A single room client simply has one room.
+
+Copy this file, pi_offline_queue.py and policy_engine.py next to
+raspberry_pi_ir_client.py.
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+from policy_engine import evaluate_command, reporting_cadence
+
+logger = logging.getLogger("AC_Controller.policy_cache")
+
+# Where the last bundles are kept between restarts
+BUNDLES_PATH = os.environ.get("AC_POLICY_BUNDLES_PATH", "ac_policy_bundles.json")
+
+
+def save_json(path, data):
+    """Write JSON to disk atomically, so a power cut cannot leave half a file"""
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save policy bundle: {e}")
+
+
+class PolicyCache:
+    """The policy bundles of a Pi's rooms, safe to share between threads"""
+
+    def __init__(self, room_numbers, path=BUNDLES_PATH):
+        self.room_numbers = list(room_numbers)
+        self.path = path
+        self._lock = threading.Lock()
+        self._bundles = {}
+        self.version = None  # Covers every room's bundle
+        self.checked_at = None
+
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("version") and isinstance(saved.get("bundles"), dict):
+                # Rooms no longer managed are dropped; the version no longer matches then either
+                self._bundles = {room_number: bundle for room_number, bundle in saved["bundles"].items()
+                                 if room_number in self.room_numbers}
+                self.version = saved["version"]
+                logger.info(f"Loaded policy bundles {self.version} from {path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable policy bundles {path}: {e}")
+
+    def room_version(self, room_number):
+        bundle = self._bundles.get(room_number)
+        return bundle["version"] if bundle else None
+
+    def is_stale(self, room_number, server_version):
+        """Whether the server's policy version for a room differs from the cached one"""
+        return bool(server_version) and server_version != self.room_version(room_number)
+
+    def refresh(self, session, server_url, timeout=(3.05, 5)):
+        """
+        Revalidate every room's bundle with one request, downloading them if any changed
+
+        Args:
+            session (requests.Session): HTTP session
+            server_url (str): Base URL of the server
+            timeout: Request timeout, as for requests
+
+        Returns:
+            bool: Whether new bundles were installed
+        """
+        headers = {}
+        if self.version:
+            headers["If-None-Match"] = f'"{self.version}"'
+
+        response = session.get(f"{server_url}/api/policy_bundles",
+                               params={"rooms": ",".join(self.room_numbers)},
+                               headers=headers, timeout=timeout)
+
+        if response.status_code == 304:
+            self.checked_at = datetime.utcnow()
+            return False
+        if response.status_code != 200:
+            logger.warning(f"Policy bundles request returned {response.status_code}")
+            return False
+
+        data = response.json()
+        bundles = {room_number: bundle for room_number, bundle in data.get("bundles", {}).items()
+                   if room_number in self.room_numbers and bundle.get("version")}
+        if data.get("missing"):
+            logger.warning(f"Server has no settings for rooms {', '.join(data['missing'])}")
+        if not data.get("version"):
+            return False
+
+        with self._lock:
+            self._bundles = bundles
+            self.version = data["version"]
+            self.checked_at = datetime.utcnow()
+        save_json(self.path, {"version": self.version, "bundles": bundles})
+        logger.info(f"Installed policy bundles {self.version} for {len(bundles)} rooms")
+        return True
+
+    def reporting(self, room_number):
+        """(temperature change reported right away, heartbeat seconds) for a room"""
+        return reporting_cadence(self._bundles.get(room_number))
+
+    def decide(self, room_number, command, window_state=None, ac_state=None, temperature=None):
+        """
+        Decide a room's command locally
+
+        Returns:
+            dict: The decision (as returned by /api/check_command, plus the
+                  policy version), or None if there is no bundle for the room yet
+        """
+        bundle = self._bundles.get(room_number)
+        if bundle is None:
+            return None
+
+        decision = evaluate_command(bundle, command, window_state, ac_state, temperature)
+        decision["policy_version"] = bundle["version"]
+        return decision
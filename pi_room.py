@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+"""
+Room control shared by the Raspberry Pi clients
+
+raspberry_pi_ir_client.py (one room) and pi_gateway.py (several rooms on one
+Pi) both run their rooms through this module:
+
+- Room is one room: its pins and input pipeline, its AC's state and what the
+  server was last told about it. Its AC methods run on the runtime's device
+  thread only, so AC changes happen one at a time in every room.
+- RoomLink is everything between a Pi's rooms and the server, shared by all
+  of them: one keep-alive HTTP session, remote control commands decided with
+  the cached policy bundles and recorded with /api/ir_command, the status
+  reports that are due sent together to /api/gateway/reports, one long poll
+  on /api/commands for server commands, and one offline queue for whatever
+  could not be delivered.
+
+A single room client is a RoomLink with one room; the server treats its
+token as covering just that room.
+
+Copy this file next to raspberry_pi_ir_client.py, with the other pi_*.py
+files and policy_engine.py.
+"""
+import time
+import asyncio
+import logging
+import random
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pi_offline_queue import flush as flush_offline_queue, utc_now_iso
+from pi_input_pipeline import InputPipeline
+from pi_ir_protocol import StepProtocol, MODES, FAN_SPEEDS
+
+# HTTP timeouts in seconds: (connect, read). Every request has one so a dead
+# server or tunnel can never hang a thread.
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 5
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# Connections kept alive per host - one per io thread that talks to the
+# server (IR commands, status updates, command channel) plus a spare
+POOL_CONNECTIONS = 2
+POOL_MAXSIZE = 4
+
+# Retries for failed connections and 502/503/504 responses, with exponential
+# backoff (0.3 s, 0.6 s, ...) plus random jitter so a fleet of devices does not
+# reconnect in lockstep after a server restart
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.3
+RETRY_JITTER = 0.5
+
+# Seconds before a room's failed report is tried again (it was queued offline meanwhile)
+REPORT_RETRY_INTERVAL = 60
+
+# Longest wait for the server to approve a command (only while no policy bundle is cached)
+PERMISSION_TIMEOUT = 6
+
+
+def create_http_session(device_token=None):
+    """
+    Create the HTTP session shared by all threads and rooms
+
+    The session keeps connections alive, so after the first request each call
+    reuses an open TCP (and, through the tunnel, TLS) connection instead of
+    opening a new one. It is configured once here and never modified
+    afterwards, which makes it safe to share between threads.
+
+    Args:
+        device_token (str, optional): API token issued on the Device Tokens page
+
+    Returns:
+        requests.Session: Configured session
+    """
+    retry_options = dict(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=1,
+        status=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        # Only GETs are retried after the request was sent - a repeated POST
+        # could record a report twice. Connection failures are always retried.
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    try:
+        retry = Retry(backoff_jitter=RETRY_JITTER, **retry_options)
+    except TypeError:
+        # urllib3 < 2 has no jitter option
+        retry = Retry(**retry_options)
+
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if device_token:
+        session.headers["Authorization"] = f"Bearer {device_token}"
+    return session
+
+
+class Room:
+    """
+    One room: its pins, its AC and what the server was last told
+
+    Args:
+        room_number (str): The room
+        window_pin (int): GPIO of the window reed switch
+        ir_receiver_pin (int): GPIO of the IR receiver
+        ir_transmitter_pin (int): GPIO of the IR LED aimed at the room's AC
+        ir_codes (dict): Decoded remote code -> command
+        protocol: How state changes are sent to the AC (default: the
+                  remote's buttons in ir_codes, with StepProtocol)
+        post_event (callable): Called as post_event(kind, data) with input events
+        logger (logging.Logger, optional): Where the room logs
+    """
+
+    def __init__(self, room_number, window_pin, ir_receiver_pin, ir_transmitter_pin,
+                 ir_codes=None, protocol=None, post_event=None, logger=None):
+        self.room_number = str(room_number)
+        self.ir_transmitter_pin = ir_transmitter_pin
+        self.ir_codes = ir_codes if ir_codes is not None else {}
+        self.protocol = protocol or StepProtocol({command: code for code, command in self.ir_codes.items()})
+        self.post_event = post_event
+        self.logger = logger or logging.getLogger(f"AC_Controller.room_{self.room_number}")
+
+        # IR waveforms of the Pi's wave engine, set by attach()
+        self.ir_waveforms = None
+
+        self.ac_state = {"power": "off", "temperature": 24, "mode": "cool", "fan_speed": "auto"}
+        self.status = {"window_state": "closed", "ac_state": "off", "temperature": 22.0}
+        self.last_report = {"window_state": None, "ac_state": None, "temperature": None, "at": None, "ok": False}
+
+        # Edges are debounced and decoded on the pipeline's thread, then handed to the event loop
+        self.pipeline = InputPipeline(
+            window_pin, ir_receiver_pin,
+            on_window=lambda state, edge_ns: self.post_event("window", (self, state, edge_ns)),
+            on_ir_code=lambda code, edge_ns: self.post_event("ir_code", (self, code, edge_ns)),
+            ir_codes=self.ir_codes
+        )
+
+    def attach(self, pi, ir_waveforms):
+        """Start the room's input pipeline on pigpio and build its IR waveforms"""
+        self.pipeline.attach(pi)
+        self.pipeline.start()
+        self.status["window_state"] = self.pipeline.window_state
+
+        # Build the remote's waveforms now, so no button press waits for them
+        self.ir_waveforms = ir_waveforms
+        ir_waveforms.prebuild(self.protocol.known_bursts(self.ac_state), gpio=self.ir_transmitter_pin)
+
+    def snapshot(self):
+        """The room's state as reported to the server"""
+        return {
+            "window_state": self.status["window_state"],
+            "ac_state": self.status["ac_state"],
+            "temperature": self.status["temperature"]
+        }
+
+    def report(self):
+        """The room's status report"""
+        return {"room_number": self.room_number, **self.snapshot()}
+
+    def read_temperature(self):
+        """Read the room's temperature sensor"""
+        # In a real implementation, read the room's DHT22 (e.g. with Adafruit_DHT);
+        # for simulation, add a small random variation
+        return round(22.5 + random.uniform(-0.5, 0.5), 1)
+
+    # AC control (device thread only) ------------------------------------------
+
+    def send_ir_transmission(self, transmission):
+        """Send an IR transmission to the room's AC"""
+        self.logger.info(f"Sending IR: {transmission.describe()} ({transmission.duration_us / 1000:.0f} ms)")
+        if self.ir_waveforms is None:
+            # No transmitter set up - simulate the IR transmission
+            return
+        self.ir_waveforms.send(transmission, gpio=self.ir_transmitter_pin)
+
+    def set_ac_state(self, **changes):
+        """
+        Bring the room's AC to a new state with a single IR transmission
+
+        Args:
+            **changes: New values for power, temperature, mode and/or fan_speed
+
+        Returns:
+            bool: Whether the AC is now in the requested state
+        """
+        target = dict(self.ac_state, **changes)
+        try:
+            transmission = self.protocol.plan(self.ac_state, target)
+        except ValueError as e:
+            self.logger.error(f"Cannot change AC state: {e}")
+            return False
+
+        if transmission is not None:
+            self.send_ir_transmission(transmission)
+
+            # ac_state is the AC's state; the status reported to the server follows it
+            self.ac_state.update(transmission.state)
+            self.status["ac_state"] = self.ac_state["power"]
+            self.logger.info(f"AC state: {self.ac_state['power']}, {self.ac_state['mode']}, "
+                             f"{self.ac_state['temperature']}°C, fan {self.ac_state['fan_speed']}")
+
+        # A switched-off AC cannot take setting changes from button presses
+        return self.ac_state == dict(self.ac_state, **changes)
+
+    def execute_command(self, code):
+        """Apply an allowed remote control command"""
+        ac_state = self.ac_state
+        commands = {
+            "POWER": lambda: self.set_ac_state(power="on" if ac_state["power"] == "off" else "off"),
+            "TEMP_UP": lambda: self.set_ac_state(temperature=ac_state["temperature"] + 1),
+            "TEMP_DOWN": lambda: self.set_ac_state(temperature=ac_state["temperature"] - 1),
+            "MODE": lambda: self.set_ac_state(mode=MODES[(MODES.index(ac_state["mode"]) + 1) % len(MODES)]),
+            "FAN": lambda: self.set_ac_state(
+                fan_speed=FAN_SPEEDS[(FAN_SPEEDS.index(ac_state["fan_speed"]) + 1) % len(FAN_SPEEDS)])
+        }
+        if code in commands:
+            self.logger.info(f"Executing approved command: {code}")
+            commands[code]()
+        else:
+            self.logger.warning(f"Unknown command code: {code}")
+
+    def apply_server_action(self, action):
+        """Apply an action the server asked for (TURN_OFF, TURN_ON, SET_TEMP_<n>)"""
+        if action == "TURN_OFF":
+            self.set_ac_state(power="off")
+        elif action == "TURN_ON":
+            self.set_ac_state(power="on")
+        elif action.startswith("SET_TEMP_"):
+            try:
+                temperature = int(action.split("_")[-1])
+            except (ValueError, IndexError):
+                self.logger.error(f"Invalid temperature in server action: {action}")
+                return
+            # Go straight to the server's setpoint, in a single transmission
+            self.set_ac_state(temperature=temperature)
+        else:
+            self.logger.warning(f"Unknown server action: {action}")
+
+    def execute_device_command(self, command):
+        """Execute a command delivered over the command channel"""
+        if command == "turn_off":
+            self.apply_server_action("TURN_OFF")
+        elif command == "turn_on":
+            self.apply_server_action("TURN_ON")
+        elif command.startswith("set_temp_"):
+            self.apply_server_action(f"SET_TEMP_{command.split('_')[-1]}")
+        else:
+            raise ValueError(f"Unknown command: {command}")
+
+    # Reporting ---------------------------------------------------------------
+
+    def report_due(self, now, temperature_delta, heartbeat_seconds):
+        """
+        Why the room's status should be reported now, or None if it need not be
+
+        A report is only sent when the window or AC state changed, the
+        temperature moved by the policy's threshold, or the policy's heartbeat
+        interval passed without a report.
+
+        Args:
+            now: time.monotonic() value
+            temperature_delta (float): Temperature change reported right away
+            heartbeat_seconds (int): Longest time between reports
+
+        Returns:
+            str: Why a report is due, or None if it is not
+        """
+        last_report = self.last_report
+        if last_report["at"] is None:
+            return "startup"
+        if self.status["window_state"] != last_report["window_state"]:
+            return "window change"
+        if self.status["ac_state"] != last_report["ac_state"]:
+            return "AC change"
+
+        elapsed = now - last_report["at"]
+        if not last_report["ok"]:
+            return "retry" if elapsed >= REPORT_RETRY_INTERVAL else None
+        if last_report["temperature"] is None or \
+                abs(self.status["temperature"] - last_report["temperature"]) >= temperature_delta:
+            return "temperature change"
+        if elapsed >= heartbeat_seconds:
+            return "heartbeat"
+        return None
+
+    def record_report(self, sent, ok):
+        """Remember what the server was told (sent is the reported state)"""
+        self.last_report.update(window_state=sent["window_state"], ac_state=sent["ac_state"],
+                                temperature=sent["temperature"], at=time.monotonic(), ok=ok)
+
+
+class RoomLink:
+    """
+    Connects a Pi's rooms to the server
+
+    Args:
+        rooms (list): The Room objects
+        runtime (AsyncRuntime): Runtime everything runs on
+        session (requests.Session): Shared HTTP session
+        policy_cache (PolicyCache): The rooms' policy bundles
+        offline_queue (OfflineQueue): Reports waiting for the server
+        server_url (callable): Returns the server's current base URL
+        logger (logging.Logger, optional): Where messages about all rooms go
+    """
+
+    def __init__(self, rooms, runtime, session, policy_cache, offline_queue, server_url, logger=None):
+        self.rooms = {room.room_number: room for room in rooms}
+        self.runtime = runtime
+        self.session = session
+        self.policy_cache = policy_cache
+        self.offline_queue = offline_queue
+        self.server_url = server_url
+        self.logger = logger or logging.getLogger("AC_Controller.rooms")
+
+        self.status_update_wakeup = runtime.wakeup()
+        self.offline_flush_wakeup = runtime.wakeup()
+        self.policy_refresh_wakeup = runtime.wakeup()
+
+        runtime.on("window", self.on_window_event)
+        runtime.on("ir_code", self.on_ir_event)
+
+    # Input events -------------------------------------------------------------
+
+    async def on_window_event(self, event):
+        """Report a room's window state change"""
+        room, window_state, _ = event
+        room.logger.info(f"Window state changed to: {window_state}")
+        room.status["window_state"] = window_state
+        self.status_update_wakeup.set()
+
+    async def on_ir_event(self, event):
+        """Handle a room's IR command and record how long it took from the first IR edge"""
+        room, code, edge_ns = event
+        await self.handle_ir_command(room, code)
+        room.pipeline.observe_action(edge_ns)
+
+    async def handle_ir_command(self, room, code):
+        """
+        Decide a remote control command for a room and apply it
+
+        Returns:
+            bool: Whether the command was allowed
+        """
+        runtime = self.runtime
+        room.logger.info(f"IR command received: {code}")
+
+        # The room's state before the command, which the server records it against
+        state = room.snapshot()
+
+        # Decide locally with the server's policy bundle (no network round trip);
+        # the server is only asked while no bundle has been received yet
+        decision = self.policy_cache.decide(room.room_number, code, **state)
+        if decision is not None:
+            server_response = decision
+        else:
+            # One request has the server decide the command and record it
+            try:
+                server_response = await runtime.run_io(self.request_ir_command, room, code, state,
+                                                       timeout=PERMISSION_TIMEOUT)
+            except asyncio.TimeoutError:
+                server_response = None
+            if server_response is None:
+                # Fail closed, as on any other communication error
+                server_response = {"allowed": False, "reason": "Server communication error"}
+        allowed = server_response.get("allowed", False)
+
+        if not allowed:
+            room.logger.warning(f"Command {code} intercepted: {server_response.get('reason', 'Policy violation')}")
+            # If the server wants something else done instead, do it
+            alternative = server_response.get("alternative_action")
+            if alternative == "REPORT_STATUS":
+                self.status_update_wakeup.set()
+            elif alternative:
+                room.logger.info(f"Executing server-recommended alternative: {alternative}")
+                await runtime.run_device(room.apply_server_action, alternative)
+        else:
+            await runtime.run_device(room.execute_command, code)
+
+        if decision is not None:
+            # Record the local decision and the new state with the server, in the background
+            runtime.spawn(self.report_ir_command(room, code, state, decision), name="ir-report")
+        elif "ac_state" in server_response:
+            await self.record_ir_reply(room, state, server_response)
+        return allowed
+
+    async def report_ir_command(self, room, code, state, decision):
+        """Send a locally decided command to the server, or queue it if the server is unreachable"""
+        reply = await self.runtime.run_io(self.request_ir_command, room, code, state, decision)
+        if reply is None:
+            await self.runtime.run_io(self.offline_queue.enqueue, {
+                "room_number": room.room_number,
+                "command": code,
+                "decision": "allowed" if decision["allowed"] else "blocked",
+                "reason": decision.get("reason"),
+                "policy_version": decision.get("policy_version"),
+                **state
+            })
+            self.offline_flush_wakeup.set()
+            # The new state still has to reach the server
+            self.status_update_wakeup.set()
+            return
+        await self.record_ir_reply(room, state, reply)
+
+    async def record_ir_reply(self, room, state, reply):
+        """The server recorded an IR command and the room's new state; act on its reply"""
+        # The server already has the new state, so no separate status report is due for it
+        room.record_report(dict(state, ac_state=reply.get("ac_state")), ok=True)
+        await self.apply_reply(room, reply)
+
+    def request_ir_command(self, room, code, state, decision=None):
+        """
+        Send a room's IR command to the server, which records it with the room's new state
+
+        Args:
+            room (Room): The room
+            code (str): The command
+            state (dict): window_state, ac_state and temperature before the command
+            decision (dict, optional): Decision already made locally; without it
+                                       the server decides
+
+        Returns:
+            dict: The server's decision and the room's new ac_state, or None if
+                  the server could not be reached
+        """
+        payload = {"room_number": room.room_number, "command": code, **state}
+        if decision is not None:
+            payload["decision"] = "allowed" if decision["allowed"] else "blocked"
+            payload["reason"] = decision.get("reason")
+
+        try:
+            response = self.session.post(f"{self.server_url()}/api/ir_command", json=payload,
+                                         timeout=DEFAULT_TIMEOUT)
+            if response.status_code == 200:
+                return response.json()
+            room.logger.error(f"Server returned error {response.status_code} for IR command {code}")
+        except Exception as e:
+            room.logger.error(f"Error sending IR command {code}: {e}")
+        return None
+
+    async def apply_reply(self, room, reply):
+        """Act on the server's reply to a room's report or command"""
+        # The server's policy changed - fetch the new bundle in the background
+        if self.policy_cache.is_stale(room.room_number, reply.get("policy_version")):
+            self.policy_refresh_wakeup.set()
+
+        # The server wants the AC in another state (only changes it if it differs)
+        if "force_ac_state" in reply:
+            room.logger.info(f"Server forcing AC state to: {reply['force_ac_state']}")
+            await self.runtime.run_device(room.set_ac_state, power=reply["force_ac_state"])
+
+    # Status reports -----------------------------------------------------------
+
+    def post_reports(self, reports):
+        """
+        Send rooms' status reports in one request, queueing them on failure
+
+        Args:
+            reports (list): Status reports, at most one per room
+
+        Returns:
+            dict: Room number -> the server's reply to its report, or None if the
+                  server could not be reached
+        """
+        recorded_at = utc_now_iso()
+        try:
+            response = self.session.post(f"{self.server_url()}/api/gateway/reports", json={"reports": reports},
+                                         timeout=DEFAULT_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Server unreachable, queueing {len(reports)} reports: {e}")
+            response = None
+
+        if response is None or response.status_code >= 500:
+            for report in reports:
+                self.offline_queue.enqueue(report, recorded_at)
+            return None
+        if response.status_code != 200:
+            self.logger.error(f"Server refused the status reports: {response.status_code}")
+            return None
+
+        if len(self.offline_queue):
+            # Connection is back - deliver the backlog without holding up this update
+            self.offline_flush_wakeup.set()
+        return response.json().get("results", {})
+
+    def sample_sensors(self):
+        """Take a temperature reading in every room"""
+        for room in self.rooms.values():
+            room.status["temperature"] = room.read_temperature()
+
+    async def status_update_job(self):
+        """Sample every room's sensors and send the reports that are due in one request"""
+        await self.runtime.run_io(self.sample_sensors)
+
+        now = time.monotonic()
+        due = []
+        for room in self.rooms.values():
+            reason = room.report_due(now, *self.policy_cache.reporting(room.room_number))
+            if reason is not None:
+                due.append((room, room.report()))
+        if not due:
+            return
+
+        results = await self.runtime.run_io(self.post_reports, [report for _, report in due])
+        for room, report in due:
+            reply = (results or {}).get(room.room_number)
+            ok = reply is not None and "status_code" not in reply
+            room.record_report(report, ok)
+            if ok:
+                await self.apply_reply(room, reply)
+        self.logger.debug(f"Reported {len(due)} of {len(self.rooms)} rooms "
+                          f"({'sent' if results is not None else 'failed'})")
+
+    # Server commands ----------------------------------------------------------
+
+    def poll_commands(self):
+        """Wait (up to 25 s, on the server) for commands queued for any of the rooms"""
+        # The server holds this request open until a command is queued
+        response = self.session.get(
+            f"{self.server_url()}/api/commands",
+            params={"rooms": ",".join(self.rooms), "wait": 25},
+            timeout=(CONNECT_TIMEOUT, 35)
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Command channel returned {response.status_code}")
+        return response.json()
+
+    def acknowledge_command(self, room, command_id, success, message=None):
+        """Tell the server a command was executed so it can record delivery latency"""
+        try:
+            response = self.session.post(f"{self.server_url()}/api/commands/{command_id}/ack",
+                                         json={"room_number": room.room_number, "success": success,
+                                               "message": message},
+                                         timeout=DEFAULT_TIMEOUT)
+            if response.status_code == 200:
+                room.logger.info(f"Command {command_id} acknowledged "
+                                 f"(delivered in {response.json().get('delivery_latency_ms')} ms)")
+            else:
+                room.logger.error(f"Failed to acknowledge command {command_id}: {response.status_code}")
+        except Exception as e:
+            room.logger.error(f"Error acknowledging command {command_id}: {e}")
+
+    async def command_channel_job(self):
+        """Receive commands for every room as soon as the server queues them"""
+        runtime = self.runtime
+        while True:
+            try:
+                reply = await runtime.run_io(self.poll_commands, timeout=40)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error in command channel: {e!r}")
+                await asyncio.sleep(5 + random.uniform(0, 5))  # Back off (with jitter) before reconnecting
+                continue
+
+            commands = reply.get("commands", [])
+            if reply.get("retry_after"):
+                # Every waiting slot on the server is taken - poll again later
+                self.logger.warning(f"Command channel busy, polling again in {reply['retry_after']} s")
+                await asyncio.sleep(reply["retry_after"] + random.uniform(0, 5))
+
+            for command in commands:
+                room = self.rooms.get(str(command.get("room_number")))
+                if room is None:
+                    self.logger.warning(f"Command {command['id']} for a room this Pi does not manage")
+                    continue
+                room.logger.info(f"Server command received: {command['command']}")
+                try:
+                    await runtime.run_device(room.execute_device_command, command["command"])
+                    success, message = True, None
+                except Exception as e:
+                    room.logger.error(f"Error executing server command {command['command']}: {e}")
+                    success, message = False, str(e)
+                # Acknowledge in the background so the next poll starts right away
+                runtime.spawn(runtime.run_io(self.acknowledge_command, room, command["id"], success, message),
+                              name="command-ack")
+
+            # Let the dashboard see the new state right away
+            if commands:
+                self.status_update_wakeup.set()
+
+    # Other periodic jobs ------------------------------------------------------
+
+    async def offline_flush_job(self):
+        """Upload the offline queue once the server is reachable"""
+        if len(self.offline_queue):
+            await self.runtime.run_io(flush_offline_queue, self.offline_queue, self.session, self.server_url())
+
+    async def policy_refresh_job(self):
+        """Download the rooms' policy bundles whenever any of them changes"""
+        await self.runtime.run_io(self.policy_cache.refresh, self.session, self.server_url(), DEFAULT_TIMEOUT)
+
+    def log_input_stats(self, ir_waveforms=None):
+        """Log each room's input pipeline counters and latencies, and the IR waveform cache"""
+        for room in self.rooms.values():
+            stats = room.pipeline.stats()
+            latency = stats.pop("latency")
+            if not stats["edges"]:
+                continue
+            if stats["dropped_edges"]:
+                room.logger.warning(f"Input pipeline dropped {stats['dropped_edges']} edges")
+            room.logger.info(f"Input pipeline: {stats}")
+            for name, histogram in latency.items():
+                if histogram["count"]:
+                    room.logger.info(f"Input latency {name}: n={histogram['count']} p50={histogram['p50_ms']}ms "
+                                     f"p95={histogram['p95_ms']}ms p99={histogram['p99_ms']}ms "
+                                     f"max={histogram['max_ms']}ms")
+        if ir_waveforms is not None:
+            self.logger.info(f"IR waveforms: {ir_waveforms.stats()}")
+
+    def jobs(self, sample_interval, offline_flush_interval, policy_refresh_interval):
+        """
+        The link's jobs, for runtime.run()
+
+        Args:
+            sample_interval (int): Seconds between sensor samples
+            offline_flush_interval (int): Seconds between offline queue uploads
+            policy_refresh_interval (int): Seconds between policy revalidations
+                                           (a new version in a reply triggers one
+                                           right away)
+        """
+        runtime = self.runtime
+        return [
+            runtime.periodic("status updates", self.status_update_job, sample_interval,
+                             wakeup=self.status_update_wakeup),
+            runtime.periodic("offline queue delivery", self.offline_flush_job, offline_flush_interval,
+                             wakeup=self.offline_flush_wakeup, first_delay=offline_flush_interval),
+            runtime.periodic("policy refresh", self.policy_refresh_job, policy_refresh_interval,
+                             wakeup=self.policy_refresh_wakeup, jitter=60),
+            self.command_channel_job()
+        ]
@@ -0,0 +1,193 @@
+"""
+Command policy shared by the server and the Raspberry Pi clients.
+
+The rules that decide whether a remote-control command may run are kept
+here, free of Flask and database imports, so the exact same code runs in
+/api/check_command on the server and locally on the Pi (copy this file next
+to raspberry_pi_ir_client.py).
+
+The server compiles a room's global policy and AC settings into a small
+"policy bundle" dict, which also carries the reporting cadence the
+devices follow. The bundle's version is a hash of its content, so a
+client holding the current version can skip downloading it again, and any
+admin change produces a new version.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+# Bundle fields left out of the version hash
+UNVERSIONED_FIELDS = ('version', 'generated_at')
+
+# Reporting cadence when the policy does not set one
+DEFAULT_REPORT_TEMPERATURE_DELTA = 0.5
+DEFAULT_REPORT_HEARTBEAT_SECONDS = 300
+
+
+def _clock(value):
+    return value.strftime('%H:%M') if value else None
+
+
+def local_utc_offset_minutes():
+    """Offset of the server's local time (used for the shutoff schedule) from UTC, in minutes"""
+    offset = datetime.now() - datetime.utcnow()
+    return int(round(offset.total_seconds() / 900.0)) * 15
+
+
+def bundle_version(bundle):
+    """Content hash identifying a bundle"""
+    content = {key: value for key, value in bundle.items() if key not in UNVERSIONED_FIELDS}
+    encoded = json.dumps(content, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def build_bundle(policy, settings, room_number):
+    """
+    Compile the policy that applies to one room
+
+    Args:
+        policy (GlobalPolicy): Global policy (may be None)
+        settings (ACSettings): The room's settings (may be None)
+        room_number (str): The room
+
+    Returns:
+        dict: The policy bundle, including its version
+    """
+    bundle = {
+        'room_number': room_number,
+        'policy_active': bool(policy and policy.policy_active),
+        'min_allowed_temp': policy.min_allowed_temp if policy else None,
+        'max_allowed_temp': policy.max_allowed_temp if policy else None,
+        'scheduled_shutoff': {
+            'active': bool(policy and policy.scheduled_shutoff_active),
+            'shutoff_time': _clock(policy.scheduled_shutoff_time) if policy else None,
+            'startup_time': _clock(policy.scheduled_startup_time) if policy else None,
+            'apply_weekends': bool(policy and policy.apply_shutoff_weekends)
+        },
+        'settings_locked': bool(settings and settings.settings_locked),
+        'force_on_enabled': bool(settings.force_on_enabled) if settings else True,
+        'schedule_override': bool(settings and settings.schedule_override),
+        'reporting': {
+            'temperature_delta': (policy and policy.report_temperature_delta) or DEFAULT_REPORT_TEMPERATURE_DELTA,
+            'heartbeat_seconds': (policy and policy.report_heartbeat_seconds) or DEFAULT_REPORT_HEARTBEAT_SECONDS
+        },
+        'utc_offset_minutes': local_utc_offset_minutes()
+    }
+    bundle['version'] = bundle_version(bundle)
+    bundle['generated_at'] = datetime.utcnow().isoformat()
+    return bundle
+
+
+def bundle_local_time(bundle, utc_now=None):
+    """Current time on the server's clock, which the shutoff schedule is written in"""
+    utc_now = utc_now or datetime.utcnow()
+    return utc_now + timedelta(minutes=bundle.get('utc_offset_minutes') or 0)
+
+
+def time_in_range(start, end, current):
+    """Returns whether current is in the range [start, end]"""
+    # Handle the case where the range crosses midnight
+    if start <= end:
+        return start <= current <= end
+    else:
+        return start <= current or current <= end
+
+
+def in_scheduled_shutoff(bundle, local_now):
+    """Whether the shutoff schedule applies to the room right now"""
+    schedule = bundle.get('scheduled_shutoff') or {}
+    if not schedule.get('active') or bundle.get('schedule_override'):
+        return False
+    if not schedule.get('shutoff_time') or not schedule.get('startup_time'):
+        return False
+    if local_now.weekday() >= 5 and not schedule.get('apply_weekends'):
+        return False
+
+    shutoff = datetime.strptime(schedule['shutoff_time'], '%H:%M').time()
+    startup = datetime.strptime(schedule['startup_time'], '%H:%M').time()
+    return time_in_range(shutoff, startup, local_now.time())
+
+
+def reporting_cadence(bundle):
+    """
+    How often a device reports its status
+
+    Returns:
+        tuple: (temperature change in °C that is reported right away,
+                longest seconds between reports while nothing changes)
+    """
+    reporting = (bundle or {}).get('reporting') or {}
+    return (reporting.get('temperature_delta') or DEFAULT_REPORT_TEMPERATURE_DELTA,
+            reporting.get('heartbeat_seconds') or DEFAULT_REPORT_HEARTBEAT_SECONDS)
+
+
+def evaluate_command(bundle, command, window_state=None, ac_state=None, temperature=None, local_now=None):
+    """
+    Decide whether a remote-control command may run
+
+    Args:
+        bundle (dict): The room's policy bundle
+        command (str): Command, e.g. 'POWER', 'TEMP_UP', 'TEMP_DOWN'
+        window_state (str, optional): Current window state
+        ac_state (str, optional): Current AC state
+        temperature (float, optional): Current temperature (°C)
+        local_now (datetime, optional): Time on the server's clock (default: now)
+
+    Returns:
+        dict: {'allowed': True, ...} or {'allowed': False, 'reason': ..., 'alternative_action': ...}
+    """
+    if bundle.get('settings_locked'):
+        return {
+            'allowed': False,
+            'reason': 'Room settings locked by administrator',
+            'alternative_action': 'REPORT_STATUS'
+        }
+
+    turning_on = command == 'POWER' and ac_state == 'off'
+
+    # Check if this is a power-on command with window open
+    if turning_on and window_state == 'opened':
+        return {
+            'allowed': False,
+            'reason': 'Cannot turn on AC while window is open',
+            'alternative_action': 'REPORT_STATUS'
+        }
+
+    if turning_on and not bundle.get('force_on_enabled', True):
+        return {
+            'allowed': False,
+            'reason': 'Turning the AC on has been disabled by administrator',
+            'alternative_action': 'REPORT_STATUS'
+        }
+
+    # Check if this is a prohibited temperature change
+    if temperature is not None:
+        if command == 'TEMP_DOWN' and bundle.get('min_allowed_temp') is not None:
+            if temperature - 1 < bundle['min_allowed_temp']:
+                return {
+                    'allowed': False,
+                    'reason': f"Temperature cannot be set below {bundle['min_allowed_temp']}°C",
+                    'alternative_action': f"SET_TEMP_{int(bundle['min_allowed_temp'])}"
+                }
+
+        if command == 'TEMP_UP' and bundle.get('max_allowed_temp') is not None:
+            if temperature + 1 > bundle['max_allowed_temp']:
+                return {
+                    'allowed': False,
+                    'reason': f"Temperature cannot be set above {bundle['max_allowed_temp']}°C",
+                    'alternative_action': f"SET_TEMP_{int(bundle['max_allowed_temp'])}"
+                }
+
+    # Check if it's scheduled shutoff time
+    if turning_on and in_scheduled_shutoff(bundle, local_now or bundle_local_time(bundle)):
+        return {
+            'allowed': False,
+            'reason': 'AC usage not allowed during scheduled shutoff hours',
+            'alternative_action': 'REPORT_STATUS'
+        }
+
+    # All checks passed, command is allowed
+    return {
+        'allowed': True,
+        'policy_status': 'compliant'
+    }
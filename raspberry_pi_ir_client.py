@@ -16,37 +16,49 @@ Hardware Requirements:
 - Temperature/humidity sensor (e.g., DHT22/AM2302)
 
 Dependencies:
-- RPi.GPIO: For GPIO control
-- pigpio: For precise IR timing
+- pigpio (and its pigpiod daemon): GPIO edges with microsecond timestamps, and precise IR timing
 - LIRC: For IR code learning and playback
 - requests: For API communication
+- pi_offline_queue.py (copy it next to this script): Stores reports while the server is unreachable
+- pi_policy_cache.py and policy_engine.py (copy them next to this script): Decide commands locally
+- pi_async_runtime.py (copy it next to this script): Event loop the client runs on
+- pi_input_pipeline.py (copy it next to this script): Debounces the window sensor and decodes IR frames
+- pi_ir_protocol.py (copy it next to this script): Encodes AC state changes as IR transmissions
+- pi_ir_waveforms.py (copy it next to this script): Sends them as cached pigpio waveforms
+- pi_room.py (copy it next to this script): The room's AC and reporting, and everything
+  between the room and the server
 
 Setup:
 1. Install required libraries:
    sudo apt-get update
-   sudo apt-get install python3-pip python3-rpi.gpio lirc
+   sudo apt-get install python3-pip pigpio lirc
    sudo pip3 install pigpio requests
+   sudo systemctl enable --now pigpiod
 
 2. Configure LIRC for your IR receiver and transmitter
    Edit /etc/lirc/lirc_options.conf and /boot/config.txt accordingly
 
-3. Learn your AC remote codes using:
-   irrecord -d /dev/lirc0 ac_remote.conf
+3. Learn your AC remote codes: press each button once and copy the code
+   from the "Unknown IR code" log line into IR_CODES below
 
 4. Update the ROOM_NUMBER and SERVER_URL constants below
+
+A Pi wired to several rooms runs pi_gateway.py instead, once for all of them;
+both run their rooms through pi_room.py.
 """
 
 import os
 import sys
-import time
-import json
-import signal
+import asyncio
 import logging
-import threading
-import RPi.GPIO as GPIO
 import pigpio
 import requests
-from datetime import datetime
+from pi_offline_queue import OfflineQueue
+from pi_policy_cache import PolicyCache
+from pi_async_runtime import AsyncRuntime
+from pi_ir_protocol import StepProtocol, FullStateProtocol
+from pi_ir_waveforms import WaveformCache
+from pi_room import Room, RoomLink, create_http_session, DEFAULT_TIMEOUT, POOL_MAXSIZE
 
 # Configuration
 ROOM_NUMBER = "7"  # Update this to your room number
@@ -58,6 +70,12 @@ API_ENDPOINT = None  # Will be set once SERVER_URL is determined
 # Flag to indicate if we should try to get ngrok URL
 USE_NGROK = True
 
+# API token issued for this device on the server's Device Tokens page
+DEVICE_TOKEN = os.environ.get("AC_DEVICE_TOKEN")
+
+# Keep-alive HTTP session shared by all threads
+http_session = create_http_session(DEVICE_TOKEN)
+
 # Helper function to handle HTTP/HTTPS requests safely
 def send_request(method, url, **kwargs):
     """
@@ -71,6 +89,8 @@ def send_request(method, url, **kwargs):
     Returns:
         Response object or None on failure
     """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+
     # Force HTTPS to HTTP in offline mode if needed
     if url.startswith("https://") and not url.startswith("https://ngrok"):
         # Only convert non-ngrok URLs to HTTP (local dev URLs)
@@ -80,18 +100,11 @@ def send_request(method, url, **kwargs):
         
     try:
         # Try the original URL first
-        if method.lower() == 'get':
-            response = requests.get(url, **kwargs)
-        else:
-            response = requests.post(url, **kwargs)
-        return response
+        return http_session.request(method.upper(), url, **kwargs)
     except requests.exceptions.SSLError:
         # If SSL error, try with HTTP instead
         logger.warning(f"SSL error with {url}, trying HTTP fallback")
-        if method.lower() == 'get':
-            return requests.get(fallback_url, **kwargs)
-        else:
-            return requests.post(fallback_url, **kwargs)
+        return http_session.request(method.upper(), fallback_url, **kwargs)
     except Exception as e:
         logger.error(f"Request error: {e}")
         return None
@@ -124,31 +137,21 @@ def update_server_url():
     logger.info(f"Server URL set to: {SERVER_URL}")
     logger.info(f"API endpoint set to: {API_ENDPOINT}")
 
-# Initialize server URL
-update_server_url()
-
 # GPIO Pin Configuration
 WINDOW_SENSOR_PIN = 17  # GPIO pin for window sensor
 TEMPERATURE_SENSOR_PIN = 4  # GPIO pin for temperature sensor
 IR_RECEIVER_PIN = 18  # GPIO pin for IR receiver
 IR_TRANSMITTER_PIN = 22  # GPIO pin for IR transmitter
 
-# AC State
-ac_state = {
-    "power": "off",
-    "temperature": 24,
-    "mode": "cool",
-    "fan_speed": "auto"
+# Decoded remote codes (NEC, 32 bits) -> commands
+IR_CODES = {
+    # 0x00FF00FF: "POWER",
 }
 
-# Current status
-current_status = {
-    "room_number": ROOM_NUMBER,
-    "window_state": "closed",
-    "ac_state": "off",
-    "temperature": 22.0,
-    "last_update": datetime.now().isoformat()
-}
+# How state changes are sent to the AC: by pressing the remote's buttons
+# (learned in IR_CODES) in one timed burst, or - if the AC accepts full-state
+# frames - with FullStateProtocol(), which sets any state in a single frame
+ac_protocol = StepProtocol({command: code for code, command in IR_CODES.items()})
 
 # Setup logging
 logging.basicConfig(
@@ -161,153 +164,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger("AC_Controller")
 
+# Initialize server URL
+update_server_url()
+
+# Event loop and thread pools everything below runs on
+runtime = AsyncRuntime(io_workers=POOL_MAXSIZE)
+
+# The room: its pins, input pipeline, AC state and what the server was last told
+room = Room(ROOM_NUMBER, WINDOW_SENSOR_PIN, IR_RECEIVER_PIN, IR_TRANSMITTER_PIN,
+            ir_codes=IR_CODES, protocol=ac_protocol, post_event=runtime.post_event, logger=logger)
+
+# Seconds between sensor samples. A report is only sent when the window or
+# AC state changed, the temperature moved by the policy's threshold, or the
+# policy's heartbeat interval passed without a report.
+SENSOR_SAMPLE_INTERVAL = 10
+
+# Seconds between checks for a new tunnel URL
+SERVER_URL_REFRESH_INTERVAL = 600
+
+# Seconds between attempts to deliver reports queued while the server was unreachable
+OFFLINE_FLUSH_INTERVAL = 30
+
+# Seconds between revalidations of the policy bundle (status updates also
+# trigger a refresh as soon as the server reports a new version)
+POLICY_REFRESH_INTERVAL = 600
+
+# Seconds between input pipeline statistics in the log
+INPUT_STATS_INTERVAL = 600
+
+# Everything between the room and the server: status reports, IR commands
+# decided locally with the policy bundle, server commands and the offline queue
+room_link = RoomLink([room], runtime, http_session, PolicyCache([ROOM_NUMBER]), OfflineQueue(),
+                     server_url=lambda: SERVER_URL, logger=logger)
+
+# pigpio connection and IR waveforms, set up by setup_gpio()
+pi = None
+ir_waveforms = None
+
 # Initialize GPIO
 def setup_gpio():
-    """Initialize GPIO pins"""
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(WINDOW_SENSOR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    """Connect to pigpiod, start the input pipeline and build the remote's IR waveforms"""
+    global pi, ir_waveforms
+    pi = pigpio.pi()
+    if not pi.connected:
+        raise RuntimeError("Cannot connect to pigpiod - is the daemon running?")
     
-    # Setup interrupt for window sensor
-    GPIO.add_event_detect(WINDOW_SENSOR_PIN, 
-                          GPIO.BOTH, 
-                          callback=window_state_changed, 
-                          bouncetime=300)
+    ir_waveforms = WaveformCache(pi, IR_TRANSMITTER_PIN)
+    room.attach(pi, ir_waveforms)
     
     logger.info("GPIO initialized")
 
-# Window state change handler
-def window_state_changed(channel):
-    """Handle window state changes"""
-    time.sleep(0.1)  # Debounce
-    
-    # Read window state (LOW when closed, HIGH when open with pull-up resistor)
-    window_state = "opened" if GPIO.input(WINDOW_SENSOR_PIN) else "closed"
-    
-    logger.info(f"Window state changed to: {window_state}")
-    current_status["window_state"] = window_state
-    
-    # Send update to server
-    send_status_update()
-
-# Read temperature from sensor
-def read_temperature():
-    """Read temperature from DHT22 sensor"""
-    # In a real implementation, use Adafruit_DHT or similar library
-    # For simulation, we'll add a small random variation
-    import random
-    base_temp = 22.5
-    variation = random.uniform(-0.5, 0.5)
-    return round(base_temp + variation, 1)
-
-# IR command handler
-def handle_ir_command(code):
-    """Process received IR command"""
-    logger.info(f"IR command received: {code}")
-    
-    # Report the command to the server and ask for permission
-    # This is a more secure approach, letting the server decide what to do
-    allowed, server_response = request_server_permission(code)
-    
-    if not allowed:
-        logger.warning(f"Command {code} intercepted by server: {server_response.get('reason', 'Policy violation')}")
-        # Provide user feedback (beep, LED flash, etc.)
-        
-        # If the server wants us to do something else instead, do it
-        if 'alternative_action' in server_response:
-            logger.info(f"Executing server-recommended alternative: {server_response['alternative_action']}")
-            execute_server_action(server_response['alternative_action'])
-            
-        return False
-    else:
-        # Server allowed the command, execute it locally
-        execute_command(code)
-        
-        # Update server with new state
-        send_status_update()
-        
-        return True
-
-def request_server_permission(code):
-    """Ask the server for permission to execute a command"""
-    try:
-        payload = {
-            "room_number": ROOM_NUMBER,
-            "command": code,
-            "window_state": current_status["window_state"],
-            "ac_state": current_status["ac_state"],
-            "temperature": current_status["temperature"]
-        }
-        
-        response = requests.post(f"{SERVER_URL}/api/check_command", json=payload, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("allowed", False), data
-        else:
-            # Connection issue or server error - fail closed (more secure)
-            logger.error(f"Server returned error {response.status_code}. Failing closed.")
-            return False, {"reason": "Server communication error"}
-            
-    except Exception as e:
-        logger.error(f"Error requesting permission: {e}")
-        # On any exception, fail closed (secure)
-        return False, {"reason": "Connection error"}
-
-def execute_command(code):
-    """Execute a command after server approval"""
-    # Example mapping of IR codes to actions
-    commands = {
-        "POWER": toggle_power,
-        "TEMP_UP": lambda: change_temperature(1),
-        "TEMP_DOWN": lambda: change_temperature(-1),
-        "MODE": cycle_mode,
-        "FAN": cycle_fan_speed
-    }
-    
-    # Process the command
-    if code in commands:
-        logger.info(f"Executing approved command: {code}")
-        commands[code]()
-    else:
-        logger.warning(f"Unknown command code: {code}")
-        
-def execute_server_action(action):
-    """Execute an action recommended by the server"""
-    if action == "TURN_OFF":
-        if current_status["ac_state"] == "on":
-            toggle_power()  # Turn off the AC
-            
-    elif action == "TURN_ON":
-        if current_status["ac_state"] == "off":
-            toggle_power()  # Turn on the AC
-            
-    elif action.startswith("SET_TEMP_"):
-        try:
-            temp = int(action.split("_")[-1])
-            # Set temperature to what the server wants
-            current_temp = ac_state["temperature"]
-            if temp > current_temp:
-                for _ in range(temp - current_temp):
-                    change_temperature(1)
-            elif temp < current_temp:
-                for _ in range(current_temp - temp):
-                    change_temperature(-1)
-        except (ValueError, IndexError):
-            logger.error(f"Invalid temperature in server action: {action}")
-            
-    elif action == "REPORT_STATUS":
-        # Just report status without changing anything
-        send_status_update()
-    else:
-        logger.warning(f"Unknown server action: {action}")
-
 # Check if command should be intercepted based on server policy
 def check_server_policy(command):
     """Check with server if the command should be intercepted"""
     try:
-        response = requests.get(
+        response = http_session.get(
             f"{SERVER_URL}/api/check_policy/{ROOM_NUMBER}", 
-            params={"command": command, "current_temp": current_status["temperature"]}
+            params={"command": command, "current_temp": room.status["temperature"]},
+            timeout=DEFAULT_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -338,56 +252,6 @@ def check_server_policy(command):
     # If server is unreachable or any error occurs, default to allowing the command
     return False, None
 
-# AC control functions
-def toggle_power():
-    """Toggle AC power state"""
-    ac_state["power"] = "on" if ac_state["power"] == "off" else "off"
-    current_status["ac_state"] = ac_state["power"]
-    logger.info(f"AC power toggled to: {ac_state['power']}")
-    
-    # Send IR command to AC
-    send_ir_command("POWER")
-
-def change_temperature(delta):
-    """Change AC temperature setting"""
-    ac_state["temperature"] += delta
-    # Limit temperature range
-    ac_state["temperature"] = max(18, min(30, ac_state["temperature"]))
-    logger.info(f"AC temperature changed to: {ac_state['temperature']}°C")
-    
-    # Send IR command to AC
-    send_ir_command(f"TEMP_{ac_state['temperature']}")
-
-def cycle_mode():
-    """Cycle through AC modes (cool, heat, fan, dry)"""
-    modes = ["cool", "heat", "fan", "dry"]
-    current_index = modes.index(ac_state["mode"])
-    ac_state["mode"] = modes[(current_index + 1) % len(modes)]
-    logger.info(f"AC mode changed to: {ac_state['mode']}")
-    
-    # Send IR command to AC
-    send_ir_command(f"MODE_{ac_state['mode'].upper()}")
-
-def cycle_fan_speed():
-    """Cycle through fan speeds (auto, low, medium, high)"""
-    speeds = ["auto", "low", "medium", "high"]
-    current_index = speeds.index(ac_state["fan_speed"])
-    ac_state["fan_speed"] = speeds[(current_index + 1) % len(speeds)]
-    logger.info(f"AC fan speed changed to: {ac_state['fan_speed']}")
-    
-    # Send IR command to AC
-    send_ir_command(f"FAN_{ac_state['fan_speed'].upper()}")
-
-# Send IR command to AC
-def send_ir_command(command):
-    """Send IR command to AC unit"""
-    logger.info(f"Sending IR command: {command}")
-    # In a real implementation, use LIRC to send the command
-    # os.system(f"irsend SEND_ONCE ac_remote {command}")
-    
-    # Simulate IR transmission
-    logger.info(f"IR signal sent: {command}")
-
 # Send IR command event to server
 def send_ir_command_event(command):
     """Send IR command information to the server"""
@@ -396,10 +260,10 @@ def send_ir_command_event(command):
         payload = {
             "room_number": ROOM_NUMBER,
             "command": command,
-            "temperature": current_status["temperature"]
+            "temperature": room.status["temperature"]
         }
         
-        response = requests.post(f"{SERVER_URL}/receive_data", json=payload)
+        response = http_session.post(f"{SERVER_URL}/receive_data", json=payload, timeout=DEFAULT_TIMEOUT)
         
         if response.status_code == 200:
             logger.info(f"IR command {command} sent to server successfully")
@@ -420,119 +284,44 @@ def send_ir_command_event(command):
         
     return False, "Server communication error"
 
-# Send status update to server
-def send_status_update():
-    """Send current status to the central server"""
-    # Update temperature reading
-    current_status["temperature"] = read_temperature()
-    current_status["last_update"] = datetime.now().isoformat()
-    
-    try:
-        # Include all relevant status information
-        payload = {
-            "room_number": ROOM_NUMBER,
-            "window_state": current_status["window_state"],
-            "ac_state": current_status["ac_state"],
-            "temperature": current_status["temperature"]
-        }
-        
-        response = requests.post(f"{SERVER_URL}/receive_data", json=payload)
-        
-        if response.status_code == 200:
-            data = response.json()
-            logger.info("Status update sent successfully")
-            
-            # Check if server wants us to force a state change
-            if "force_ac_state" in data:
-                forced_state = data["force_ac_state"]
-                logger.info(f"Server forcing AC state to: {forced_state}")
-                
-                # Only change state if it's different
-                if current_status["ac_state"] != forced_state:
-                    # Update local state
-                    ac_state["power"] = forced_state
-                    current_status["ac_state"] = forced_state
-                    
-                    # Send command to AC
-                    if forced_state == "on":
-                        send_ir_command("POWER_ON")
-                    else:
-                        send_ir_command("POWER_OFF")
-            
-            # Check for any actions required by the server
-            if data.get("action") == "turn_off_ac" and current_status["ac_state"] == "on":
-                logger.warning("Server requested AC turn off")
-                toggle_power()  # Turn off the AC
-                
-            return True
-        else:
-            logger.error(f"Failed to send status update: {response.status_code}")
-            
-    except Exception as e:
-        logger.error(f"Error sending status update: {e}")
-        
-    return False
+# Periodic jobs, run by the runtime next to the room link's
+async def server_url_job():
+    """Check whether the tunnel URL has changed"""
+    logger.info("Checking for ngrok URL updates...")
+    await runtime.run_io(update_server_url)
 
-# Background thread for regular status updates
-def status_update_thread():
-    """Background thread to periodically update status"""
-    update_counter = 0
-    while True:
-        try:
-            # Send regular status update
-            send_status_update()
-            
-            # Every 10 updates (10 minutes), check if ngrok URL has changed
-            update_counter += 1
-            if update_counter >= 10:
-                logger.info("Checking for ngrok URL updates...")
-                update_server_url()
-                update_counter = 0
-                
-            time.sleep(60)  # Update every minute
-        except Exception as e:
-            logger.error(f"Error in status update thread: {e}")
-            time.sleep(60)  # Retry after a minute
+async def input_stats_job():
+    """Log the input pipeline's counters and latencies"""
+    room_link.log_input_stats(ir_waveforms)
 
 # Cleanup function
 def cleanup():
     """Clean up GPIO and other resources"""
     logger.info("Cleaning up resources...")
-    GPIO.cleanup()
-
-# Signal handler for graceful shutdown
-def signal_handler(sig, frame):
-    """Handle termination signals"""
-    logger.info("Shutdown signal received")
-    cleanup()
-    sys.exit(0)
+    room.pipeline.stop()
+    if pi is not None:
+        if ir_waveforms is not None:
+            ir_waveforms.clear()
+        pi.stop()
 
 # Main function
 def main():
     """Main function"""
     try:
-        # Register signal handlers
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
-        
         # Setup GPIO
         setup_gpio()
         
-        # Start status update thread
-        updater = threading.Thread(target=status_update_thread)
-        updater.daemon = True
-        updater.start()
-        
         logger.info(f"AC Controller started for Room {ROOM_NUMBER}")
         logger.info(f"Connecting to server at {SERVER_URL}")
         
-        # Initial status update
-        send_status_update()
-        
-        # In a real implementation, you would start an IR receiver loop here
-        # For the example, we'll simulate by just keeping the script running
-        while True:
-            time.sleep(1)
+        # Runs until SIGINT/SIGTERM
+        asyncio.run(runtime.run(
+            *room_link.jobs(SENSOR_SAMPLE_INTERVAL, OFFLINE_FLUSH_INTERVAL, POLICY_REFRESH_INTERVAL),
+            runtime.periodic("server URL refresh", server_url_job, SERVER_URL_REFRESH_INTERVAL,
+                             first_delay=SERVER_URL_REFRESH_INTERVAL),
+            runtime.periodic("input statistics", input_stats_job, INPUT_STATS_INTERVAL,
+                             first_delay=INPUT_STATS_INTERVAL)
+        ))
             
     except Exception as e:
         logger.error(f"Error in main function: {e}")
@@ -540,4 +329,4 @@ def main():
         cleanup()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
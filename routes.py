@@ -1,9 +1,13 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, make_response
+from flask import render_template, redirect, url_for, flash, request, jsonify, make_response, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_mail import Message
 from app import app, db, login_manager, mail
 from models import User, ACSettings, WindowEvent, SessionAtributes, PendingWindowEvent, GlobalPolicy, RoomStatus
+from user_cache import principal_cache
+from device_auth import device_auth_required
+from policy_engine import build_bundle
 import random  # For mock temperature data
+from functools import wraps
 from datetime import datetime, timedelta, time
 
 
@@ -18,7 +22,49 @@ def time_in_range(start, end, current):
 
 @login_manager.user_loader
 def load_user(id):
-    return db.session.get(User, int(id))
+    # Served from a short-lived cache of principals; falls back to the database on a miss
+    return principal_cache.get(int(id), lambda user_id: db.session.get(User, user_id))
+
+
+def etag_by_room_version(view):
+    """
+    Answer conditional GETs for a per-room API without touching the database.
+
+    The ETag comes from the change bus's version counter for the room, which is
+    bumped whenever a status, event, pending action or setting of the room is
+    committed. While it is unchanged, a request carrying the client's ETag in
+    If-None-Match gets 304 Not Modified before the view runs, so any access
+    check must be applied outside this decorator (see room_access_required).
+    """
+    @wraps(view)
+    def wrapper(room_number, *args, **kwargs):
+        from change_bus import bus, BOOT_ID
+
+        # Read the version before building the response, so a change committed
+        # meanwhile can only make the ETag older than the data, never newer
+        etag = f"{view.__name__}-{room_number}-{BOOT_ID}-{bus.room_version(room_number)}"
+
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(room_number, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # Always revalidate
+        return response
+    return wrapper
+
+
+def room_access_required(view):
+    """Only let admins and the room's own user through to a per-room view"""
+    @wraps(view)
+    def wrapper(room_number, *args, **kwargs):
+        if not current_user.is_admin and current_user.room_number != room_number:
+            return jsonify({'error': 'Unauthorized'}), 403
+        return view(room_number, *args, **kwargs)
+    return wrapper
 
 
 @app.route('/')
@@ -284,178 +330,85 @@ def event_logs():
         flash('You must be an admin to access the event logs', 'error')
         return redirect(url_for('room_dashboard'))
     
+    from event_pagination import filtered_event_query, keyset_page, cached_event_count
+
     # Get filter parameters
-    page = request.args.get('page', 1, type=int)
-    selected_room = request.args.get('room', 'all')
-    event_type = request.args.get('event_type', 'all')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    # Default to 50 items per page
-    per_page = 50
-    
-    # Build the query with filters
-    query = WindowEvent.query
-    
-    # Apply room filter
-    if selected_room != 'all':
-        query = query.filter_by(room_number=selected_room)
-    
-    # Apply event type filter
-    if event_type == 'window_opened':
-        query = query.filter_by(window_state='opened')
-    elif event_type == 'window_closed':
-        query = query.filter_by(window_state='closed')
-    elif event_type == 'ac_on':
-        query = query.filter_by(ac_state='on')
-    elif event_type == 'ac_off':
-        query = query.filter_by(ac_state='off')
-    elif event_type == 'policy_violation':
-        query = query.filter_by(policy_compliant=False)
-    
-    # Apply date filters
-    if date_from:
-        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-        query = query.filter(WindowEvent.timestamp >= date_from_obj)
-    
-    if date_to:
-        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
-        # Add a day to include the full end date
-        date_to_obj = date_to_obj + timedelta(days=1)
-        query = query.filter(WindowEvent.timestamp < date_to_obj)
-    
-    # Order by timestamp descending
-    query = query.order_by(WindowEvent.timestamp.desc())
-    
-    # Get total count and paginate
-    total_events = query.count()
-    events = query.paginate(page=page, per_page=per_page, error_out=False)
-    
-    # Calculate total pages
-    total_pages = (total_events + per_page - 1) // per_page
-    
+    filters = {
+        'selected_room': request.args.get('room', 'all'),
+        'event_type': request.args.get('event_type', 'all'),
+        'date_from': request.args.get('date_from', ''),
+        'date_to': request.args.get('date_to', '')
+    }
+
+    # Seek to the page from its cursor instead of counting and skipping rows
+    page = keyset_page(
+        filtered_event_query(**filters),
+        after=request.args.get('after'),
+        before=request.args.get('before')
+    )
+
     # Get all rooms for the room filter dropdown
     rooms = User.query.filter(User.room_number.isnot(None)).all()
     
     return render_template(
         'event_logs.html',
-        events=events.items,
-        total_events=total_events,
-        page=page,
-        total_pages=total_pages,
+        events=page['events'],
+        next_cursor=page['next_cursor'],
+        prev_cursor=page['prev_cursor'],
+        total_events=cached_event_count(filters),
         rooms=rooms,
-        selected_room=selected_room,
-        event_type=event_type,
-        date_from=date_from,
-        date_to=date_to
+        selected_room=filters['selected_room'],
+        event_type=filters['event_type'],
+        date_from=filters['date_from'],
+        date_to=filters['date_to']
     )
 
 
 @app.route('/api/export_events')
 @login_required
 def export_events():
-    """Export events to CSV format"""
+    """
+    Export events as a streamed download.
+
+    Query parameters:
+        format: 'csv', 'ndjson' or 'json' (default 'csv')
+        room, event_type, date_from, date_to: same filters as the event log
+        gzip: '0' to disable compression for clients that accept gzip
+    """
     if not current_user.is_admin:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    from event_pagination import filtered_event_query
+    from event_export import export_rows, iter_export, gzip_chunks, CONTENT_TYPES
+
     # Get filter parameters
     format_type = request.args.get('format', 'csv')
+    if format_type not in CONTENT_TYPES:
+        format_type = 'json'
     selected_room = request.args.get('room', 'all')
     event_type = request.args.get('event_type', 'all')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
     
-    # Build the query with filters (similar to event_logs route)
-    query = WindowEvent.query
-    
-    # Apply room filter
-    if selected_room != 'all':
-        query = query.filter_by(room_number=selected_room)
-    
-    # Apply event type filter
-    if event_type == 'window_opened':
-        query = query.filter_by(window_state='opened')
-    elif event_type == 'window_closed':
-        query = query.filter_by(window_state='closed')
-    elif event_type == 'ac_on':
-        query = query.filter_by(ac_state='on')
-    elif event_type == 'ac_off':
-        query = query.filter_by(ac_state='off')
-    elif event_type == 'policy_violation':
-        query = query.filter_by(policy_compliant=False)
-    
-    # Apply date filters
-    if date_from:
-        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-        query = query.filter(WindowEvent.timestamp >= date_from_obj)
-    
-    if date_to:
-        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
-        # Add a day to include the full end date
-        date_to_obj = date_to_obj + timedelta(days=1)
-        query = query.filter(WindowEvent.timestamp < date_to_obj)
+    query = filtered_event_query(selected_room, event_type, date_from, date_to)
     
-    # Order by timestamp descending
-    events = query.order_by(WindowEvent.timestamp.desc()).all()
-    
-    # Import temperature conversion utility
-    from temperature_utils import celsius_to_fahrenheit
-
-    if format_type == 'csv':
-        # Create CSV response
-        import csv
-        from io import StringIO
-        
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['ID', 'Room', 'Timestamp', 'Window State', 'AC State', 
-                        'Temperature (°F)', 'Policy Compliant', 'Compliance Issue'])
-        
-        # Write data rows
-        for event in events:
-            # Convert temperature to Fahrenheit
-            temp_f = celsius_to_fahrenheit(event.temperature) if event.temperature is not None else None
-            
-            writer.writerow([
-                event.id,
-                event.room_number,
-                event.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                event.window_state,
-                event.ac_state,
-                f"{temp_f:.1f}" if temp_f is not None else "",
-                'Yes' if event.policy_compliant else 'No',
-                event.compliance_issue or ''
-            ])
-        
-        # Create response
-        response = make_response(output.getvalue())
-        response.headers["Content-Disposition"] = f"attachment; filename=event_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        response.headers["Content-type"] = "text/csv"
-        return response
+    # Rows are fetched and written out in batches while the response is sent
+    chunks = iter_export(export_rows(query), format_type)
     
+    use_gzip = ('gzip' in request.headers.get('Accept-Encoding', '').lower()
+                and request.args.get('gzip') != '0')
+    if use_gzip:
+        body = gzip_chunks(chunks)
     else:
-        # Return JSON by default
-        events_data = []
-        for event in events:
-            # Convert temperature to Fahrenheit
-            temp_f = celsius_to_fahrenheit(event.temperature) if event.temperature is not None else None
-            
-            events_data.append({
-                'id': event.id,
-                'room_number': event.room_number,
-                'timestamp': event.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                'window_state': event.window_state,
-                'ac_state': event.ac_state,
-                'temperature': event.temperature,
-                'temperature_f': temp_f,
-                'unit': 'F',  # Indicate preferred unit
-                'policy_compliant': event.policy_compliant,
-                'compliance_issue': event.compliance_issue
-            })
-        
-        return jsonify({'events': events_data})
+        body = (chunk.encode('utf-8') for chunk in chunks)
+    
+    response = Response(stream_with_context(body), mimetype=CONTENT_TYPES[format_type])
+    if format_type != 'json':
+        response.headers["Content-Disposition"] = f"attachment; filename=event_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format_type}"
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 
 @app.route('/policy_management')
@@ -516,9 +469,16 @@ def save_policy():
         
         # Energy conservation settings
         policy.energy_conservation_active = 'energy_conservation_active' in request.form
+        policy.quarantine_noisy_rooms = 'quarantine_noisy_rooms' in request.form
         conservation_f = float(request.form.get('conservation_threshold', 75.2))  # Default 24°C = 75.2°F
         policy.conservation_threshold = fahrenheit_to_celsius(conservation_f)
         
+        # Reporting cadence (the temperature change is entered in °F degrees)
+        delta_f = float(request.form.get('report_temperature_delta', 0.9))  # Default 0.5°C = 0.9°F
+        policy.report_temperature_delta = round(min(max(delta_f, 0.2), 9.0) * 5 / 9, 2)
+        heartbeat_minutes = float(request.form.get('report_heartbeat_minutes', 5))
+        policy.report_heartbeat_seconds = int(min(max(heartbeat_minutes, 0.5), 60) * 60)
+        
         # Schedule settings
         policy.scheduled_shutoff_active = 'scheduled_shutoff_active' in request.form
         policy.apply_shutoff_weekends = 'apply_shutoff_weekends' in request.form
@@ -727,11 +687,10 @@ def register():
 
 @app.route('/api/temperature/<room_number>')
 @login_required
+@room_access_required
+@etag_by_room_version
 def get_temperature(room_number):
     from temperature_utils import celsius_to_fahrenheit
-    
-    if not current_user.is_admin and current_user.room_number != room_number:
-        return jsonify({'error': 'Unauthorized'}), 403
 
     # Get current temperature from room status
     room_status = RoomStatus.query.filter_by(room_number=room_number).first()
@@ -758,6 +717,7 @@ def get_temperature(room_number):
 
 
 @app.route('/api/room_status/<room_number>')
+@etag_by_room_version
 def get_room_status(room_number):
     # Import temperature conversion utility
     from temperature_utils import celsius_to_fahrenheit
@@ -807,6 +767,70 @@ def get_room_status(room_number):
     })
 
 
+@app.route('/api/room_statuses')
+@login_required
+def get_room_statuses():
+    """
+    Bulk version of /api/room_status for dashboards showing many rooms.
+
+    Builds every room's status from a single RoomStatus/ACSettings join instead
+    of one request (and three queries) per room. Optional query parameters:
+        rooms:    comma-separated room numbers to restrict the result to
+        page:     1-based page number (only used together with per_page)
+        per_page: page size, capped at 1000
+    """
+    from temperature_utils import celsius_to_fahrenheit
+    from change_bus import bus, BOOT_ID
+
+    # Any committed change to any room bumps the bus version
+    scope = 'all' if current_user.is_admin else current_user.room_number
+    etag = f"room_statuses-{scope}-{BOOT_ID}-{bus.version()}"
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    query = db.session.query(RoomStatus, ACSettings)\
+        .outerjoin(ACSettings, ACSettings.room_number == RoomStatus.room_number)
+
+    # Regular users only ever see their own room
+    if not current_user.is_admin:
+        query = query.filter(RoomStatus.room_number == current_user.room_number)
+
+    rooms_filter = request.args.get('rooms', '')
+    if rooms_filter:
+        room_numbers = [room.strip() for room in rooms_filter.split(',') if room.strip()]
+        query = query.filter(RoomStatus.room_number.in_(room_numbers))
+
+    query = query.order_by(RoomStatus.room_number)
+
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', type=int)
+    if per_page:
+        per_page = max(1, min(per_page, 1000))
+        query = query.limit(per_page).offset((max(page, 1) - 1) * per_page)
+
+    rooms = {}
+    for status, settings in query.all():
+        summary = status.to_summary()
+        if settings:
+            summary['min_temperature_f'] = celsius_to_fahrenheit(settings.min_temperature)
+            summary['auto_shutoff'] = settings.auto_shutoff
+            summary['email_notifications'] = settings.email_notifications
+        rooms[status.room_number] = summary
+
+    response = jsonify({
+        'rooms': rooms,
+        'count': len(rooms),
+        'page': page if per_page else None,
+        'per_page': per_page,
+        'unit': 'F'  # Indicate preferred unit
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate
+    return response
+
+
 @app.route('/api/send_command/<room_number>', methods=['POST'])
 @login_required
 def send_command(room_number):
@@ -829,9 +853,7 @@ def send_command(room_number):
         
     # Process the command
     if command == 'turn_off':
-        # Force the AC to turn off
-        status.has_pending_event = True
-        status.pending_event_time = datetime.now()
+        # Force the AC to turn off (the command channel delivers it)
         status.policy_violation_type = 'Manual override - Turn OFF'
         db.session.commit()
         
@@ -844,17 +866,20 @@ def send_command(room_number):
             compliance_issue='Manual AC turn OFF command'
         )
         db.session.add(event)
+
+        # Push the command to the room's client
+        from command_channel import queue_command
+        device_command = queue_command(room_number, 'turn_off', 'send_command')
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'message': 'Command queued for execution. AC will be turned off when client next connects.'
+            'command_id': device_command.id,
+            'message': 'Command sent to the room controller. AC will be turned off shortly.'
         })
         
     elif command == 'turn_on':
-        # Force the AC to turn on
-        status.has_pending_event = True
-        status.pending_event_time = datetime.now()
+        # Force the AC to turn on (the command channel delivers it)
         status.policy_violation_type = 'Manual override - Turn ON'
         db.session.commit()
         
@@ -867,11 +892,16 @@ def send_command(room_number):
             compliance_issue='Manual AC turn ON command'
         )
         db.session.add(event)
+
+        # Push the command to the room's client
+        from command_channel import queue_command
+        device_command = queue_command(room_number, 'turn_on', 'send_command')
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'message': 'Command queued for execution. AC will be turned on when client next connects.'
+            'command_id': device_command.id,
+            'message': 'Command sent to the room controller. AC will be turned on shortly.'
         })
         
     elif command.startswith('set_temp_'):
@@ -879,9 +909,7 @@ def send_command(room_number):
             # Parse the temperature from the command (e.g., set_temp_24)
             temp = float(command.split('_')[-1])
             
-            # Add a pending event for the client
-            status.has_pending_event = True
-            status.pending_event_time = datetime.now()
+            # Record the override (the command channel delivers it)
             status.policy_violation_type = f'Manual temperature set to {temp}°C'
             db.session.commit()
             
@@ -894,11 +922,16 @@ def send_command(room_number):
                 compliance_issue=f'Manual temperature set command: {temp}°C'
             )
             db.session.add(event)
+
+            # Push the command to the room's client
+            from command_channel import queue_command
+            device_command = queue_command(room_number, f'set_temp_{int(round(temp))}', 'send_command')
             db.session.commit()
             
             return jsonify({
                 'success': True,
-                'message': f'Command queued for execution. Temperature will be set to {temp}°C when client next connects.'
+                'command_id': device_command.id,
+                'message': f'Command sent to the room controller. Temperature will be set to {temp}°C shortly.'
             })
             
         except (ValueError, IndexError):
@@ -1001,6 +1034,10 @@ def force_ac_state(room_number, state):
             room_status.pending_event_time = None
         
         db.session.add(event)
+
+        # Push the new state to the room's client right away
+        from command_channel import queue_command
+        queue_command(room_number, f'turn_{state}', 'force_ac_state')
         db.session.commit()
         
         action = "turned on" if state == "on" else "turned off"
@@ -1179,6 +1216,10 @@ def receive_data_internal(data):
             status = RoomStatus(room_number=room_number)
             db.session.add(status)
         
+        # Look for stuck sensors and flapping windows
+        from anomaly_detector import check_report
+        quarantined = check_report(status, temperature, window_state, policy)
+        
         # Update room status
         status.current_temperature = temperature
         status.window_state = window_state
@@ -1193,7 +1234,7 @@ def receive_data_internal(data):
             db.session.add(settings)
         
         # Check for window opened with AC on - potential automatic shutoff
-        if window_state == 'opened' and ac_state == 'on' and settings.auto_shutoff:
+        if window_state == 'opened' and ac_state == 'on' and settings.auto_shutoff and not quarantined:
             # Record pending event for delayed AC shutoff
             shutoff_delay = settings.shutoff_delay  # Delay in seconds
             scheduled_time = datetime.utcnow() + timedelta(seconds=shutoff_delay)
@@ -1254,35 +1295,17 @@ def receive_data_internal(data):
 
 
 @app.route('/api/recent_events/<room_number>')
+@etag_by_room_version
 def get_recent_events(room_number):
-        
-    # Import temperature conversion utility
-    from temperature_utils import celsius_to_fahrenheit
-        
     # Fetch latest events for this room (limit to 10)
     events = WindowEvent.query.filter_by(room_number=room_number)\
         .order_by(WindowEvent.timestamp.desc()).limit(10).all()
-        
-    # Format events for JSON response
-    events_data = []
-    for event in events:
-        # Convert temperature to Fahrenheit
-        temp_f = celsius_to_fahrenheit(event.temperature) if event.temperature else None
-        
-        events_data.append({
-            'id': event.id,
-            'timestamp': event.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'window_state': event.window_state,
-            'ac_state': event.ac_state,
-            'temperature': event.temperature,
-            'temperature_f': temp_f,
-            'unit': 'F'  # Indicate preferred unit
-        })
-        
-    return jsonify({'events': events_data})
+
+    return jsonify({'events': [event.to_dict() for event in events]})
 
 
 @app.route('/api/check_policy/<room_number>')
+@device_auth_required
 def check_policy(room_number):
     """Check if an AC command should be intercepted based on policy"""
     # API endpoint for the Raspberry Pi client to check if commands should be intercepted
@@ -1384,6 +1407,7 @@ def check_policy(room_number):
 
 
 @app.route('/receive_data', methods=['POST'])
+@device_auth_required
 def receive_data():
     """
     Receive window/AC data from clients and process it according to rules.
@@ -1545,231 +1569,311 @@ def receive_data():
                 return jsonify({'success': True, 'message': f'Command {command} processed'})
         
         # Standard window/AC state update
-        window_state = data.get('window_state')
-        ac_state = data.get('ac_state', 'off')
-        temperature = data.get('temperature')
-        
-        # Validate room number
-        if not room_number:
-            return jsonify({"message": "Room number is required", "status": "error"}), 400
-        
-        # Get room settings
-        settings = ACSettings.query.filter_by(room_number=room_number).first()
-        if not settings:
-            settings = ACSettings(room_number=room_number)
-            db.session.add(settings)
-            db.session.commit()
+        payload, status_code = process_status_report(data)
+        return jsonify(payload), status_code
+    else:
+        return jsonify({
+            "message": "Request must be JSON",
+            "status": "error"
+        }), 400
 
-        # Get or create room status
-        room_status = RoomStatus.query.filter_by(room_number=room_number).first()
-        if not room_status:
-            room_status = RoomStatus(
-                room_number=room_number,
-                current_temperature=float(temperature) if temperature else 22.0,
-                window_state=window_state,
-                ac_state=ac_state
-            )
-            db.session.add(room_status)
-            db.session.commit()
-            
-        # Get global policy
-        policy = GlobalPolicy.query.first()
-        if not policy:
-            policy = GlobalPolicy()
-            db.session.add(policy)
-            db.session.commit()
 
-        app.logger.info(f"Received data: room={room_number}, window={window_state}, ac={ac_state}, temp={temperature}")
-        
-        # Log the window event and handle delayed actions
-        try:
-            # Get current temperature
-            temp_value = float(temperature) if temperature else 22.0
-            
-            # Apply policy temperature limits if needed
-            is_compliant = True
-            compliance_issue = None
-            
-            if policy.policy_active:
-                # Check if the temperature is within allowed range
-                if temp_value < policy.min_allowed_temp:
-                    compliance_issue = f"Temperature below minimum allowed ({policy.min_allowed_temp}°C)"
-                    is_compliant = False
-                elif temp_value > policy.max_allowed_temp:
-                    compliance_issue = f"Temperature above maximum allowed ({policy.max_allowed_temp}°C)"
-                    is_compliant = False
-                
-            # First check - if window is closed, should we cancel any pending shutoff events?
-            if window_state == 'closed' and room_status.has_pending_event:
-                # Cancel any pending shutoff events for this room
-                pending_events = PendingWindowEvent.query.filter_by(
-                    room_number=room_number, 
-                    processed=False
-                ).all()
-                
-                for pending in pending_events:
-                    pending.processed = True  # Mark as processed (cancelled)
-                
+def process_status_report(data, commit=True):
+    """
+    Apply a window/AC status report from a client to the room: log it, enforce
+    the policy rules and manage pending actions like delayed AC shutoff.
+
+    Shared by /receive_data and the clients that send many rooms' reports at
+    once (gateway batches).
+
+    Args:
+        data (dict): room_number, window_state, ac_state and temperature
+        commit (bool): Commit the changes; with False they are only flushed,
+                       errors are raised instead of rolled back and email
+                       notifications are left for the caller to send once
+                       it commits (see process_status_reports)
+
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    save = db.session.commit if commit else db.session.flush
+
+    room_number = data.get('room_number')
+    window_state = data.get('window_state')
+    ac_state = data.get('ac_state', 'off')
+    temperature = data.get('temperature')
+
+    # Validate room number
+    if not room_number:
+        return {"message": "Room number is required", "status": "error"}, 400
+
+    # Get room settings
+    settings = ACSettings.query.filter_by(room_number=room_number).first()
+    if not settings:
+        settings = ACSettings(room_number=room_number)
+        db.session.add(settings)
+        save()
+
+    # Get or create room status
+    room_status = RoomStatus.query.filter_by(room_number=room_number).first()
+    if not room_status:
+        room_status = RoomStatus(
+            room_number=room_number,
+            current_temperature=float(temperature) if temperature else 22.0,
+            window_state=window_state,
+            ac_state=ac_state
+        )
+        db.session.add(room_status)
+        save()
+
+    # Get global policy
+    policy = GlobalPolicy.query.first()
+    if not policy:
+        policy = GlobalPolicy()
+        db.session.add(policy)
+        save()
+
+    app.logger.info(f"Received data: room={room_number}, window={window_state}, ac={ac_state}, temp={temperature}")
+
+    # Look for stuck sensors and flapping windows; noisy rooms may be
+    # quarantined from creating pending shutoff events
+    quarantined = False
+    try:
+        from anomaly_detector import check_report
+        quarantined = check_report(room_status, float(temperature) if temperature else None, window_state, policy)
+    except Exception as e:
+        app.logger.error(f"Error running anomaly detection for room {room_number}: {str(e)}")
+
+    # Log the window event and handle delayed actions
+    try:
+        # Get current temperature
+        temp_value = float(temperature) if temperature else 22.0
+
+        # Apply policy temperature limits if needed
+        is_compliant = True
+        compliance_issue = None
+
+        if policy.policy_active:
+            # Check if the temperature is within allowed range
+            if temp_value < policy.min_allowed_temp:
+                compliance_issue = f"Temperature below minimum allowed ({policy.min_allowed_temp}°C)"
+                is_compliant = False
+            elif temp_value > policy.max_allowed_temp:
+                compliance_issue = f"Temperature above maximum allowed ({policy.max_allowed_temp}°C)"
+                is_compliant = False
+
+        # First check - if window is closed, should we cancel any pending shutoff events?
+        if window_state == 'closed' and room_status.has_pending_event:
+            # Cancel any pending shutoff events for this room
+            pending_events = PendingWindowEvent.query.filter_by(
+                room_number=room_number, 
+                processed=False
+            ).all()
+
+            for pending in pending_events:
+                pending.processed = True  # Mark as processed (cancelled)
+
+            # Update room status
+            room_status.has_pending_event = False
+            room_status.pending_event_time = None
+
+            app.logger.info(f"Cancelled pending events for room {room_number} - window is now closed")
+
+            # If AC is off, turn it back on
+            if ac_state == 'off':
+                new_ac_state = 'on'
+                app.logger.info(f"Window closed. Turning AC back on for room {room_number}")
+            else:
+                new_ac_state = ac_state
+
+            # Create window event
+            event = WindowEvent()
+            event.room_number = room_number
+            event.window_state = window_state
+            event.ac_state = new_ac_state
+            event.temperature = temp_value
+            event.policy_compliant = is_compliant
+            event.compliance_issue = compliance_issue
+            db.session.add(event)
+
+            # Update room status
+            room_status.window_state = window_state
+            room_status.ac_state = new_ac_state
+            room_status.current_temperature = temp_value
+            room_status.last_updated = datetime.utcnow()
+
+            save()
+            app.logger.info(f"Window event logged successfully: {event.id}")
+
+        # Special handling for window opened while AC is on
+        elif window_state == 'opened' and ac_state == 'on' and settings.auto_shutoff and not quarantined:
+            # If there's a delay set, create a pending event
+            if settings.shutoff_delay > 0:
+                # Calculate when the action should be taken
+                scheduled_time = datetime.utcnow() + timedelta(seconds=settings.shutoff_delay)
+
+                # Create a pending event
+                pending_event = PendingWindowEvent()
+                pending_event.room_number = room_number
+                pending_event.window_state = window_state
+                pending_event.ac_state = ac_state
+                pending_event.temperature = temp_value
+                pending_event.scheduled_action_time = scheduled_time
+                pending_event.processed = False
+                pending_event.event_type = 'window_open'
+
+                # Save the pending event
+                db.session.add(pending_event)
+
                 # Update room status
-                room_status.has_pending_event = False
-                room_status.pending_event_time = None
-                
-                app.logger.info(f"Cancelled pending events for room {room_number} - window is now closed")
-                
-                # If AC is off, turn it back on
-                if ac_state == 'off':
-                    new_ac_state = 'on'
-                    app.logger.info(f"Window closed. Turning AC back on for room {room_number}")
-                else:
-                    new_ac_state = ac_state
-                    
-                # Create window event
+                room_status.window_state = window_state
+                room_status.ac_state = ac_state
+                room_status.current_temperature = temp_value
+                room_status.has_pending_event = True
+                room_status.pending_event_time = scheduled_time
+                room_status.last_updated = datetime.utcnow()
+
+                # Log the current state (before any action is taken)
                 event = WindowEvent()
                 event.room_number = room_number
                 event.window_state = window_state
-                event.ac_state = new_ac_state
+                event.ac_state = ac_state  # Still on at this point
                 event.temperature = temp_value
                 event.policy_compliant = is_compliant
                 event.compliance_issue = compliance_issue
                 db.session.add(event)
-                
-                # Update room status
-                room_status.window_state = window_state
-                room_status.ac_state = new_ac_state
-                room_status.current_temperature = temp_value
-                room_status.last_updated = datetime.utcnow()
-                
-                db.session.commit()
+
+                save()
+                app.logger.info(f"Created pending event {pending_event.id} for room {room_number}, scheduled for {scheduled_time}")
                 app.logger.info(f"Window event logged successfully: {event.id}")
-                
-            # Special handling for window opened while AC is on
-            elif window_state == 'opened' and ac_state == 'on' and settings.auto_shutoff:
-                # If there's a delay set, create a pending event
-                if settings.shutoff_delay > 0:
-                    # Calculate when the action should be taken
-                    scheduled_time = datetime.utcnow() + timedelta(seconds=settings.shutoff_delay)
-                    
-                    # Create a pending event
-                    pending_event = PendingWindowEvent()
-                    pending_event.room_number = room_number
-                    pending_event.window_state = window_state
-                    pending_event.ac_state = ac_state
-                    pending_event.temperature = temp_value
-                    pending_event.scheduled_action_time = scheduled_time
-                    pending_event.processed = False
-                    pending_event.event_type = 'window_open'
-                    
-                    # Save the pending event
-                    db.session.add(pending_event)
-                    
-                    # Update room status
-                    room_status.window_state = window_state
-                    room_status.ac_state = ac_state
-                    room_status.current_temperature = temp_value
-                    room_status.has_pending_event = True
-                    room_status.pending_event_time = scheduled_time
-                    room_status.last_updated = datetime.utcnow()
-                    
-                    # Log the current state (before any action is taken)
-                    event = WindowEvent()
-                    event.room_number = room_number
-                    event.window_state = window_state
-                    event.ac_state = ac_state  # Still on at this point
-                    event.temperature = temp_value
-                    event.policy_compliant = is_compliant
-                    event.compliance_issue = compliance_issue
-                    db.session.add(event)
-                    
-                    db.session.commit()
-                    app.logger.info(f"Created pending event {pending_event.id} for room {room_number}, scheduled for {scheduled_time}")
-                    app.logger.info(f"Window event logged successfully: {event.id}")
-                    
-                    # The AC will be turned off later by the scheduler
-                    new_ac_state = ac_state  # Keep it on for now
-                else:
-                    # No delay, turn off AC immediately
-                    event = WindowEvent()
-                    event.room_number = room_number
-                    event.window_state = window_state
-                    event.ac_state = 'off'  # Turn off immediately
-                    event.temperature = temp_value
-                    event.policy_compliant = is_compliant
-                    event.compliance_issue = compliance_issue
-                    db.session.add(event)
-                    
-                    # Update room status
-                    room_status.window_state = window_state
-                    room_status.ac_state = 'off'
-                    room_status.current_temperature = temp_value
-                    room_status.has_pending_event = False
-                    room_status.pending_event_time = None
-                    room_status.last_updated = datetime.utcnow()
-                    
-                    db.session.commit()
-                    app.logger.info(f"Window event logged successfully: {event.id}")
-                    
-                    # Send notification immediately if configured
-                    if settings.email_notifications:
-                        user = User.query.filter_by(room_number=room_number).first()
-                        if user:
-                            app.logger.info(f"Sending notification to {user.email}")
-                            try:
-                                send_notification(user.email)
-                            except Exception as e:
-                                app.logger.error(f"Error sending notification: {str(e)}")
-                    
-                    new_ac_state = 'off'  # Turn off immediately
+
+                # The AC will be turned off later by the scheduler
+                new_ac_state = ac_state  # Keep it on for now
             else:
-                # Window closed - turn AC back on
-                if window_state == 'closed' and ac_state == 'off':
-                    app.logger.info(f"Window closed. Turning AC back on for room {room_number}")
-                    new_ac_state = 'on'  # Turn AC on
-                else:
-                    # Regular event without special handling
-                    new_ac_state = ac_state  # Keep current state
-                
-                # Create regular event
+                # No delay, turn off AC immediately
                 event = WindowEvent()
                 event.room_number = room_number
                 event.window_state = window_state
-                event.ac_state = new_ac_state
+                event.ac_state = 'off'  # Turn off immediately
                 event.temperature = temp_value
                 event.policy_compliant = is_compliant
                 event.compliance_issue = compliance_issue
                 db.session.add(event)
-                
+
                 # Update room status
                 room_status.window_state = window_state
-                room_status.ac_state = new_ac_state
+                room_status.ac_state = 'off'
                 room_status.current_temperature = temp_value
+                room_status.has_pending_event = False
+                room_status.pending_event_time = None
                 room_status.last_updated = datetime.utcnow()
-                
-                db.session.commit()
+
+                save()
                 app.logger.info(f"Window event logged successfully: {event.id}")
-                
-        except Exception as e:
-            db.session.rollback()
-            app.logger.error(f"Error processing event: {str(e)}")
-            # Continue processing even if logging fails
-            new_ac_state = ac_state  # Keep current state on error
 
-        # Check if we need to enforce temperature limits
-        ac_message = "AC state updated"
-        if policy.policy_active and not is_compliant:
-            ac_message = compliance_issue
+                # Send notification immediately if configured
+                if settings.email_notifications:
+                    user = User.query.filter_by(room_number=room_number).first()
+                    if user and not commit:
+                        db.session.info.setdefault('notifications', []).append(user.email)
+                    elif user:
+                        app.logger.info(f"Sending notification to {user.email}")
+                        try:
+                            send_notification(user.email)
+                        except Exception as e:
+                            app.logger.error(f"Error sending notification: {str(e)}")
+
+                new_ac_state = 'off'  # Turn off immediately
+        else:
+            # Window closed - turn AC back on
+            if window_state == 'closed' and ac_state == 'off':
+                app.logger.info(f"Window closed. Turning AC back on for room {room_number}")
+                new_ac_state = 'on'  # Turn AC on
+            else:
+                # Regular event without special handling
+                new_ac_state = ac_state  # Keep current state
+
+            # Create regular event
+            event = WindowEvent()
+            event.room_number = room_number
+            event.window_state = window_state
+            event.ac_state = new_ac_state
+            event.temperature = temp_value
+            event.policy_compliant = is_compliant
+            event.compliance_issue = compliance_issue
+            db.session.add(event)
+
+            # Update room status
+            room_status.window_state = window_state
+            room_status.ac_state = new_ac_state
+            room_status.current_temperature = temp_value
+            room_status.last_updated = datetime.utcnow()
 
-        # Return a JSON response
-        return jsonify({
-            "message": "Data received and logged successfully",
-            "ac_state": new_ac_state,
-            "min_temperature": settings.min_temperature,
-            "has_pending_event": room_status.has_pending_event,
-            "pending_event_time": room_status.pending_event_time.isoformat() if room_status.pending_event_time else None,
-            "is_compliant": is_compliant,
-            "policy_message": ac_message
-        }), 200
+            save()
+            app.logger.info(f"Window event logged successfully: {event.id}")
+
+    except Exception as e:
+        if not commit:
+            raise  # The caller's whole transaction is rolled back
+        db.session.rollback()
+        app.logger.error(f"Error processing event: {str(e)}")
+        # Continue processing even if logging fails
+        new_ac_state = ac_state  # Keep current state on error
+
+    # Check if we need to enforce temperature limits
+    ac_message = "AC state updated"
+    if policy.policy_active and not is_compliant:
+        ac_message = compliance_issue
+
+    return {
+        "message": "Data received and logged successfully",
+        "ac_state": new_ac_state,
+        "min_temperature": settings.min_temperature,
+        "has_pending_event": room_status.has_pending_event,
+        "pending_event_time": room_status.pending_event_time.isoformat() if room_status.pending_event_time else None,
+        "is_compliant": is_compliant,
+        "policy_message": ac_message,
+        # Lets the Pi notice policy changes and refresh its cached bundle
+        "policy_version": build_bundle(policy, settings, room_number)['version']
+    }, 200
+
+
+def process_status_reports(reports):
+    """
+    Apply several status reports in one transaction
+
+    Shared by the gateway batches and the MQTT bridge. If anything in the
+    batch fails, the batch is rolled back and the reports are applied one by
+    one instead, so a bad report only costs its own reply.
+
+    Args:
+        reports (list): Status reports, as for process_status_report
+
+    Returns:
+        list: (response dict, HTTP status code) for each report, in order
+    """
+    try:
+        results = [process_status_report(report, commit=False) for report in reports]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        db.session.info.pop('notifications', None)
+        app.logger.error(f"Error processing a batch of {len(reports)} reports, retrying one by one: {str(e)}")
     else:
-        return jsonify({
-            "message": "Request must be JSON",
-            "status": "error"
-        }), 400
+        for email in db.session.info.pop('notifications', []):
+            app.logger.info(f"Sending notification to {email}")
+            try:
+                send_notification(email)
+            except Exception as e:
+                app.logger.error(f"Error sending notification: {str(e)}")
+        return results
+
+    results = []
+    for report in reports:
+        try:
+            results.append(process_status_report(report))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error processing report for room {report.get('room_number')}: {str(e)}")
+            results.append(({'message': 'Could not process report', 'status': 'error'}, 500))
+    return results
@@ -0,0 +1,235 @@
+"""
+Materialized state intervals.
+
+Every time a room's AC or window state changes, the interval table is updated
+in the same transaction: an 'ac_on' or 'window_open' interval is opened when
+the state becomes active and closed when it ends. Questions like "how long
+was the AC on with the window open yesterday" then only read the handful of
+intervals overlapping the range instead of scanning and sorting raw events.
+
+Intervals are maintained from a session hook on RoomStatus, so receive_data,
+the pending-event processor, force_ac_state and every other writer keep the
+table current without having to call anything themselves. Events logged
+after the fact (reports a device queued while offline) do not touch the room
+status; rebuild_room_intervals replays them into the table instead.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("state_intervals")
+
+# Interval kind -> (RoomStatus attribute, value meaning the state is active)
+INTERVAL_KINDS = {
+    'ac_on': ('ac_state', 'on'),
+    'window_open': ('window_state', 'opened'),
+}
+
+
+def new_interval(session, room_number, kind, start, end):
+    """Add an interval (end None while it is still open)"""
+    from models import StateInterval
+
+    interval = StateInterval()
+    interval.room_number = room_number
+    interval.kind = kind
+    interval.start = start
+    interval.end = end
+    session.add(interval)
+    return interval
+
+
+def sync_room_intervals(session, status, at=None):
+    """
+    Open or close the room's intervals to match its current status
+
+    Args:
+        session (Session): Session the status is being flushed in
+        status (RoomStatus): Room status with its new window/AC state
+        at (datetime, optional): When the change happened (default: now)
+    """
+    from models import StateInterval
+
+    at = at or datetime.utcnow()
+
+    for kind, (attribute, active_value) in INTERVAL_KINDS.items():
+        active = getattr(status, attribute) == active_value
+
+        with session.no_autoflush:
+            current = session.query(StateInterval).filter_by(
+                room_number=status.room_number,
+                kind=kind,
+                end=None
+            ).order_by(StateInterval.start.desc()).first()
+
+        if active and current is None:
+            new_interval(session, status.room_number, kind, at, None)
+        elif not active and current is not None:
+            current.end = max(at, current.start)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_state_changes(session, flush_context, instances):
+    from models import RoomStatus
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, RoomStatus) or not obj.room_number:
+            continue
+
+        if obj not in session.new:
+            state = inspect(obj)
+            if not (state.attrs.ac_state.history.has_changes()
+                    or state.attrs.window_state.history.has_changes()):
+                continue
+
+        try:
+            sync_room_intervals(session, obj)
+        except Exception as e:
+            logger.error(f"Error updating state intervals for room {obj.room_number}: {e}")
+
+
+def rebuild_room_intervals(session, room_number, start, end):
+    """
+    Rebuild a room's intervals within [start, end) from its logged events
+
+    The room's state at `start` is taken from the intervals already recorded,
+    and intervals outside the range are kept (clipped and joined to the
+    rebuilt ones where they touch).
+
+    Args:
+        session (Session): Session to rebuild in; the caller commits
+        room_number (str): Room to rebuild
+        start (datetime): Time of the earliest event to replay
+        end (datetime): When the state already recorded takes over again
+    """
+    from models import StateInterval, WindowEvent
+
+    if end <= start:
+        return
+
+    events = session.query(WindowEvent).filter(
+        WindowEvent.room_number == room_number,
+        WindowEvent.timestamp >= start,
+        WindowEvent.timestamp < end
+    ).order_by(WindowEvent.timestamp, WindowEvent.id).all()
+
+    for kind, (attribute, active_value) in INTERVAL_KINDS.items():
+        rows = session.query(StateInterval).filter(
+            StateInterval.room_number == room_number,
+            StateInterval.kind == kind,
+            StateInterval.start <= end,
+            or_(StateInterval.end.is_(None), StateInterval.end >= start)
+        ).order_by(StateInterval.start).all()
+
+        # Replay the events, starting from the state the room was in at `start`
+        active_since = start if any(row.start < start for row in rows) else None
+        segments = []
+        for window_event in events:
+            state = getattr(window_event, attribute)
+            if not state:
+                continue  # e.g. an IR command logged without the room's state
+            if state == active_value and active_since is None:
+                active_since = window_event.timestamp
+            elif state != active_value and active_since is not None:
+                segments.append((active_since, window_event.timestamp))
+                active_since = None
+        if active_since is not None:
+            segments.append((active_since, end))
+
+        # Keep what lies outside the range, drop what lies inside
+        before = after = None
+        spans, span_end = False, None
+        for row in rows:
+            if row.start < start:
+                if row.end is None or row.end > end:
+                    spans, span_end = True, row.end
+                row.end = start
+                before = row
+            elif row.end is None or row.end > end:
+                row.start = end
+                after = row
+            else:
+                session.delete(row)
+
+        previous = before
+        for segment_start, segment_end in segments:
+            if segment_end <= segment_start:
+                continue
+            if previous is not None and previous.end == segment_start:
+                previous.end = segment_end
+            else:
+                previous = new_interval(session, room_number, kind, segment_start, segment_end)
+
+        # Join up with the state recorded after the range
+        if spans:
+            if previous is not None and previous.end == end:
+                previous.end = span_end
+            else:
+                new_interval(session, room_number, kind, end, span_end)
+        elif after is not None and previous is not None and previous.end == end:
+            previous.end = after.end
+            session.delete(after)
+
+
+def intervals_in_range(room_number, kind, start, end):
+    """
+    Intervals of a kind overlapping [start, end), clipped to the range
+
+    Returns:
+        list: (start, end) tuples in chronological order
+    """
+    from models import StateInterval
+
+    rows = StateInterval.query.with_entities(StateInterval.start, StateInterval.end).filter(
+        StateInterval.room_number == room_number,
+        StateInterval.kind == kind,
+        StateInterval.start < end,
+        or_(StateInterval.end.is_(None), StateInterval.end > start)
+    ).order_by(StateInterval.start).all()
+
+    now = datetime.utcnow()
+    clipped = []
+    for interval_start, interval_end in rows:
+        clipped_start = max(interval_start, start)
+        clipped_end = min(interval_end or now, end)
+        if clipped_end > clipped_start:
+            clipped.append((clipped_start, clipped_end))
+    return clipped
+
+
+def total_seconds(intervals):
+    """Combined length of non-overlapping (start, end) intervals"""
+    return sum((interval_end - interval_start).total_seconds() for interval_start, interval_end in intervals)
+
+
+def intersect(first, second):
+    """Overlap of two sorted lists of non-overlapping (start, end) intervals"""
+    overlap = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        overlap_start = max(first[i][0], second[j][0])
+        overlap_end = min(first[i][1], second[j][1])
+        if overlap_end > overlap_start:
+            overlap.append((overlap_start, overlap_end))
+
+        # Advance whichever interval finishes first
+        if first[i][1] <= second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return overlap
+
+
+def state_seconds(room_number, kind, start, end):
+    """Seconds a room spent in a state within [start, end)"""
+    return total_seconds(intervals_in_range(room_number, kind, start, end))
+
+
+def overlap_seconds(room_number, kind_a, kind_b, start, end):
+    """Seconds a room spent in two states at once within [start, end)"""
+    return total_seconds(intersect(
+        intervals_in_range(room_number, kind_a, start, end),
+        intervals_in_range(room_number, kind_b, start, end)
+    ))
@@ -1,138 +1,218 @@
-// Update room temperatures periodically
-async function updateTemperatures() {
-    document.querySelectorAll('[id^="temp-"]').forEach(async element => {
-        const roomNumber = element.id.split('-')[1];
-        
-        try {
-            // Fetch actual temperature from the API
-            const response = await fetch(`/api/room_status/${roomNumber}`);
-            if (!response.ok) {
-                console.error(`Failed to fetch status for room ${roomNumber}: ${response.status}`);
-                return;
-            }
-            
-            const data = await response.json();
-            
-            // Update temperature display
-            if (data && (data.temperature_f || data.temperature)) {
-                const temp = data.temperature_f ? parseFloat(data.temperature_f).toFixed(1) : 
-                    (parseFloat(data.temperature) * 9/5 + 32).toFixed(1);
-                element.textContent = `${temp}°F`;
-                
-                // Update status based on temperature and other factors
-                const statusElement = document.getElementById(`status-${roomNumber}`);
-                
-                if (data.non_compliant_since) {
-                    // Room is in non-compliant state
-                    statusElement.innerHTML = `<span class="badge bg-danger">${data.policy_violation_type || 'Non-Compliant'}</span>`;
-                } else if (data.window_state === 'opened' && data.ac_state === 'on') {
-                    // Window open with AC on
-                    statusElement.innerHTML = '<span class="badge bg-warning">Window Open & AC On</span>';
-                } else if (data.window_state === 'opened') {
-                    // Window open
-                    statusElement.innerHTML = '<span class="badge bg-info">Window Open</span>';
-                } else if (data.ac_state === 'on') {
-                    // AC on
-                    statusElement.innerHTML = '<span class="badge bg-primary">AC On</span>';
-                } else {
-                    // AC off state
-                    statusElement.innerHTML = '<span class="badge bg-secondary">AC Off</span>';
-                }
-            }
-        } catch (error) {
-            console.error(`Error fetching data for room ${roomNumber}:`, error);
+// Render the status badge for a room
+function renderStatusBadge(data) {
+    if (data.non_compliant_since) {
+        // Room is in non-compliant state
+        return `<span class="badge bg-danger">${data.policy_violation_type || 'Non-Compliant'}</span>`;
+    } else if (data.window_state === 'opened' && data.ac_state === 'on') {
+        // Window open with AC on
+        return '<span class="badge bg-warning">Window Open & AC On</span>';
+    } else if (data.window_state === 'opened') {
+        // Window open
+        return '<span class="badge bg-info">Window Open</span>';
+    } else if (data.ac_state === 'on') {
+        // AC on
+        return '<span class="badge bg-primary">AC On</span>';
+    }
+    // AC off state
+    return '<span class="badge bg-secondary">AC Off</span>';
+}
+
+// Labels for sensor anomalies reported by the server
+const ANOMALY_LABELS = {
+    stuck_sensor: 'Stuck Sensor',
+    window_flapping: 'Window Flapping'
+};
+
+// Render badges for a room's sensor anomalies (empty when there are none)
+function renderAnomalyBadges(data) {
+    let badges = (data.anomalies || []).map(anomaly =>
+        `<span class="badge bg-dark border border-warning text-warning ms-1">${ANOMALY_LABELS[anomaly] || anomaly}</span>`
+    ).join('');
+    if (data.quarantined) {
+        badges += '<span class="badge bg-dark border border-danger text-danger ms-1" title="Window changes do not trigger delayed shutoffs">Quarantined</span>';
+    }
+    return badges;
+}
+
+// Format a room's temperature in Fahrenheit
+function formatTemperature(data) {
+    const temp = data.temperature_f ? parseFloat(data.temperature_f).toFixed(1) :
+        (parseFloat(data.temperature) * 9/5 + 32).toFixed(1);
+    return `${temp}°F`;
+}
+
+// Render a row of the recent events table
+function renderEventRow(event) {
+    return `
+                <tr>
+                    <td>${event.timestamp}</td>
+                    <td>${event.window_state}</td>
+                    <td>${event.ac_state}</td>
+                    <td>${(event.temperature_f || (event.temperature * 9/5 + 32)).toFixed(1)}°F</td>
+                </tr>`;
+}
+
+// ETags of the last responses seen, keyed by URL
+const responseEtags = {};
+
+// Fetch JSON with If-None-Match, resolving to null when the server answers 304 Not Modified
+async function fetchIfChanged(url) {
+    const headers = {};
+    if (responseEtags[url]) {
+        headers['If-None-Match'] = responseEtags[url];
+    }
+
+    // Bypass the browser cache so we see the 304 ourselves
+    const response = await fetch(url, { headers: headers, cache: 'no-store' });
+    if (response.status === 304) return null;
+    if (!response.ok) {
+        throw new Error(`${url} returned ${response.status}`);
+    }
+
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        responseEtags[url] = etag;
+    }
+    return response.json();
+}
+
+// Fetch the status of every room on screen with a single bulk request
+// (null when nothing changed since the last fetch)
+async function fetchRoomStatuses() {
+    const data = await fetchIfChanged('/api/room_statuses');
+    return data ? (data.rooms || {}) : null;
+}
+
+// Apply a room's status to the admin dashboard (table rows and room cards)
+function applyRoomStatus(roomNumber, data) {
+    if (!data || !(data.temperature_f || data.temperature)) return;
+
+    // Admin dashboard table
+    const tempElement = document.getElementById(`temp-${roomNumber}`);
+    if (tempElement) {
+        tempElement.textContent = formatTemperature(data);
+    }
+    const statusElement = document.getElementById(`status-${roomNumber}`);
+    if (statusElement) {
+        statusElement.innerHTML = renderStatusBadge(data) + renderAnomalyBadges(data);
+    }
+
+    // Room cards
+    const card = document.querySelector(`.room-card[data-room-id="${roomNumber}"]`);
+    if (card) {
+        const cardStatus = card.querySelector('.room-status');
+        if (cardStatus) {
+            cardStatus.innerHTML = renderStatusBadge(data) + renderAnomalyBadges(data);
         }
-    });
+        const cardTemp = card.querySelector('.room-temperature');
+        if (cardTemp) {
+            cardTemp.textContent = formatTemperature(data);
+        }
+    }
+}
+
+// Whether this page shows the fleet overview
+function isFleetView() {
+    return document.querySelector('[id^="temp-"]') !== null ||
+        document.getElementById('admin-dashboard') !== null;
+}
+
+// Load the status of every room on the admin dashboard
+async function updateTemperatures() {
+    if (!isFleetView()) return; // Not on admin dashboard page
+
+    try {
+        const rooms = await fetchRoomStatuses();
+        if (!rooms) return;
+
+        Object.entries(rooms).forEach(([roomNumber, data]) => applyRoomStatus(roomNumber, data));
+    } catch (error) {
+        console.error('Error fetching room statuses:', error);
+    }
 }
 
 // Function to fetch and update recent events
 async function fetchRecentEvents() {
     const roomElement = document.querySelector('[data-room-number]');
     if (!roomElement) return; // Not on room dashboard page
-    
+
     const roomNumber = roomElement.getAttribute('data-room-number');
     try {
         // Fetch latest events for this room
-        const response = await fetch(`/api/recent_events/${roomNumber}`);
-        if (!response.ok) {
-            console.error('Failed to fetch recent events:', response.status);
-            return;
-        }
-        
-        const data = await response.json();
+        const data = await fetchIfChanged(`/api/recent_events/${roomNumber}`);
+        if (!data) return; // Nothing changed
+
         const eventsTable = document.getElementById('eventsTable');
-        
+
         if (eventsTable && data.events && data.events.length > 0) {
-            let newRows = '';
-            // Create table rows for each event
-            data.events.forEach(event => {
-                newRows += `
-                <tr>
-                    <td>${event.timestamp}</td>
-                    <td>${event.window_state}</td>
-                    <td>${event.ac_state}</td>
-                    <td>${(event.temperature_f || (event.temperature * 9/5 + 32)).toFixed(1)}°F</td>
-                </tr>`;
-            });
-            eventsTable.innerHTML = newRows;
+            eventsTable.innerHTML = data.events.map(renderEventRow).join('');
         }
     } catch (error) {
         console.error('Error fetching recent events:', error);
     }
 }
 
-// Update more frequently
-setInterval(updateTemperatures, 3000); // Every 3 seconds
-updateTemperatures(); // Initial update
+// Add a newly logged event to the top of the recent events table
+function prependRecentEvent(event) {
+    const eventsTable = document.getElementById('eventsTable');
+    if (!eventsTable) return;
 
-// Update events more frequently
-setInterval(fetchRecentEvents, 5000); // Every 5 seconds
-fetchRecentEvents(); // Initial events fetch
+    eventsTable.insertAdjacentHTML('afterbegin', renderEventRow(event));
+
+    // Keep the table at the 10 most recent events
+    while (eventsTable.rows.length > 10) {
+        eventsTable.deleteRow(eventsTable.rows.length - 1);
+    }
+}
+
+// Subscribe to live changes pushed by the server (Server-Sent Events)
+function openLiveStream() {
+    if (!window.EventSource) return null;
+
+    const roomElement = document.querySelector('[data-room-number]');
+    if (!roomElement && !isFleetView()) return null;
 
-// Add realtime update for admin dashboard
-function updateAllRoomStatus() {
-    // Only run on admin dashboard
-    if (document.getElementById('admin-dashboard')) {
-        document.querySelectorAll('.room-card').forEach(async card => {
-            const roomNumber = card.getAttribute('data-room-id');
-            if (!roomNumber) return;
-            
-            try {
-                const response = await fetch(`/api/room_status/${roomNumber}`);
-                if (!response.ok) return;
-                
-                const data = await response.json();
-                
-                // Update room status
-                const statusElement = card.querySelector('.room-status');
-                if (statusElement) {
-                    if (data.non_compliant_since) {
-                        statusElement.innerHTML = `<span class="badge bg-danger">${data.policy_violation_type || 'Non-Compliant'}</span>`;
-                    } else if (data.window_state === 'opened' && data.ac_state === 'on') {
-                        statusElement.innerHTML = '<span class="badge bg-warning">Window Open & AC On</span>';
-                    } else if (data.window_state === 'opened') {
-                        statusElement.innerHTML = '<span class="badge bg-info">Window Open</span>';
-                    } else if (data.ac_state === 'on') {
-                        statusElement.innerHTML = '<span class="badge bg-primary">AC On</span>';
-                    } else {
-                        statusElement.innerHTML = '<span class="badge bg-secondary">AC Off</span>';
-                    }
-                }
-                
-                // Update temperature
-                const tempElement = card.querySelector('.room-temperature');
-                if (tempElement && (data.temperature_f || data.temperature)) {
-                    const temp = data.temperature_f ? parseFloat(data.temperature_f).toFixed(1) : 
-                        (parseFloat(data.temperature) * 9/5 + 32).toFixed(1);
-                    tempElement.textContent = `${temp}°F`;
-                }
-            } catch (error) {
-                console.error(`Error updating status for room ${roomNumber}:`, error);
-            }
-        });
+    // Room dashboards only need their own room
+    let url = '/api/stream';
+    if (roomElement) {
+        url += `?rooms=${encodeURIComponent(roomElement.getAttribute('data-room-number'))}`;
     }
+
+    // The browser reconnects on its own and resumes from the last event id
+    const stream = new EventSource(url);
+
+    stream.addEventListener('status', e => {
+        const data = JSON.parse(e.data);
+        applyRoomStatus(data.room_number, data);
+    });
+
+    stream.addEventListener('event', e => {
+        const data = JSON.parse(e.data);
+        // Backfilled events are older than the ones shown - reload the table in order
+        if (data.backfilled) {
+            fetchRecentEvents();
+        } else {
+            prependRecentEvent(data);
+        }
+    });
+
+    // The server could not replay everything we missed - reload from scratch
+    stream.addEventListener('reset', () => {
+        updateTemperatures();
+        fetchRecentEvents();
+    });
+
+    return stream;
 }
 
-// Update admin dashboard every 3 seconds
-setInterval(updateAllRoomStatus, 3000);
-updateAllRoomStatus(); // Initial update
+// Shared with temperature_chart.js
+window.acLiveStream = openLiveStream();
+
+updateTemperatures(); // Initial update
+fetchRecentEvents(); // Initial events fetch
+
+// Fall back to polling in browsers without Server-Sent Events
+if (!window.acLiveStream) {
+    setInterval(updateTemperatures, 3000); // Every 3 seconds
+    setInterval(fetchRecentEvents, 5000); // Every 5 seconds
+}
@@ -23,31 +23,85 @@ const temperatureChart = new Chart(ctx, {
     }
 });
 
+// Most points the chart ever holds - history is downsampled to this on the server
+const MAX_CHART_POINTS = 300;
+
 let temperatures = [];
 let timestamps = [];
 
-// Update chart with real data
-async function updateChart() {
+// Hours of history shown, from the range selector
+function selectedRangeHours() {
+    const rangeSelect = document.getElementById('chartRange');
+    return rangeSelect ? parseInt(rangeSelect.value, 10) : 2;
+}
+
+// Label a point with the time, plus the date for ranges longer than a day
+function formatPointLabel(timestamp) {
+    const date = new Date(timestamp);
+    return selectedRangeHours() > 24 ? date.toLocaleString() : date.toLocaleTimeString();
+}
+
+// Append a point to the chart, keeping only the last MAX_CHART_POINTS
+function addChartPoint(tempF, timestamp) {
+    temperatures.push(tempF);
+    timestamps.push(formatPointLabel(timestamp));
+
+    if (temperatures.length > MAX_CHART_POINTS) {
+        temperatures.shift();
+        timestamps.shift();
+    }
+
+    temperatureChart.data.labels = timestamps;
+    temperatureChart.data.datasets[0].data = temperatures;
+    temperatureChart.update();
+}
+
+// Load the selected range from the server-side (downsampled) temperature history
+async function loadChartHistory() {
     try {
         const roomNumber = document.querySelector('[data-room-number]').dataset.roomNumber;
-        const response = await fetch(`/api/temperature/${roomNumber}`);
-        const data = await response.json();
-
-        // Add new data point (using Fahrenheit if available)
-        const temp = data.temperature_f || (data.temperature * 9/5 + 32);
-        temperatures.push(temp);
-        timestamps.push(new Date(data.timestamp).toLocaleTimeString());
+        const to = new Date();
+        const from = new Date(to.getTime() - selectedRangeHours() * 3600 * 1000);
 
-        // Keep only last 24 points
-        if (temperatures.length > 24) {
-            temperatures.shift();
-            timestamps.shift();
+        const params = new URLSearchParams({
+            from: from.toISOString(),
+            to: to.toISOString(),
+            points: MAX_CHART_POINTS
+        });
+        const response = await fetch(`/api/temperature_history/${roomNumber}?${params}`);
+        if (!response.ok) {
+            console.error('Failed to fetch temperature history:', response.status);
+            return;
         }
 
+        const data = await response.json();
+        temperatures = data.points.map(point => point.avg_f);
+        timestamps = data.points.map(point => formatPointLabel(point.t));
+
         temperatureChart.data.labels = timestamps;
         temperatureChart.data.datasets[0].data = temperatures;
         temperatureChart.update();
 
+        // No history yet - show the current reading at least
+        if (temperatures.length === 0) {
+            updateChart();
+        }
+    } catch (error) {
+        console.error('Error loading temperature history:', error);
+    }
+}
+
+// Update chart with real data
+async function updateChart() {
+    try {
+        const roomNumber = document.querySelector('[data-room-number]').dataset.roomNumber;
+        const data = await fetchIfChanged(`/api/temperature/${roomNumber}`);
+        if (!data) return; // Nothing changed since the last point
+
+        // Add new data point (using Fahrenheit if available)
+        const temp = data.temperature_f || (data.temperature * 9/5 + 32);
+        addChartPoint(temp, data.timestamp);
+
         // Update current temperature display
         document.querySelector('[data-current-temp]').textContent = 
             `${temp.toFixed(1)}°F`;
@@ -56,63 +110,72 @@ async function updateChart() {
     }
 }
 
-// Update more frequently - every 5 seconds
-setInterval(updateChart, 5000);
-updateChart(); // Initial update
+// Show a room status on the room dashboard (current temperature, status badge, pending action)
+function applyCurrentStatus(data) {
+    const tempDisplay = document.querySelector('[data-current-temp]');
+    if (!tempDisplay || !data || !data.temperature) return;
+
+    // Convert temperature to Fahrenheit if needed
+    const tempF = data.temperature_f || (data.temperature * 9/5 + 32);
+    tempDisplay.textContent = `${tempF.toFixed(1)}°F`;
+
+    // Update room status
+    const statusElement = document.querySelector('.room-status');
+    if (statusElement) {
+        if (data.non_compliant_since) {
+            statusElement.innerHTML = `<span class="badge bg-danger">${data.policy_violation_type || 'Non-Compliant'}</span>`;
+        } else if (data.window_state === 'opened' && data.ac_state === 'on') {
+            statusElement.innerHTML = '<span class="badge bg-warning">Window Open & AC On</span>';
+        } else if (data.window_state === 'opened') {
+            statusElement.innerHTML = '<span class="badge bg-info">Window Open</span>';
+        } else if (data.ac_state === 'on') {
+            statusElement.innerHTML = '<span class="badge bg-primary">AC On</span>';
+        } else {
+            statusElement.innerHTML = '<span class="badge bg-secondary">AC Off</span>';
+        }
+    }
+
+    // Update pending action notification if there is one
+    const pendingElement = document.querySelector('.pending-action');
+    if (pendingElement) {
+        if (data.has_pending_event) {
+            const actionTime = new Date(data.pending_event_time);
+            pendingElement.innerHTML = `<div class="alert alert-warning">
+                <strong>Pending Action:</strong> AC will be turned off at ${actionTime.toLocaleTimeString()}
+            </div>`;
+            pendingElement.style.display = 'block';
+        } else {
+            pendingElement.style.display = 'none';
+        }
+    }
+}
 
 // Add realtime temperature updates
 function updateCurrentTemperature() {
-    try {
-        const tempDisplay = document.querySelector('[data-current-temp]');
-        if (!tempDisplay) return;
-        
-        const roomNumber = document.querySelector('[data-room-number]')?.dataset.roomNumber;
-        if (!roomNumber) return;
-        
-        fetch(`/api/room_status/${roomNumber}`)
-            .then(response => response.json())
-            .then(data => {
-                if (data && data.temperature) {
-                    // Convert temperature to Fahrenheit if needed
-                    const tempF = data.temperature_f || (data.temperature * 9/5 + 32);
-                    // Update current temperature display without updating chart
-                    tempDisplay.textContent = `${tempF.toFixed(1)}°F`;
-                    
-                    // Update room status
-                    const statusElement = document.querySelector('.room-status');
-                    if (statusElement) {
-                        if (data.non_compliant_since) {
-                            statusElement.innerHTML = `<span class="badge bg-danger">${data.policy_violation_type || 'Non-Compliant'}</span>`;
-                        } else if (data.window_state === 'opened' && data.ac_state === 'on') {
-                            statusElement.innerHTML = '<span class="badge bg-warning">Window Open & AC On</span>';
-                        } else if (data.window_state === 'opened') {
-                            statusElement.innerHTML = '<span class="badge bg-info">Window Open</span>';
-                        } else if (data.ac_state === 'on') {
-                            statusElement.innerHTML = '<span class="badge bg-primary">AC On</span>';
-                        } else {
-                            statusElement.innerHTML = '<span class="badge bg-secondary">AC Off</span>';
-                        }
-                    }
-                    
-                    // Update pending action notification if there is one
-                    const pendingElement = document.querySelector('.pending-action');
-                    if (pendingElement) {
-                        if (data.has_pending_event) {
-                            const actionTime = new Date(data.pending_event_time);
-                            pendingElement.innerHTML = `<div class="alert alert-warning">
-                                <strong>Pending Action:</strong> AC will be turned off at ${actionTime.toLocaleTimeString()}
-                            </div>`;
-                            pendingElement.style.display = 'block';
-                        } else {
-                            pendingElement.style.display = 'none';
-                        }
-                    }
-                }
-            });
-    } catch (error) {
-        console.error('Error updating current temperature:', error);
-    }
+    const roomNumber = document.querySelector('[data-room-number]')?.dataset.roomNumber;
+    if (!roomNumber) return;
+
+    fetchIfChanged(`/api/room_status/${roomNumber}`)
+        .then(data => {
+            if (data) applyCurrentStatus(data);
+        })
+        .catch(error => console.error('Error updating current temperature:', error));
 }
 
-// Update temperature every 2 seconds (more frequent than chart update)
-setInterval(updateCurrentTemperature, 2000);
\ No newline at end of file
+loadChartHistory(); // Initial chart from stored history
+document.getElementById('chartRange')?.addEventListener('change', loadChartHistory);
+
+if (window.acLiveStream) {
+    // Live status changes pushed by the server (opened in dashboard.js)
+    window.acLiveStream.addEventListener('status', e => {
+        const data = JSON.parse(e.data);
+        applyCurrentStatus(data);
+
+        const tempF = data.temperature_f || (data.temperature * 9/5 + 32);
+        addChartPoint(tempF, data.last_updated ? data.last_updated + 'Z' : Date.now());
+    });
+} else {
+    // Fall back to polling in browsers without Server-Sent Events
+    setInterval(updateChart, 5000); // Every 5 seconds
+    setInterval(updateCurrentTemperature, 2000); // Every 2 seconds
+}
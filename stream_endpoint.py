@@ -0,0 +1,80 @@
+import json
+import time
+
+from flask import Response, request, jsonify
+from flask_login import login_required, current_user
+from app import app
+from change_bus import bus
+
+# Keep individual streams short-lived so worker threads are recycled; browsers
+# reconnect automatically and resume from the Last-Event-ID header
+STREAM_MAX_SECONDS = 300
+KEEPALIVE_SECONDS = 15
+
+# Change kinds dashboards care about (device commands are delivered separately)
+STREAM_KINDS = ['status', 'event', 'pending']
+
+
+def format_sse(data, event=None, event_id=None):
+    """Format a single Server-Sent Events message"""
+    message = ''
+    if event_id:
+        message += f"id: {event_id}\n"
+    if event:
+        message += f"event: {event}\n"
+    message += f"data: {json.dumps(data)}\n\n"
+    return message
+
+
+@app.route('/api/stream')
+@login_required
+def stream_changes():
+    """
+    Server-Sent Events stream of live room changes.
+
+    Pushes 'status' (RoomStatus changed), 'event' (new WindowEvent) and
+    'pending' (pending action created, processed or cancelled) messages as they
+    are committed. An 'event' with only "backfilled": true means older events
+    were uploaded by a device that was offline. A 'reset' message tells the client it missed changes and
+    should reload its state. Optional query parameter:
+        rooms: comma-separated room numbers to receive changes for (admins only;
+               regular users always receive their own room)
+    """
+    if current_user.is_admin:
+        rooms_filter = request.args.get('rooms', '')
+        rooms = [room.strip() for room in rooms_filter.split(',') if room.strip()] or None
+    elif current_user.room_number:
+        rooms = [current_user.room_number]
+    else:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = bus.subscribe(rooms=rooms, kinds=STREAM_KINDS, last_event_id=last_event_id)
+
+    def generate():
+        try:
+            # Ask the browser to wait 3 seconds before reconnecting
+            yield "retry: 3000\n\n"
+
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                if subscription.needs_reset:
+                    subscription.needs_reset = False
+                    yield format_sse({}, event='reset')
+
+                changes = subscription.get(timeout=KEEPALIVE_SECONDS)
+                if not changes:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+
+                for change in changes:
+                    data = dict(change.data, room_number=change.room_number)
+                    yield format_sse(data, event=change.kind, event_id=change.event_id)
+        finally:
+            bus.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Disable response buffering in nginx
+    })
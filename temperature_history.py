@@ -0,0 +1,124 @@
+"""
+Temperature history API for the room charts.
+
+Readings are downsampled in the database: the requested range is split into
+at most `points` equal time buckets and each bucket is reduced to its min, avg
+and max temperature with a single GROUP BY. A 30-day chart therefore costs the
+same few hundred points as a 2-minute one.
+"""
+import calendar
+from datetime import datetime, timedelta, timezone
+
+from flask import request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import func, cast, Integer
+from app import app, db
+from models import WindowEvent
+from temperature_utils import celsius_to_fahrenheit
+
+DEFAULT_POINTS = 300
+MAX_POINTS = 2000
+DEFAULT_RANGE = timedelta(hours=24)
+
+
+def parse_utc(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime (as stored in the database)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def to_epoch(value):
+    """Seconds since the epoch for a naive UTC datetime"""
+    return calendar.timegm(value.utctimetuple())
+
+
+def bucket_index(column, start_epoch, bucket_seconds):
+    """SQL expression numbering the fixed-width time bucket a timestamp falls into"""
+    if db.engine.dialect.name == 'sqlite':
+        # Integer arithmetic in SQLite already truncates
+        epoch = cast(func.strftime('%s', column), Integer)
+        return cast((epoch - start_epoch) / bucket_seconds, Integer)
+    return func.floor((func.extract('epoch', column) - start_epoch) / bucket_seconds)
+
+
+def downsampled_temperatures(room_number, start, end, points):
+    """
+    Min/avg/max temperature per time bucket for a room
+
+    Args:
+        room_number (str): Room to read
+        start (datetime): Range start (naive UTC, inclusive)
+        end (datetime): Range end (naive UTC, exclusive)
+        points (int): Maximum number of buckets
+
+    Returns:
+        tuple: (bucket width in seconds, list of (bucket start, avg, min, max, count))
+    """
+    start_epoch = to_epoch(start)
+    span_seconds = max(1, to_epoch(end) - start_epoch)
+    bucket_seconds = max(1, -(-span_seconds // points))  # Ceiling division
+
+    bucket = bucket_index(WindowEvent.timestamp, start_epoch, bucket_seconds).label('bucket')
+    rows = db.session.query(
+        bucket,
+        func.avg(WindowEvent.temperature),
+        func.min(WindowEvent.temperature),
+        func.max(WindowEvent.temperature),
+        func.count(WindowEvent.id)
+    ).filter(
+        WindowEvent.room_number == room_number,
+        WindowEvent.timestamp >= start,
+        WindowEvent.timestamp < end,
+        WindowEvent.temperature.isnot(None)
+    ).group_by(bucket).order_by(bucket).all()
+
+    series = []
+    for index, avg_temp, min_temp, max_temp, count in rows:
+        bucket_start = start + timedelta(seconds=int(index) * bucket_seconds)
+        series.append((bucket_start, avg_temp, min_temp, max_temp, count))
+    return bucket_seconds, series
+
+
+@app.route('/api/temperature_history/<room_number>')
+@login_required
+def get_temperature_history(room_number):
+    """
+    Downsampled temperature history for a room's chart.
+
+    Query parameters:
+        from:   ISO 8601 range start (default: 24 hours before `to`)
+        to:     ISO 8601 range end (default: now)
+        points: maximum number of points to return (default 300, max 2000)
+    """
+    if not current_user.is_admin and current_user.room_number != room_number:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    try:
+        end = parse_utc(request.args['to']) if request.args.get('to') else datetime.utcnow()
+        start = parse_utc(request.args['from']) if request.args.get('from') else end - DEFAULT_RANGE
+    except ValueError:
+        return jsonify({'error': 'Invalid from/to timestamp'}), 400
+
+    if start >= end:
+        return jsonify({'error': '"from" must be before "to"'}), 400
+
+    points = max(1, min(request.args.get('points', DEFAULT_POINTS, type=int), MAX_POINTS))
+
+    bucket_seconds, series = downsampled_temperatures(room_number, start, end, points)
+
+    return jsonify({
+        'room_number': room_number,
+        'from': start.isoformat() + 'Z',
+        'to': end.isoformat() + 'Z',
+        'bucket_seconds': bucket_seconds,
+        'unit': 'F',  # Indicate preferred unit
+        'points': [{
+            't': bucket_start.isoformat() + 'Z',
+            'avg_f': round(celsius_to_fahrenheit(avg_temp), 1),
+            'min_f': round(celsius_to_fahrenheit(min_temp), 1),
+            'max_f': round(celsius_to_fahrenheit(max_temp), 1),
+            'count': count
+        } for bucket_start, avg_temp, min_temp, max_temp, count in series]
+    })
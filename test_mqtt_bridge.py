@@ -0,0 +1,159 @@
+"""
+Tests for mqtt_bridge.py, against its in-process LocalBroker
+
+Run with:
+    python -m pytest test_mqtt_bridge.py
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from mqtt_bridge import LocalBroker, MQTTBridge, claim_bridge_lock, topic_matches
+
+
+class Recorder:
+    """Messages a device subscribed to a topic pattern receives"""
+
+    def __init__(self, broker, pattern):
+        self.messages = []
+        self.received = threading.Event()
+        client = broker.client()
+        client.on_message = self.on_message
+        client.loop_start()
+        client.subscribe(pattern)
+
+    def on_message(self, client, userdata, message):
+        self.messages.append((message.topic, json.loads(message.payload)))
+        self.received.set()
+
+
+class FakeServer:
+    """Stand-ins for the processing functions the server wires into the bridge"""
+
+    def __init__(self):
+        self.batches = []
+        self.acks = []
+        self.queued = {}
+
+    def process_reports(self, reports):
+        self.batches.append(reports)
+        return [(report["room_number"], {"ac_state": report.get("ac_state"), "policy_version": "v1"})
+                for report in reports]
+
+    def process_acks(self, acks):
+        self.acks.extend(acks)
+
+    def claim_commands(self, room_number):
+        return self.queued.pop(room_number, [])
+
+
+def telemetry(window_state="closed", ac_state="on", temperature=22.5, **extra):
+    return json.dumps(dict(window_state=window_state, ac_state=ac_state, temperature=temperature, **extra))
+
+
+class TopicTest(unittest.TestCase):
+    def test_wildcards(self):
+        self.assertTrue(topic_matches("ac/+/telemetry", "ac/7/telemetry"))
+        self.assertFalse(topic_matches("ac/+/telemetry", "ac/7/ack"))
+        self.assertFalse(topic_matches("ac/+/telemetry", "ac/7/telemetry/x"))
+        self.assertTrue(topic_matches("ac/7/#", "ac/7/commands"))
+        self.assertFalse(topic_matches("ac/7/#", "ac/8/commands"))
+
+
+class BridgeTest(unittest.TestCase):
+    def make(self, **kwargs):
+        broker = LocalBroker()
+        server = FakeServer()
+        bridge = MQTTBridge(broker.client(), server.process_reports, server.process_acks,
+                            server.claim_commands, **kwargs)
+        return broker, server, bridge
+
+    def connect(self, bridge):
+        # Connect without starting the processing thread, to process batches by hand
+        bridge.client.on_connect = bridge._on_connect
+        bridge.client.on_message = bridge._on_message
+        bridge.client.loop_start()
+
+    def test_messages_are_processed_in_batches(self):
+        broker, server, bridge = self.make(batch_size=100, batch_interval=0)
+        self.connect(bridge)
+        replies = Recorder(broker, "ac/+/reply")
+
+        for index in range(250):
+            broker.publish(f"ac/{index % 50}/telemetry", telemetry())
+        while bridge.pending():
+            bridge.process_batch(bridge._next_batch(timeout=0))
+
+        self.assertEqual([len(batch) for batch in server.batches], [100, 100, 50])
+        self.assertEqual(len(replies.messages), 250)
+        self.assertEqual(replies.messages[0], ("ac/0/reply", {"ac_state": "on", "policy_version": "v1"}))
+        self.assertEqual(len(bridge.rooms), 50)
+
+    def test_room_comes_from_the_topic(self):
+        broker, server, bridge = self.make()
+        self.connect(bridge)
+        broker.publish("ac/7/telemetry", telemetry(room_number="8"))
+        bridge.process_batch(bridge._next_batch(timeout=0))
+        self.assertEqual(server.batches[0][0]["room_number"], "7")
+
+    def test_invalid_messages_are_counted(self):
+        broker, server, bridge = self.make()
+        self.connect(bridge)
+        broker.publish("ac/7/telemetry", b"not json")
+        broker.publish("ac/7/telemetry", "[1, 2]")
+        broker.publish("ac/7/ack", json.dumps({"id": "x"}))
+        self.assertEqual(bridge.stats()["invalid"], 3)
+        self.assertEqual(bridge.pending(), 0)
+
+    def test_full_queue_drops_messages(self):
+        broker, server, bridge = self.make(max_pending=5)
+        self.connect(bridge)
+        for _ in range(8):
+            broker.publish("ac/7/telemetry", telemetry())
+        self.assertEqual((bridge.pending(), bridge.stats()["dropped"]), (5, 3))
+
+    def test_commands_go_to_rooms_on_mqtt(self):
+        broker, server, bridge = self.make()
+        self.connect(bridge)
+        commands = Recorder(broker, "ac/+/commands")
+        server.queued = {"7": [{"id": 1, "room_number": "7", "command": "turn_off"}],
+                         "8": [{"id": 2, "room_number": "8", "command": "turn_on"}]}
+
+        # Queued before room 7 was heard from: sent with the reply to its first report
+        broker.publish("ac/7/telemetry", telemetry())
+        bridge.process_batch(bridge._next_batch(timeout=0))
+        self.assertEqual(commands.messages, [("ac/7/commands", {"id": 1, "room_number": "7", "command": "turn_off"})])
+
+        # Room 8 has not used MQTT - its commands stay for the HTTP command channel
+        self.assertEqual(bridge.forward_commands("8"), 0)
+        self.assertIn("8", server.queued)
+
+        broker.publish("ac/7/ack", json.dumps({"id": 1, "success": True}))
+        bridge.process_batch(bridge._next_batch(timeout=0))
+        self.assertEqual(server.acks, [("7", {"id": 1, "success": True})])
+
+    def test_worker_thread_replies(self):
+        broker, server, bridge = self.make()
+        replies = Recorder(broker, "ac/7/reply")
+        bridge.start()
+        try:
+            broker.publish("ac/7/telemetry", telemetry(ac_state="off"))
+            self.assertTrue(replies.received.wait(2))
+            self.assertEqual(replies.messages[0][1]["ac_state"], "off")
+        finally:
+            bridge.stop()
+
+
+class BridgeLockTest(unittest.TestCase):
+    def test_only_one_holder(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bridge.lock")
+            self.assertTrue(claim_bridge_lock(path))
+            # Another worker process (or a second claim) finds it taken
+            self.assertFalse(claim_bridge_lock(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+"""
+Tests for pi_input_pipeline.py, driven by a simulated pigpio
+
+Run with:
+    python -m pytest test_pi_input_pipeline.py
+"""
+import time
+import threading
+import unittest
+
+from pi_input_pipeline import (
+    InputPipeline, EdgeRing, LatencyHistogram, decode_nec, tick_diff,
+    PI_EITHER_EDGE, PI_PUD_UP, TICK_MASK
+)
+
+WINDOW_PIN = 17
+IR_PIN = 18
+POWER_CODE = 0x00FF00FF
+
+
+class FakeCallback:
+    def __init__(self, pi, gpio, func):
+        self.pi, self.gpio, self.func = pi, gpio, func
+
+    def cancel(self):
+        self.pi.callbacks.remove(self)
+
+
+class FakePi:
+    """Stand-in for pigpio.pi(): pins, pulls, callbacks and a microsecond tick"""
+
+    def __init__(self, levels=None, tick=0):
+        self.levels = dict(levels or {})
+        self.modes = {}
+        self.pulls = {}
+        self.callbacks = []
+        self.tick = tick
+
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+
+    def set_pull_up_down(self, gpio, pud):
+        self.pulls[gpio] = pud
+
+    def read(self, gpio):
+        return self.levels.get(gpio, 0)
+
+    def callback(self, gpio, edge, func):
+        assert edge == PI_EITHER_EDGE
+        callback = FakeCallback(self, gpio, func)
+        self.callbacks.append(callback)
+        return callback
+
+    def edge(self, gpio, level, after_us=0):
+        """Change a pin's level and call its callbacks, as pigpio's callback thread does"""
+        self.tick = (self.tick + after_us) & TICK_MASK
+        self.levels[gpio] = level
+        for callback in list(self.callbacks):
+            if callback.gpio == gpio:
+                callback.func(gpio, level, self.tick)
+
+    def send_nec(self, gpio, code, after_us=20000):
+        """Play an NEC frame on an active-low IR receiver output"""
+        marks_spaces = [9000, 4500]
+        for bit in range(32):
+            marks_spaces += [560, 1690 if code >> bit & 1 else 560]
+        marks_spaces.append(560)
+
+        self.edge(gpio, 0, after_us)
+        level = 0
+        for duration in marks_spaces:
+            level ^= 1
+            self.edge(gpio, level, duration)
+
+
+def nec(address, command):
+    return address | (address ^ 0xFF) << 8 | command << 16 | (command ^ 0xFF) << 24
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self.received = threading.Event()
+
+    def __call__(self, value, edge_ns):
+        self.events.append(value)
+        self.received.set()
+
+
+def make_pipeline(pi=None, **kwargs):
+    windows, commands = Recorder(), Recorder()
+    pipeline = InputPipeline(WINDOW_PIN, IR_PIN, on_window=windows, on_ir_code=commands,
+                             ir_codes={POWER_CODE: "POWER"}, **kwargs)
+    pi = pi or FakePi({WINDOW_PIN: 0, IR_PIN: 1})
+    pipeline.attach(pi)
+    return pipeline, pi, windows, commands
+
+
+class EdgeRingTest(unittest.TestCase):
+    def test_fifo_and_overflow(self):
+        ring = EdgeRing(4)
+        self.assertTrue(all(ring.push(i) for i in range(3)))
+        self.assertFalse(ring.push(3))  # One slot is kept free
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual([ring.pop(), ring.pop()], [0, 1])
+        self.assertTrue(ring.push(4))
+        self.assertEqual([ring.pop(), ring.pop(), ring.pop()], [2, 4, None])
+        self.assertEqual(len(ring), 0)
+
+
+class DecodeTest(unittest.TestCase):
+    def test_tick_wraparound(self):
+        self.assertEqual(tick_diff(TICK_MASK - 9, 10), 20)
+
+    def test_nec_frame(self):
+        pi = FakePi()
+        frames = []
+        last = [None]
+
+        def record(gpio, level, tick):
+            if last[0] is not None:
+                frames.append(tick_diff(last[0], tick))
+            last[0] = tick
+
+        pi.callback(IR_PIN, PI_EITHER_EDGE, record)
+        pi.send_nec(IR_PIN, nec(0x12, 0x34))
+        self.assertEqual(decode_nec(frames), nec(0x12, 0x34))
+
+    def test_nec_repeat_and_noise(self):
+        self.assertEqual(decode_nec([9000, 2250, 560]), "REPEAT")
+        self.assertIsNone(decode_nec([300, 300, 300]))
+
+
+class PipelineTest(unittest.TestCase):
+    def test_attach_configures_pins(self):
+        pipeline, pi, _, _ = make_pipeline()
+        self.assertEqual(pi.pulls[WINDOW_PIN], PI_PUD_UP)
+        self.assertEqual({callback.gpio for callback in pi.callbacks}, {WINDOW_PIN, IR_PIN})
+        self.assertEqual(pipeline.window_state, "closed")
+        pipeline.stop()
+        self.assertEqual(pi.callbacks, [])
+
+    def test_window_bounces_are_debounced(self):
+        pipeline, pi, windows, _ = make_pipeline()
+        for level in (1, 0, 1, 0, 1):
+            pi.edge(WINDOW_PIN, level, 1000)
+        pipeline.process_pending()
+        self.assertEqual(windows.events, [])  # Still settling
+
+        pipeline.process_pending(now_ns=time.monotonic_ns() + 60_000_000)
+        self.assertEqual(windows.events, ["opened"])
+        self.assertEqual(pipeline.stats()["window_bounces"], 2)
+
+    def test_window_glitch_is_ignored(self):
+        pipeline, pi, windows, _ = make_pipeline()
+        pi.edge(WINDOW_PIN, 1, 1000)
+        pi.edge(WINDOW_PIN, 0, 1000)
+        pipeline.process_pending(now_ns=time.monotonic_ns() + 60_000_000)
+        self.assertEqual(windows.events, [])
+        self.assertEqual(pipeline.window_state, "closed")
+
+    def test_ir_frame_across_tick_wraparound(self):
+        pipeline, pi, _, commands = make_pipeline(FakePi({WINDOW_PIN: 0, IR_PIN: 1}, tick=TICK_MASK - 30000))
+        pi.send_nec(IR_PIN, POWER_CODE)
+        pipeline.process_pending(now_ns=time.monotonic_ns() + 20_000_000)
+        self.assertEqual(commands.events, ["POWER"])
+
+    def test_back_to_back_frames_and_unknown_codes(self):
+        pipeline, pi, _, commands = make_pipeline()
+        pi.send_nec(IR_PIN, POWER_CODE)
+        pi.send_nec(IR_PIN, nec(0x01, 0x02))  # Its first edge ends the previous frame
+        pi.send_nec(IR_PIN, POWER_CODE)
+        pipeline.process_pending(now_ns=time.monotonic_ns() + 20_000_000)
+
+        stats = pipeline.stats()
+        self.assertEqual(commands.events, ["POWER", "POWER"])
+        self.assertEqual((stats["ir_frames"], stats["ir_commands"], stats["ir_unknown"]), (3, 2, 1))
+        self.assertEqual(stats["latency"]["ir_dispatch"]["count"], 2)
+
+    def test_full_ring_counts_dropped_edges(self):
+        pipeline, pi, _, _ = make_pipeline(ring_size=16)
+        pi.send_nec(IR_PIN, POWER_CODE)
+        stats = pipeline.stats()
+        self.assertEqual(stats["edges"], 15)
+        self.assertEqual(stats["dropped_edges"], 68 - 15)
+
+        pipeline.process_pending(now_ns=time.monotonic_ns() + 20_000_000)
+        self.assertEqual(pipeline.stats()["ir_undecoded"], 1)
+
+    def test_worker_thread_dispatches_without_blocking_callbacks(self):
+        pipeline, pi, windows, commands = make_pipeline()
+        slow_started = threading.Event()
+
+        def slow_window(state, edge_ns):
+            slow_started.set()
+            time.sleep(0.3)
+            windows(state, edge_ns)
+
+        pipeline.on_window = slow_window
+        pipeline.start()
+        try:
+            pi.edge(WINDOW_PIN, 1)
+            self.assertTrue(slow_started.wait(1))
+
+            # The worker is busy in the handler; callbacks must still return at once
+            started = time.perf_counter()
+            pi.send_nec(IR_PIN, POWER_CODE)
+            self.assertLess(time.perf_counter() - started, 0.05)
+
+            self.assertTrue(commands.received.wait(2))
+            self.assertEqual(windows.events, ["opened"])
+            self.assertEqual(commands.events, ["POWER"])
+            self.assertEqual(pipeline.stats()["dropped_edges"], 0)
+        finally:
+            pipeline.stop()
+
+    def test_handler_errors_are_counted(self):
+        pipeline, pi, _, _ = make_pipeline()
+
+        def broken(state, edge_ns):
+            raise ValueError("boom")
+
+        pipeline.on_window = broken
+        pi.edge(WINDOW_PIN, 1)
+        pipeline.process_pending(now_ns=time.monotonic_ns() + 60_000_000)
+        self.assertEqual(pipeline.stats()["handler_errors"], 1)
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile_ms(0.5))
+        for latency_us in [100] * 90 + [5000] * 9 + [200000]:
+            histogram.observe(latency_us * 1000)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 100)
+        self.assertEqual(snapshot["p50_ms"], 0.128)
+        self.assertEqual(snapshot["p95_ms"], 8.192)
+        self.assertEqual(snapshot["max_ms"], 200.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+"""
+Tests for pi_ir_waveforms.py, against a mock pigpio
+
+Run with:
+    python -m pytest test_pi_ir_waveforms.py
+"""
+import types
+import unittest
+from unittest import mock
+from collections import namedtuple
+
+from pi_ir_protocol import StepProtocol, FullStateProtocol, Burst, Transmission, nec_pulses
+from pi_ir_waveforms import WaveformCache, MAX_CHAIN_BYTES
+
+IR_PIN = 22
+CODES = {"POWER": 0x00FF00FF, "TEMP_UP": 0x00FF807F, "TEMP_DOWN": 0x00FF40BF, "MODE": 0x00FFC03F, "FAN": 0x00FF20DF}
+STATE = {"power": "on", "temperature": 24, "mode": "cool", "fan_speed": "auto"}
+
+
+class MockPigpioError(Exception):
+    pass
+
+
+mock_pigpio = types.SimpleNamespace(
+    pulse=namedtuple("pulse", ["gpio_on", "gpio_off", "delay"]),
+    error=MockPigpioError,
+    OUTPUT=1
+)
+
+
+class MockPi:
+    """pigpiod's wave memory: a number of wave ids and of DMA control blocks"""
+
+    def __init__(self, max_waves=250, max_cbs=25016):
+        self.max_waves = max_waves
+        self.max_cbs = max_cbs
+        self.waves = {}
+        self.building = []
+        self.last_cbs = 0
+        self.created = 0
+        self.chains = []
+
+    def set_mode(self, gpio, mode):
+        pass
+
+    def write(self, gpio, level):
+        pass
+
+    def wave_get_max_cbs(self):
+        return self.max_cbs
+
+    def wave_add_new(self):
+        self.building = []
+
+    def wave_add_generic(self, pulses):
+        self.building.extend(pulses)
+        return len(self.building)
+
+    def wave_create(self):
+        cbs = 2 * len(self.building)
+        if len(self.waves) >= self.max_waves or sum(len(w) * 2 for w in self.waves.values()) + cbs > self.max_cbs:
+            raise MockPigpioError("no memory for wave")
+        wave_id = min(set(range(self.max_waves)) - set(self.waves))
+        self.waves[wave_id] = self.building
+        self.last_cbs = cbs
+        self.created += 1
+        return wave_id
+
+    def wave_get_cbs(self):
+        return self.last_cbs
+
+    def wave_delete(self, wave_id):
+        del self.waves[wave_id]
+
+    def wave_clear(self):
+        self.waves.clear()
+
+    def wave_chain(self, chain):
+        assert len(chain) <= MAX_CHAIN_BYTES
+        self.chains.append(list(chain))
+
+    def wave_tx_busy(self):
+        return 0
+
+    def wave_tx_stop(self):
+        pass
+
+
+def played_pulses(pi, chain):
+    """Mark/space durations a chain plays, expanding loops"""
+    def durations(wave_ids):
+        result = []
+        for wave_id in wave_ids:
+            total = sum(pulse.delay for pulse in pi.waves[wave_id])
+            carrier = any(pulse.gpio_on for pulse in pi.waves[wave_id])
+            result.append(("mark" if carrier else "space", total))
+        return result
+
+    if chain[:2] == [255, 0]:
+        end = chain.index(255, 2)
+        count = chain[end + 2] + 256 * chain[end + 3]
+        return durations(chain[2:end]) * count, chain[end + 4:]
+    return durations(chain), []
+
+
+class WaveformCacheTest(unittest.TestCase):
+    def setUp(self):
+        # The mock transmits instantly; do not wait for the IR to go out
+        patcher = mock.patch("pi_ir_waveforms.time.sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make(self, pi=None, **kwargs):
+        pi = pi or MockPi()
+        return WaveformCache(pi, IR_PIN, pigpio_module=mock_pigpio, **kwargs), pi
+
+    def test_prebuilt_waves_are_reused(self):
+        cache, pi = self.make()
+        protocol = StepProtocol(CODES)
+        cache.prebuild(protocol.known_bursts(STATE))
+        built = pi.created
+
+        # NEC needs two marks, three spaces and the gap between frames
+        self.assertEqual(built, 2 + 3 + 1)
+        cache.send(protocol.plan(STATE, dict(STATE, temperature=20)))
+        cache.send(protocol.plan(STATE, dict(STATE, mode="dry")))
+        self.assertEqual(pi.created, built)
+        self.assertEqual(cache.stats()["builds"], built)
+        self.assertEqual(len(pi.chains), 2)
+
+    def test_burst_is_one_looped_chain(self):
+        cache, pi = self.make()
+        transmission = StepProtocol(CODES).plan(STATE, dict(STATE, temperature=30))
+        cache.send(transmission)
+
+        chain = pi.chains[0]
+        self.assertEqual(chain[:2], [255, 0])
+        self.assertEqual(chain[-4:], [255, 1, 6, 0])
+        played, rest = played_pulses(pi, chain)
+        self.assertEqual(rest, [])
+        self.assertEqual(len(played), 68 * 6)
+
+    def test_waveform_timing(self):
+        cache, pi = self.make()
+        pulses = nec_pulses(CODES["POWER"])
+        cache.send(Transmission([Burst("POWER", pulses, 1, 40000)], STATE))
+        played, _ = played_pulses(pi, pi.chains[0])
+
+        self.assertEqual([kind for kind, _ in played[:3]], ["mark", "space", "mark"])
+        for (kind, duration), expected in zip(played, pulses + [40000]):
+            self.assertLessEqual(abs(duration - expected), 14)  # Within half a carrier cycle
+        carrier = pi.waves[pi.chains[0][0]]
+        self.assertEqual(carrier[0].gpio_on, 1 << IR_PIN)
+        self.assertAlmostEqual(carrier[0].delay + carrier[1].delay, 26, delta=1)
+
+    def test_full_state_setpoints(self):
+        cache, pi = self.make()
+        protocol = FullStateProtocol()
+        cache.prebuild(protocol.known_bursts(STATE))
+        built = pi.created
+        self.assertLess(built, 10)  # Every setpoint shares the same few waves
+
+        cache.send(protocol.plan(STATE, dict(STATE, temperature=19)))
+        self.assertEqual(pi.created, built)
+
+    def test_least_recently_used_waves_are_evicted(self):
+        cache, pi = self.make(max_waves=8)
+        step, full_state = StepProtocol(CODES), FullStateProtocol()
+
+        # Each protocol needs six waves, so they cannot both be kept
+        for _ in range(2):
+            cache.send(step.plan(STATE, dict(STATE, temperature=25)))
+            cache.send(full_state.plan(STATE, dict(STATE, temperature=25)))
+        stats = cache.stats()
+        self.assertGreater(stats["evictions"], 0)
+        self.assertLessEqual(stats["waves"], 8)
+        self.assertEqual(len(pi.waves), stats["waves"])
+
+    def test_control_block_limit_is_respected(self):
+        cache, pi = self.make(pi=MockPi(max_cbs=3000))
+        protocol = FullStateProtocol()
+        for temperature in range(18, 31):
+            cache.send(protocol.plan(dict(STATE, temperature=17), dict(STATE, temperature=temperature)))
+        self.assertLessEqual(cache.stats()["control_blocks"], 3000)
+        self.assertEqual(len(pi.chains), 13)
+
+    def test_wave_memory_is_cleared_when_eviction_is_not_enough(self):
+        cache, pi = self.make(pi=MockPi(max_cbs=3000))
+        pi.waves[200] = [mock_pigpio.pulse(0, 0, 1)] * 1000  # A wave the cache does not know about
+        cache.send(StepProtocol(CODES).plan(STATE, dict(STATE, power="off")))
+
+        self.assertEqual(len(pi.chains), 1)
+        self.assertEqual(cache.stats()["resets"], 1)
+        self.assertNotIn(200, pi.waves)
+
+    def test_transmitters_share_spaces_but_not_marks(self):
+        cache, pi = self.make()
+        protocol = StepProtocol(CODES)
+        transmission = protocol.plan(STATE, dict(STATE, mode="dry"))
+        cache.send(transmission)
+        cache.send(transmission, gpio=IR_PIN + 1)
+
+        # A second LED only needs its own two marks
+        self.assertEqual(pi.created, 6 + 2)
+        second_led = pi.waves[pi.chains[1][2]]
+        self.assertEqual(second_led[0].gpio_on, 1 << (IR_PIN + 1))
+        self.assertEqual(pi.chains[0][3], pi.chains[1][3])  # The same header space wave
+
+    def test_long_transmissions_are_split_into_chains(self):
+        cache, pi = self.make()
+        burst = StepProtocol(CODES)._burst("MODE", 2)
+        cache.send(Transmission([burst] * 10, STATE))
+        self.assertGreater(len(pi.chains), 1)
+        self.assertEqual(sum(chain.count(255) // 2 for chain in pi.chains), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Tests for pi_room.py, without pigpio or a server
+
+Run with:
+    python -m pytest test_pi_room.py
+"""
+import asyncio
+import unittest
+
+from pi_async_runtime import AsyncRuntime
+from pi_ir_protocol import StepProtocol
+from pi_room import Room, RoomLink, REPORT_RETRY_INTERVAL
+
+CODES = {"POWER": 0x00FF00FF, "TEMP_UP": 0x00FF807F, "TEMP_DOWN": 0x00FF40BF, "MODE": 0x00FFC03F, "FAN": 0x00FF20DF}
+
+
+def make_room(room_number="7"):
+    return Room(room_number, 17, 18, 22, protocol=StepProtocol(CODES), post_event=lambda kind, data: None)
+
+
+class FakePolicyCache:
+    """Decides every command with a fixed decision"""
+
+    def __init__(self, decision):
+        self.decision = decision
+
+    def decide(self, room_number, command, **state):
+        return dict(self.decision)
+
+    def is_stale(self, room_number, server_version):
+        return False
+
+
+class FakeQueue(list):
+    def enqueue(self, report, recorded_at=None):
+        self.append(report)
+
+
+class RoomTest(unittest.TestCase):
+    def test_report_due(self):
+        room = make_room()
+        self.assertEqual(room.report_due(0, 0.5, 300), "startup")
+
+        room.record_report(room.report(), ok=True)
+        now = room.last_report["at"]
+        self.assertIsNone(room.report_due(now + 10, 0.5, 300))
+        self.assertEqual(room.report_due(now + 300, 0.5, 300), "heartbeat")
+
+        room.status["temperature"] += 0.5
+        self.assertEqual(room.report_due(now + 10, 0.5, 300), "temperature change")
+
+        room.status["window_state"] = "opened"
+        self.assertEqual(room.report_due(now + 10, 0.5, 300), "window change")
+
+    def test_failed_report_waits_for_retry(self):
+        room = make_room()
+        room.record_report(room.report(), ok=False)
+        now = room.last_report["at"]
+        self.assertIsNone(room.report_due(now + 10, 0.5, 300))
+        self.assertEqual(room.report_due(now + REPORT_RETRY_INTERVAL, 0.5, 300), "retry")
+
+    def test_device_commands(self):
+        room = make_room()
+        room.execute_device_command("set_temp_20")
+        self.assertEqual(room.ac_state["temperature"], 24)  # The AC is off
+
+        room.execute_device_command("turn_on")
+        room.execute_device_command("set_temp_20")
+        self.assertEqual((room.ac_state["power"], room.ac_state["temperature"]), ("on", 20))
+        self.assertEqual(room.status["ac_state"], "on")
+        with self.assertRaises(ValueError):
+            room.execute_device_command("reboot")
+
+
+class RoomLinkTest(unittest.TestCase):
+    def handle(self, decision, code, room=None):
+        """Handle an IR code with a local decision; returns (allowed, link)"""
+        runtime = AsyncRuntime(io_workers=1)
+        room = room or make_room()
+        link = RoomLink([room], runtime, session=None, policy_cache=FakePolicyCache(decision),
+                        offline_queue=FakeQueue(), server_url=lambda: "http://127.0.0.1:1")
+        # The server cannot be reached: the decision is queued instead
+        link.request_ir_command = lambda *args: None
+        result = {}
+
+        async def job():
+            result["allowed"] = await link.handle_ir_command(room, code)
+            await asyncio.sleep(0.05)  # Let the background report finish
+            runtime.stop()
+
+        asyncio.run(runtime.run(job()))
+        return result["allowed"], link
+
+    def test_allowed_command_runs_and_is_queued_when_offline(self):
+        room = make_room()
+        room.set_ac_state(power="on")
+        allowed, link = self.handle({"allowed": True, "policy_version": "v1"}, "TEMP_UP", room)
+
+        self.assertTrue(allowed)
+        self.assertEqual(room.ac_state["temperature"], 25)
+        self.assertEqual(len(link.offline_queue), 1)
+        self.assertEqual(link.offline_queue[0]["decision"], "allowed")
+        self.assertEqual(link.offline_queue[0]["ac_state"], "on")  # The state before the command
+
+    def test_blocked_command_applies_the_alternative(self):
+        room = make_room()
+        room.set_ac_state(power="on")
+        decision = {"allowed": False, "reason": "Too cold", "alternative_action": "SET_TEMP_22"}
+        allowed, link = self.handle(decision, "TEMP_DOWN", room)
+
+        self.assertFalse(allowed)
+        self.assertEqual(room.ac_state["temperature"], 22)
+        self.assertEqual(link.offline_queue[0]["decision"], "blocked")
+
+
+if __name__ == "__main__":
+    unittest.main()
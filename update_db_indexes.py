@@ -0,0 +1,44 @@
+"""
+Database migration script to add indexes for time range queries on large event tables
+"""
+import os
+import sys
+import sqlite3
+
+# Get the database path
+DB_PATH = "instance/ac_control.db"
+
+# (index name, table, columns) - keep in sync with __table_args__ in models.py
+INDEXES = [
+    ("ix_window_event_room_timestamp", "window_event", "room_number, timestamp"),
+    ("ix_window_event_timestamp_id", "window_event", "timestamp, id"),
+]
+
+def update_database():
+    """Create any missing indexes"""
+    if not os.path.exists(DB_PATH):
+        print(f"Error: Database file {DB_PATH} not found")
+        sys.exit(1)
+        
+    print(f"Updating database at {DB_PATH}")
+    
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    try:
+        for name, table, columns in INDEXES:
+            print(f"Creating index {name} on {table} ({columns})")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        
+        conn.commit()
+        print("Database indexes updated successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error updating database: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    update_database()
@@ -35,6 +35,7 @@ def update_database():
         add_column_if_not_exists(cursor, "ac_settings", "window_open_minutes", "INTEGER DEFAULT 0")
         add_column_if_not_exists(cursor, "ac_settings", "temperature_deviation", "REAL DEFAULT 0.0")
         add_column_if_not_exists(cursor, "ac_settings", "compliance_score", "REAL DEFAULT 100.0")
+        add_column_if_not_exists(cursor, "ac_settings", "power_rating_kw", "REAL")
         
         # Create new tables if they don't exist
         
@@ -69,6 +70,67 @@ def update_database():
         )
         """)
         
+        # RoomDailyUsage table (analytics aggregates)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS room_daily_usage (
+            id INTEGER PRIMARY KEY,
+            room_number TEXT,
+            floor TEXT,
+            day DATE NOT NULL,
+            ac_on_seconds REAL DEFAULT 0.0,
+            window_open_seconds REAL DEFAULT 0.0,
+            window_open_ac_on_seconds REAL DEFAULT 0.0,
+            energy_kwh REAL DEFAULT 0.0,
+            updated_at TIMESTAMP,
+            CONSTRAINT uq_room_daily_usage_room_day UNIQUE (room_number, day),
+            FOREIGN KEY (room_number) REFERENCES user (room_number)
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_room_daily_usage_day ON room_daily_usage (day)")
+        
+        # DeviceToken table (API tokens for Raspberry Pi clients)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS device_token (
+            id INTEGER PRIMARY KEY,
+            room_number TEXT,
+            label TEXT,
+            token_prefix TEXT,
+            token_hash TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP,
+            last_used_at TIMESTAMP,
+            revoked BOOLEAN DEFAULT 0,
+            FOREIGN KEY (room_number) REFERENCES user (room_number)
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_device_token_room_number ON device_token (room_number)")
+        
+        # Offline queue backfill watermarks
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS device_report_stream (
+            id INTEGER PRIMARY KEY,
+            room_number TEXT NOT NULL,
+            stream_id TEXT NOT NULL,
+            last_seq INTEGER DEFAULT 0,
+            last_recorded_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (room_number) REFERENCES user (room_number),
+            CONSTRAINT uq_device_report_stream UNIQUE (room_number, stream_id)
+        )
+        """)
+        
+        # Sensor anomaly tracking (after the tables above are known to exist)
+        add_column_if_not_exists(cursor, "room_status", "anomaly_flags", "VARCHAR(100)")
+        add_column_if_not_exists(cursor, "room_status", "anomaly_since", "TIMESTAMP")
+        add_column_if_not_exists(cursor, "room_status", "quarantined", "BOOLEAN DEFAULT 0")
+        add_column_if_not_exists(cursor, "global_policy", "quarantine_noisy_rooms", "BOOLEAN DEFAULT 0")
+        
+        # Raspberry Pi reporting cadence
+        add_column_if_not_exists(cursor, "global_policy", "report_temperature_delta", "FLOAT DEFAULT 0.5")
+        add_column_if_not_exists(cursor, "global_policy", "report_heartbeat_seconds", "INTEGER DEFAULT 300")
+        
+        # Gateway tokens (one Raspberry Pi managing several rooms)
+        add_column_if_not_exists(cursor, "device_token", "gateway_rooms", "TEXT")
+        
         # Insert default GlobalPolicy if none exists
         cursor.execute("SELECT COUNT(*) FROM global_policy")
         if cursor.fetchone()[0] == 0:
@@ -0,0 +1,100 @@
+"""
+Database migration script to create the state interval table and backfill it from event history
+"""
+import os
+import sys
+import sqlite3
+
+# Get the database path
+DB_PATH = "instance/ac_control.db"
+
+# Interval kind -> (window_event column, value meaning the state is active)
+INTERVAL_KINDS = {
+    'ac_on': ('ac_state', 'on'),
+    'window_open': ('window_state', 'opened'),
+}
+
+def update_database():
+    """Create the state_interval table and rebuild intervals from window events"""
+    if not os.path.exists(DB_PATH):
+        print(f"Error: Database file {DB_PATH} not found")
+        sys.exit(1)
+
+    print(f"Updating database at {DB_PATH}")
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS state_interval (
+                id INTEGER PRIMARY KEY,
+                room_number VARCHAR(10) REFERENCES user (room_number),
+                kind VARCHAR(20),
+                start DATETIME NOT NULL,
+                "end" DATETIME
+            )
+        """)
+        cursor.execute('CREATE INDEX IF NOT EXISTS ix_state_interval_room_kind_start ON state_interval (room_number, kind, start)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS ix_state_interval_room_kind_end ON state_interval (room_number, kind, "end")')
+
+        cursor.execute("SELECT COUNT(*) FROM state_interval")
+        if cursor.fetchone()[0] > 0:
+            print("state_interval already populated, skipping backfill")
+        else:
+            backfill_intervals(conn)
+
+        conn.commit()
+        print("Database updated successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error updating database: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+def backfill_intervals(conn):
+    """Replay window events in time order, opening and closing intervals as states change"""
+    reader = conn.cursor()
+    writer = conn.cursor()
+
+    reader.execute("""
+        SELECT room_number, timestamp, ac_state, window_state
+        FROM window_event
+        WHERE room_number IS NOT NULL AND timestamp IS NOT NULL
+        ORDER BY room_number, timestamp, id
+    """)
+
+    open_since = {}  # (room, kind) -> start of the ongoing interval
+    last_seen = {}  # room -> timestamp of its latest event
+    rows = []
+
+    for room_number, timestamp, ac_state, window_state in reader:
+        last_seen[room_number] = timestamp
+        states = {'ac_state': ac_state, 'window_state': window_state}
+        for kind, (column, active_value) in INTERVAL_KINDS.items():
+            key = (room_number, kind)
+            active = states[column] == active_value
+            if active and key not in open_since:
+                open_since[key] = timestamp
+            elif not active and key in open_since:
+                rows.append((room_number, kind, open_since.pop(key), timestamp))
+
+    # Still active at the end of the history: leave open only if the room is still in
+    # that state, otherwise close it at the room's last event
+    writer.execute("SELECT room_number, ac_state, window_state FROM room_status")
+    current = {room: {'ac_state': ac, 'window_state': window} for room, ac, window in writer.fetchall()}
+    for (room_number, kind), start in open_since.items():
+        column, active_value = INTERVAL_KINDS[kind]
+        still_active = current.get(room_number, {}).get(column) == active_value
+        rows.append((room_number, kind, start, None if still_active else last_seen[room_number]))
+
+    writer.executemany(
+        'INSERT INTO state_interval (room_number, kind, start, "end") VALUES (?, ?, ?, ?)',
+        rows
+    )
+    print(f"Backfilled {len(rows)} state intervals")
+
+if __name__ == "__main__":
+    update_database()
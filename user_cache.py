@@ -0,0 +1,124 @@
+"""
+Cache of logged-in user principals for Flask-Login.
+
+Flask-Login loads the user on every authenticated request, including every
+dashboard poll. Instead of querying the user table each time, load_user is
+served from a bounded LRU cache of lightweight principals (no password or
+PIN hashes) that expire after a short TTL. Any insert, update or delete of a
+User evicts its entry, both when flushed and again once the transaction
+commits, so registration, password/PIN changes and admin edits are seen on
+the next request.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Most principals kept in memory
+MAX_ENTRIES = 2048
+
+# Seconds a principal is trusted before it is reloaded from the database
+TTL_SECONDS = 60
+
+
+class UserPrincipal(UserMixin):
+    """Read-only snapshot of the User fields requests need"""
+
+    __slots__ = ('id', 'username', 'email', 'room_number', 'is_admin')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.room_number = user.room_number
+        self.is_admin = bool(user.is_admin)
+
+    def __repr__(self):
+        return f"<UserPrincipal {self.id} {self.username}>"
+
+
+class PrincipalCache:
+    """Thread-safe LRU cache of principals with a per-entry TTL"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user id -> (principal, expiry)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, loader):
+        """
+        Return the principal for a user id, loading it on a miss
+
+        Args:
+            user_id (int): User id from the session
+            loader (callable): Returns the User for an id, or None
+
+        Returns:
+            UserPrincipal: The principal, or None if the user does not exist
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        user = loader(user_id)
+        if user is None:
+            return None
+
+        principal = UserPrincipal(user)
+        with self._lock:
+            self._entries[user_id] = (principal, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def _register_invalidation():
+    from models import User
+
+    def evict(mapper, connection, target):
+        if target.id is not None:
+            principal_cache.invalidate(target.id)
+            # Evict again after commit, in case another request reloaded the old row meanwhile
+            session = Session.object_session(target)
+            if session is not None:
+                session.info.setdefault('user_cache_evict', set()).add(target.id)
+
+    for mapper_event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(User, mapper_event, evict)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_committed(session):
+    for user_id in session.info.pop('user_cache_evict', ()):
+        principal_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_evictions(session):
+    session.info.pop('user_cache_evict', None)
+
+
+_register_invalidation()